@@ -1,39 +1,121 @@
 ### Write code for the new module here and import it from agent.py.
 from uagents import Agent, Context
 from invoice_models import PDFRequest, PDFResponse
+import asyncio
 import httpx
 from invoice_agent import InvoiceExtractor
+from telemetry import EN_VUELO, PROFUNDIDAD_COLA, configurar_trazas, extraer_contexto, inyectar_contexto, servir_metricas, span
 from dotenv import load_dotenv
 import os
 load_dotenv()
 WEBHOOK_URL = os.getenv('WEBHOOK_URL')
 ASI1_API_KEY = os.getenv('ASI1_API_KEY')
-extractor = InvoiceExtractor(api_key=ASI1_API_KEY) 
+# Facturas que el agente procesa a la vez y mensajes que pueden esperar turno antes de rechazarse
+AGENT_WORKERS = int(os.getenv('AGENT_WORKERS', '8'))
+AGENT_MAX_PENDIENTES = int(os.getenv('AGENT_MAX_PENDIENTES', '64'))
+# Puerto del /metrics del agente (bandeja, facturas en proceso y llamadas a ASI1); 0 lo desactiva
+AGENT_METRICS_PORT = int(os.getenv('AGENT_METRICS_PORT', '0'))
+extractor = InvoiceExtractor(api_key=ASI1_API_KEY)
+configurar_trazas("fr8-invoice-agent")
+servir_metricas(AGENT_METRICS_PORT)
 agent = Agent(
     name="agent_1",
     seed="seed_1"
 )
-@agent.on_message(model=PDFRequest, replies=PDFResponse)
-async def proxy_handler(ctx: Context, sender: str, msg: PDFRequest):
-    ctx.logger.info(f"Recibido texto de {msg.path}, procesando con InvoiceExtractor")
-    try:
+# uagents entrega los mensajes de uno en uno: el handler solo los deja en la bandeja
+# y los workers los procesan en paralelo, asi una llamada lenta a ASI1 no frena a las demas
+bandeja: asyncio.Queue = asyncio.Queue(maxsize=AGENT_MAX_PENDIENTES)
+PROFUNDIDAD_COLA.labels("bandeja").set_function(bandeja.qsize)
+workers: list[asyncio.Task] = []
+en_proceso = 0
+# Un solo cliente HTTP (con pool de conexiones) para todas las respuestas al webhook
+cliente_webhook = None
+
+async def enviar_webhook(ctx: Context, payload: dict):
+    response = await cliente_webhook.post(WEBHOOK_URL, json=payload, headers=inyectar_contexto())
+    ctx.logger.info(f"Respuesta manual enviada a {WEBHOOK_URL}: {response.status_code}")
+
+async def procesar_mensaje(ctx: Context, sender: str, msg: PDFRequest):
+    # El span continua la traza del upload; su contexto viaja al webhook en el header traceparent
+    contexto = extraer_contexto({"traceparent": msg.traceparent}) if msg.traceparent else None
+    with span("agent.proxy_handler", contexto, **{"invoice.request_id": msg.request_id}):
         # Obtener el texto del mensaje
         texto = msg.content
-        resultados_response, errores_response = extractor.extraer_datos(texto)
+        # Llamada asincrona: los demas workers siguen procesando mientras ASI1 responde
+        resultados_response, errores_response = await extractor.extraer_datos_async(texto)
         resultado = resultados_response
         errores = errores_response
         ctx.logger.info(f"Sender {sender}")
         # Enviar respuesta manualmente al webhook
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                WEBHOOK_URL,
-                json={"status": "received", "resultado": resultado, "errores": errores}
-            )
-            ctx.logger.info(f"Respuesta manual enviada a {WEBHOOK_URL}: {response.status_code}")
-        #await ctx.send(sender, PDFResponse(resultado=resultado, errores=errores))
-    except Exception as e:
-        ctx.logger.error(f"Error al procesar texto: {str(e)}")
-        #await ctx.send(sender, PDFResponse(resultado={}, errores={"error": str(e)}))
+        await enviar_webhook(ctx, {
+            "status": "received",
+            "request_id": msg.request_id,
+            "resultado": resultado,
+            "errores": errores
+        })
+    #await ctx.send(sender, PDFResponse(resultado=resultado, errores=errores))
+
+async def worker_extraccion():
+    global en_proceso
+    while True:
+        # Cada mensaje trae el ctx de su handler: logs y estado corresponden a ese mensaje
+        ctx, sender, msg = await bandeja.get()
+        en_proceso += 1
+        EN_VUELO.inc()
+        try:
+            await procesar_mensaje(ctx, sender, msg)
+        except Exception as e:
+            ctx.logger.error(f"Error al procesar texto: {str(e)}")
+            # Avisar a la API para que el upload no espere hasta su timeout
+            try:
+                await enviar_webhook(ctx, {"status": "error", "request_id": msg.request_id, "message": str(e)})
+            except Exception as error:
+                ctx.logger.error(f"Error al avisar al webhook: {str(error)}")
+            #await ctx.send(sender, PDFResponse(resultado={}, errores={"error": str(e)}))
+        finally:
+            en_proceso -= 1
+            EN_VUELO.dec()
+            bandeja.task_done()
+
+@agent.on_event("startup")
+async def iniciar_workers(ctx: Context):
+    global cliente_webhook
+    cliente_webhook = httpx.AsyncClient(timeout=30.0, limits=httpx.Limits(max_connections=AGENT_WORKERS))
+    for _ in range(AGENT_WORKERS):
+        workers.append(asyncio.create_task(worker_extraccion()))
+    ctx.logger.info(f"{AGENT_WORKERS} workers de extraccion, bandeja de {AGENT_MAX_PENDIENTES} mensajes")
+
+@agent.on_event("shutdown")
+async def detener_workers(ctx: Context):
+    for tarea in workers:
+        tarea.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    workers.clear()
+    if cliente_webhook is not None:
+        await cliente_webhook.aclose()
+
+@agent.on_message(model=PDFRequest, replies=PDFResponse)
+async def proxy_handler(ctx: Context, sender: str, msg: PDFRequest):
+    ctx.logger.info(f"Recibido texto de {msg.path} (request_id={msg.request_id}), en cola para InvoiceExtractor")
+    try:
+        bandeja.put_nowait((ctx, sender, msg))
+    except asyncio.QueueFull:
+        # Bandeja llena: se rechaza de inmediato en lugar de acumular trabajo sin limite
+        ctx.logger.warning(f"Bandeja llena ({bandeja.qsize()} mensajes), se rechaza request_id={msg.request_id}")
+        try:
+            await enviar_webhook(ctx, {
+                "status": "error",
+                "request_id": msg.request_id,
+                "message": f"Agente saturado: {bandeja.qsize()} facturas en espera"
+            })
+        except Exception as e:
+            ctx.logger.error(f"Error al avisar al webhook: {str(e)}")
+
+@agent.on_interval(period=60.0)
+async def reportar_carga(ctx: Context):
+    # Facturas en proceso y en espera, visibles en el log del agente en Agentverse
+    if en_proceso or not bandeja.empty():
+        ctx.logger.info(f"Facturas en proceso: {en_proceso}/{AGENT_WORKERS}, en bandeja: {bandeja.qsize()}/{AGENT_MAX_PENDIENTES}")
 
 if __name__ == "__main__":
-    agent.run()
\ No newline at end of file
+    agent.run()
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+import threading
+import weakref
+import httpx
+
+try:
+    import h2  # noqa: F401  (necesario para HTTP/2 en httpx)
+    HTTP2_DISPONIBLE = True
+except ImportError:
+    HTTP2_DISPONIBLE = False
+
+
+def max_tokens_respuesta():
+    """
+    Tokens maximos de la respuesta del modelo por factura (ASI1_MAX_TOKENS, por defecto 1024).
+
+    Se lee aqui y no en InvoiceExtractor para que la API y la copia de
+    Agentverse (que no importa os en invoice_agent.py) usen la misma configuracion.
+    """
+    return int(os.getenv("ASI1_MAX_TOKENS", "1024"))
+
+
+class ASI1Client:
+    def __init__(self, api_url, headers, timeout=None, max_connections=None, max_keepalive=None, http2=None):
+        """
+        Cliente HTTP asincrono y compartido para la API de ASI1.
+
+        Reutiliza un httpx.AsyncClient con keep-alive (y HTTP/2 si h2 esta
+        instalado) por event loop, de modo que las facturas no pagan un
+        handshake TLS en cada llamada.
+
+        Args:
+            api_url (str): URL del endpoint de chat completions
+            headers (dict): Headers de autenticacion
+            timeout (float): Timeout por peticion en segundos (ASI1_TIMEOUT, por defecto 30)
+            max_connections (int): Conexiones maximas del pool (ASI1_MAX_CONNECTIONS, por defecto 20)
+            max_keepalive (int): Conexiones ociosas conservadas (ASI1_MAX_KEEPALIVE, por defecto 10)
+            http2 (bool): Usar HTTP/2 (ASI1_HTTP2, por defecto si h2 esta instalado)
+        """
+        self.api_url = api_url
+        self.headers = headers
+        self.timeout = timeout or float(os.getenv("ASI1_TIMEOUT", "30"))
+        self.limits = httpx.Limits(
+            max_connections=max_connections or int(os.getenv("ASI1_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=max_keepalive or int(os.getenv("ASI1_MAX_KEEPALIVE", "10"))
+        )
+        if http2 is None:
+            http2 = os.getenv("ASI1_HTTP2", "1") == "1"
+        self.http2 = http2 and HTTP2_DISPONIBLE
+        # Las conexiones de httpx quedan ligadas al loop que las creo
+        self._clientes = weakref.WeakKeyDictionary()
+
+    def _get_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clientes.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2
+            )
+            self._clientes[loop] = client
+        return client
+
+    async def post(self, payload):
+        """
+        Envia el payload al endpoint de ASI1.
+
+        Args:
+            payload (dict): Cuerpo JSON de la peticion
+
+        Returns:
+            httpx.Response: Respuesta con status 2xx
+
+        Raises:
+            httpx.HTTPStatusError: Si la API responde con un status de error
+            httpx.RequestError: Si falla la conexion o se agota el timeout
+        """
+        response = await self._get_client().post(self.api_url, json=payload)
+        response.raise_for_status()
+        return response
+
+    async def post_stream(self, payload, al_recibir=None):
+        """
+        Envia el payload con "stream": true y lee los eventos SSE de la respuesta.
+
+        Args:
+            payload (dict): Cuerpo JSON de la peticion
+            al_recibir (callable): Recibe cada fragmento de contenido; si devuelve
+                True se deja de leer y se cierra la conexion sin esperar el resto
+
+        Returns:
+            str: Contenido recibido hasta el final del stream o hasta el corte
+
+        Raises:
+            httpx.HTTPStatusError: Si la API responde con un status de error
+            httpx.RequestError: Si falla la conexion o se agota el timeout
+        """
+        async with self._get_client().stream("POST", self.api_url, json=payload) as response:
+            if response.is_error:
+                # El cuerpo se lee para que el error lleve el mensaje del servidor
+                await response.aread()
+            response.raise_for_status()
+            if "text/event-stream" not in response.headers.get("content-type", ""):
+                # El servidor ignoro "stream" y respondio el JSON completo
+                await response.aread()
+                choices = response.json().get("choices") or [{}]
+                return choices[0].get("message", {}).get("content") or ""
+
+            partes = []
+            async for linea in response.aiter_lines():
+                if not linea.startswith("data:"):
+                    continue
+                datos = linea[5:].strip()
+                if datos == "[DONE]":
+                    break
+                try:
+                    choices = json.loads(datos).get("choices") or [{}]
+                except json.JSONDecodeError:
+                    continue
+                fragmento = choices[0].get("delta", {}).get("content")
+                if not fragmento:
+                    continue
+                partes.append(fragmento)
+                if al_recibir is not None and al_recibir(fragmento):
+                    break
+            return "".join(partes)
+
+    def run_sync(self, coro):
+        """
+        Ejecuta una corrutina en el loop de fondo compartido y espera su resultado.
+
+        Permite que los scripts sincronos usen el mismo pool de conexiones,
+        incluso desde varios hilos a la vez.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, _loop_de_fondo()).result()
+
+    async def cerrar(self):
+        """Cierra el cliente del loop actual."""
+        client = self._clientes.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _loop_de_fondo():
+    # Loop en un hilo daemon para atender las llamadas sincronas
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="asi1-client", daemon=True).start()
+    return _loop
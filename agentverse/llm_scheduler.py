@@ -0,0 +1,248 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import httpx
+from telemetry import REINTENTOS_LLM
+
+
+class CircuitoAbiertoError(Exception):
+    """Se lanza sin llamar a la API mientras el circuito hacia ASI1 esta abierto."""
+
+
+class TokenBucket:
+    def __init__(self, por_minuto, capacidad=None):
+        """
+        Token bucket con reserva anticipada.
+
+        Cada reserva descuenta sus tokens aunque el saldo quede negativo y
+        devuelve cuanto esperar hasta que el saldo la cubra; asi las llamadas
+        se espacian en orden de llegada sin un lock de asyncio (las reservas
+        pueden venir de loops distintos).
+
+        Args:
+            por_minuto (float): Tokens repuestos por minuto
+            capacidad (float): Rafaga maxima (por defecto, por_minuto)
+        """
+        self.tasa = por_minuto / 60.0
+        self.capacidad = capacidad or por_minuto
+        self.tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reservar(self, n=1):
+        """
+        Reserva n tokens.
+
+        Returns:
+            float: Segundos a esperar antes de usar los tokens reservados
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            self.tokens = min(self.capacidad, self.tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            self.tokens -= min(n, self.capacidad)
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.tasa
+
+
+class CircuitBreaker:
+    def __init__(self, umbral=5, tiempo_abierto=30.0):
+        """
+        Circuit breaker de tres estados (cerrado, abierto, semiabierto).
+
+        Args:
+            umbral (int): Fallos consecutivos que abren el circuito
+            tiempo_abierto (float): Segundos antes de dejar pasar una llamada de prueba
+        """
+        self.umbral = umbral
+        self.tiempo_abierto = tiempo_abierto
+        self.fallos = 0
+        self.abierto_desde = None
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self):
+        if self.abierto_desde is None:
+            return "cerrado"
+        if time.monotonic() - self.abierto_desde >= self.tiempo_abierto:
+            return "semiabierto"
+        return "abierto"
+
+    def permitir(self):
+        """
+        Raises:
+            CircuitoAbiertoError: Si el circuito esta abierto o ya hay una llamada de prueba
+        """
+        with self._lock:
+            estado = self.estado
+            if estado == "cerrado":
+                return
+            if estado == "semiabierto" and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return
+            raise CircuitoAbiertoError("ASI1 no disponible: circuito abierto tras fallos consecutivos")
+
+    def exito(self):
+        with self._lock:
+            self.fallos = 0
+            self.abierto_desde = None
+            self._prueba_en_curso = False
+
+    def liberar_prueba(self):
+        # La llamada de prueba termino sin veredicto (p. ej. se cancelo)
+        with self._lock:
+            self._prueba_en_curso = False
+
+    def fallo(self):
+        with self._lock:
+            self.fallos += 1
+            self._prueba_en_curso = False
+            if self.fallos >= self.umbral:
+                self.abierto_desde = time.monotonic()
+
+
+def _leer_retry_after(response):
+    # Retry-After puede venir en segundos o como fecha HTTP
+    valor = response.headers.get("Retry-After")
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMScheduler:
+    def __init__(self, rpm=None, tpm=None, max_reintentos=None, backoff_base=None, backoff_max=None,
+                 umbral_circuito=None, tiempo_circuito=None, retry_after_max=None):
+        """
+        Planificador central de llamadas salientes al LLM.
+
+        Limita peticiones y tokens por minuto, reintenta 429/5xx/timeouts con
+        backoff exponencial con jitter (respetando Retry-After) y corta las
+        llamadas mientras el proveedor esta caido.
+
+        Args:
+            rpm (float): Peticiones por minuto (ASI1_RPM, por defecto 60)
+            tpm (float): Tokens por minuto (ASI1_TPM, por defecto 100000)
+            max_reintentos (int): Reintentos por llamada (ASI1_MAX_REINTENTOS, por defecto 4)
+            backoff_base (float): Espera base en segundos (ASI1_BACKOFF_BASE, por defecto 1)
+            backoff_max (float): Espera maxima en segundos (ASI1_BACKOFF_MAX, por defecto 30)
+            umbral_circuito (int): Fallos consecutivos que abren el circuito (ASI1_CIRCUIT_UMBRAL, por defecto 5)
+            tiempo_circuito (float): Segundos con el circuito abierto (ASI1_CIRCUIT_TIMEOUT, por defecto 30)
+            retry_after_max (float): Retry-After maximo que se espera; si el servidor pide mas,
+                la llamada falla de inmediato (ASI1_RETRY_AFTER_MAX, por defecto 120)
+        """
+        self.rpm = TokenBucket(rpm or float(os.getenv("ASI1_RPM", "60")))
+        self.tpm = TokenBucket(tpm or float(os.getenv("ASI1_TPM", "100000")))
+        self.max_reintentos = max_reintentos if max_reintentos is not None else int(os.getenv("ASI1_MAX_REINTENTOS", "4"))
+        self.backoff_base = backoff_base or float(os.getenv("ASI1_BACKOFF_BASE", "1"))
+        self.backoff_max = backoff_max or float(os.getenv("ASI1_BACKOFF_MAX", "30"))
+        self.retry_after_max = retry_after_max or float(os.getenv("ASI1_RETRY_AFTER_MAX", "120"))
+        self.circuito = CircuitBreaker(
+            umbral_circuito or int(os.getenv("ASI1_CIRCUIT_UMBRAL", "5")),
+            tiempo_circuito or float(os.getenv("ASI1_CIRCUIT_TIMEOUT", "30"))
+        )
+
+    def calcular_espera(self, intento, retry_after=None):
+        """
+        Backoff exponencial con jitter completo; Retry-After actua como minimo y
+        se respeta completo, aunque supere backoff_max.
+
+        Args:
+            intento (int): Numero de reintento, empezando en 0
+            retry_after (float): Segundos indicados por el servidor, si los hay
+
+        Returns:
+            float: Segundos a esperar
+        """
+        espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** intento))
+        if retry_after is not None:
+            espera = max(espera, retry_after)
+        return espera
+
+    async def ejecutar(self, llamada, tokens_estimados=1):
+        """
+        Ejecuta una llamada al LLM respetando los limites y reintentando errores transitorios.
+
+        Args:
+            llamada (callable): Funcion sin argumentos que devuelve la corrutina de la peticion
+            tokens_estimados (int): Tokens de entrada y salida estimados de la peticion
+
+        Returns:
+            El resultado de la llamada
+
+        Raises:
+            CircuitoAbiertoError: Si el proveedor esta marcado como caido
+            httpx.HTTPStatusError: Si el error no es reintentable, se agotan los reintentos
+                o el Retry-After supera retry_after_max
+            httpx.TransportError: Si persisten los errores de red o timeouts
+        """
+        intento = 0
+        while True:
+            self.circuito.permitir()
+            espera = max(self.rpm.reservar(1), self.tpm.reservar(tokens_estimados))
+            if espera > 0:
+                await asyncio.sleep(espera)
+            try:
+                resultado = await llamada()
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                if status != 429 and status < 500:
+                    self.circuito.exito()
+                    raise
+                # Un 429 es limite de tasa, no caida del proveedor
+                if status >= 500:
+                    self.circuito.fallo()
+                else:
+                    self.circuito.exito()
+                if intento >= self.max_reintentos:
+                    raise
+                retry_after = _leer_retry_after(e.response)
+                if retry_after is not None and retry_after > self.retry_after_max:
+                    # Reintentar antes solo gastaria reintentos en mas 429
+                    print(f"ASI1 pide esperar {retry_after:.0f} s (maximo {self.retry_after_max:.0f} s), no se reintenta")
+                    raise
+                motivo = "429" if status == 429 else "5xx"
+            except httpx.TransportError:
+                self.circuito.fallo()
+                if intento >= self.max_reintentos:
+                    raise
+                retry_after = None
+                motivo = "red"
+            except BaseException:
+                self.circuito.liberar_prueba()
+                raise
+            else:
+                self.circuito.exito()
+                return resultado
+
+            espera = self.calcular_espera(intento, retry_after)
+            print(f"Llamada a ASI1 fallida (intento {intento + 1}), reintentando en {espera:.1f} s")
+            REINTENTOS_LLM.labels(motivo).inc()
+            await asyncio.sleep(espera)
+            intento += 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def obtener_scheduler():
+    """
+    Devuelve el planificador compartido por todos los extractores del proceso.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+    return _scheduler
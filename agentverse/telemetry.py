@@ -0,0 +1,203 @@
+import contextlib
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    PROMETHEUS_DISPONIBLE = True
+except ImportError:
+    PROMETHEUS_DISPONIBLE = False
+
+try:
+    from opentelemetry import propagate, trace
+    OTEL_DISPONIBLE = True
+except ImportError:
+    OTEL_DISPONIBLE = False
+
+# Segundos: desde lecturas de PDF de milisegundos hasta la espera maxima del agente (300 s)
+BUCKETS_SEGUNDOS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class _MetricaNula:
+    """Metrica sin efecto para cuando prometheus_client no esta instalado."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, valor):
+        pass
+
+    def inc(self, valor=1):
+        pass
+
+    def dec(self, valor=1):
+        pass
+
+    def set(self, valor):
+        pass
+
+    def set_function(self, funcion):
+        pass
+
+
+def _metrica(tipo, nombre, descripcion, etiquetas=(), **kwargs):
+    if not PROMETHEUS_DISPONIBLE:
+        return _MetricaNula()
+    return getattr(prometheus_client, tipo)(nombre, descripcion, etiquetas, **kwargs)
+
+
+DURACION_ETAPA = _metrica(
+    "Histogram", "invoice_stage_seconds",
+    "Duracion de cada etapa del procesamiento de una factura (cfdi, pdf, agente, total)",
+    ("etapa",), buckets=BUCKETS_SEGUNDOS
+)
+LATENCIA_LLM = _metrica(
+    "Histogram", "invoice_llm_latency_seconds",
+    "Latencia de las llamadas a ASI1, incluidos los reintentos del planificador",
+    ("resultado",), buckets=BUCKETS_SEGUNDOS
+)
+REINTENTOS_LLM = _metrica(
+    "Counter", "invoice_llm_retries_total",
+    "Reintentos de llamadas a ASI1 por motivo (429, 5xx, red, json)",
+    ("motivo",)
+)
+PROFUNDIDAD_COLA = _metrica(
+    "Gauge", "invoice_queue_depth",
+    "Facturas esperando turno (extraccion: pool de PDFs; agente: limite de llamadas al LLM; webhook: respuestas del agente por llegar; bandeja: mensajes en el agente esperando worker)",
+    ("cola",)
+)
+EN_VUELO = _metrica(
+    "Gauge", "invoice_in_flight",
+    "Facturas en proceso"
+)
+
+
+def exportar_metricas():
+    """
+    Serializa las metricas en el formato de texto de Prometheus.
+
+    Returns:
+        tuple: (contenido, content type), o None si prometheus_client no esta instalado
+    """
+    if not PROMETHEUS_DISPONIBLE:
+        return None
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def servir_metricas(puerto):
+    """
+    Expone las metricas en http://<host>:<puerto>/metrics desde un hilo, para
+    procesos sin API propia como el agente.
+
+    Args:
+        puerto (int): Puerto del servidor; 0 no inicia nada
+
+    Returns:
+        bool: True si el servidor quedo escuchando
+    """
+    if not puerto:
+        return False
+    if not PROMETHEUS_DISPONIBLE:
+        logger.warning(f"No se exponen metricas en el puerto {puerto}: prometheus_client no esta instalado")
+        return False
+    prometheus_client.start_http_server(puerto)
+    return True
+
+
+def configurar_trazas(servicio, exportador=None):
+    """
+    Configura el envio de trazas si el SDK de OpenTelemetry esta instalado.
+
+    Sin exportador ni OTEL_EXPORTER_OTLP_ENDPOINT no se configura nada: los
+    spans siguen funcionando como no-op y el contexto no se propaga.
+
+    Args:
+        servicio (str): Nombre del servicio (OTEL_SERVICE_NAME tiene prioridad)
+        exportador (SpanExporter): Exportador a usar, p. ej. uno en memoria en
+            pruebas (por defecto OTLP/HTTP a OTEL_EXPORTER_OTLP_ENDPOINT)
+
+    Returns:
+        bool: True si las trazas quedaron configuradas
+    """
+    if not OTEL_DISPONIBLE or (exportador is None and not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")):
+        return False
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        if exportador is None:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exportador = OTLPSpanExporter()
+    except ImportError as e:
+        logger.warning(f"No se configuraron las trazas, falta el SDK o el exportador de OpenTelemetry: {e}")
+        return False
+
+    proveedor = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", servicio)}))
+    proveedor.add_span_processor(BatchSpanProcessor(exportador))
+    trace.set_tracer_provider(proveedor)
+    return True
+
+
+@contextlib.contextmanager
+def span(nombre, contexto=None, **atributos):
+    """
+    Abre un span como hijo del span actual o del contexto indicado.
+
+    Args:
+        nombre (str): Nombre del span
+        contexto (Context): Contexto remoto devuelto por extraer_contexto (opcional)
+        **atributos: Atributos del span; los None se omiten
+
+    Yields:
+        Span: El span, o None si OpenTelemetry no esta instalado
+    """
+    if not OTEL_DISPONIBLE:
+        yield None
+        return
+    atributos = {clave: valor for clave, valor in atributos.items() if valor is not None}
+    with trace.get_tracer("fr8-invoice").start_as_current_span(nombre, context=contexto, attributes=atributos) as actual:
+        yield actual
+
+
+@contextlib.contextmanager
+def medir_etapa(etapa, **atributos):
+    """
+    Span "invoice.<etapa>" y observacion de su duracion en DURACION_ETAPA.
+    """
+    inicio = time.perf_counter()
+    try:
+        with span(f"invoice.{etapa}", **atributos) as actual:
+            yield actual
+    finally:
+        DURACION_ETAPA.labels(etapa).observe(time.perf_counter() - inicio)
+
+
+def inyectar_contexto():
+    """
+    Contexto de la traza actual en formato W3C.
+
+    Returns:
+        dict: Headers "traceparent" (y "tracestate"); vacio si no hay traza activa
+    """
+    portador = {}
+    if OTEL_DISPONIBLE:
+        propagate.inject(portador)
+    return portador
+
+
+def extraer_contexto(portador):
+    """
+    Contexto remoto a partir de los headers W3C recibidos.
+
+    Args:
+        portador (Mapping): Headers o diccionario con "traceparent"
+
+    Returns:
+        Context: Contexto para span(), o None si OpenTelemetry no esta instalado
+    """
+    if not OTEL_DISPONIBLE:
+        return None
+    return propagate.extract(portador)
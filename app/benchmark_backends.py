@@ -0,0 +1,101 @@
+from pdf_reader import BACKENDS, PdfplumberBackend, obtener_backend, texto_legible, leer_texto_pdf
+from rule_extractor import extraer_campos_reglas
+import os
+import glob
+import argparse
+import time
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "raw")
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compara tiempo por pagina y campos extraidos por reglas entre los backends de texto"
+    )
+    parser.add_argument(
+        "--dirs",
+        nargs="+",
+        default=[os.path.join(DATA_DIR, d) for d in ("unique", "others", "error")],
+        help="Directorios con facturas PDF (por defecto data/raw/{unique,others,error})"
+    )
+    parser.add_argument(
+        "--repeticiones",
+        type=int,
+        default=3,
+        help="Lecturas de cada PDF por backend; se toma la mas rapida (por defecto 3)"
+    )
+    return parser.parse_args()
+
+def medir(backend, path_pdf, repeticiones):
+    """
+    Lee todas las paginas del PDF con el backend, sin respaldo de pdfplumber.
+
+    Returns:
+        tuple: (segundos de la lectura mas rapida, textos por pagina)
+    """
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        paginas = list(backend.iterar_paginas(path_pdf))
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor, paginas
+
+def main():
+    args = parse_args()
+    pdfs = sorted(p for d in args.dirs for p in glob.glob(os.path.join(d, "*.pdf")))
+    if not pdfs:
+        print("No se encontraron archivos PDF")
+        return
+
+    # Los campos que las reglas encuentran con pdfplumber son la referencia
+    referencia = {}
+    for path_pdf in pdfs:
+        _, paginas = medir(PdfplumberBackend(), path_pdf, 1)
+        referencia[path_pdf] = extraer_campos_reglas("\n".join(p for p in paginas if p))
+    total_referencia = sum(len(campos) for campos in referencia.values())
+
+    print(f"{len(pdfs)} PDFs, {total_referencia} campos encontrados por reglas con pdfplumber\n")
+    print(f"{'backend':<12} {'ms/pagina':>10} {'paginas':>8} {'respaldo':>9} {'campos':>7} {'coinciden':>10}")
+    for nombre in BACKENDS:
+        backend = obtener_backend(nombre)
+        tiempo = 0.0
+        num_paginas = 0
+        respaldo = 0
+        campos = 0
+        coinciden = 0
+        for path_pdf in pdfs:
+            duracion, paginas = medir(backend, path_pdf, args.repeticiones)
+            tiempo += duracion
+            num_paginas += len(paginas)
+            respaldo += sum(1 for p in paginas if not texto_legible(p))
+            encontrados = extraer_campos_reglas("\n".join(p for p in paginas if p))
+            campos += len(encontrados)
+            coinciden += sum(1 for c, v in referencia[path_pdf].items() if encontrados.get(c) == v)
+        print(
+            f"{nombre:<12} {tiempo / num_paginas * 1000:>10.1f} {num_paginas:>8} {respaldo:>9} "
+            f"{campos:>7} {coinciden:>6}/{total_referencia}"
+        )
+
+    # Flujo completo de la API: backend rapido con respaldo de pdfplumber
+    print(f"\n{'backend':<16} {'ms/PDF':>10} {'campos':>7} {'coinciden':>10}")
+    for nombre in BACKENDS:
+        if nombre == PdfplumberBackend.nombre:
+            continue
+        backend = obtener_backend(nombre)
+        tiempo = 0.0
+        campos = 0
+        coinciden = 0
+        for path_pdf in pdfs:
+            inicio = time.perf_counter()
+            texto = leer_texto_pdf(path_pdf, parada_temprana=False, backend=backend)
+            tiempo += time.perf_counter() - inicio
+            encontrados = extraer_campos_reglas(texto)
+            campos += len(encontrados)
+            coinciden += sum(1 for c, v in referencia[path_pdf].items() if encontrados.get(c) == v)
+        print(f"{nombre + '+resp':<16} {tiempo / len(pdfs) * 1000:>10.1f} {campos:>7} {coinciden:>6}/{total_referencia}")
+
+    print("\nrespaldo: paginas que no pasan texto_legible y se releen con pdfplumber")
+    print("+resp: leer_texto_pdf, el flujo de la API con el respaldo por pagina")
+
+if __name__ == "__main__":
+    main()
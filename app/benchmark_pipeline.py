@@ -0,0 +1,425 @@
+from invoice_agent import InvoiceExtractor, CAMPOS_LLM
+from llm_scheduler import LLMScheduler
+from llm_schema import extraer_json, validar_respuesta
+from mock_asi1 import ServidorASI1Simulado
+from pdf_reader import leer_texto_pdf
+from text_compactor import compactar_texto
+import invoice_agent
+import os
+import io
+import glob
+import json
+import math
+import time
+import asyncio
+import argparse
+import tracemalloc
+import contextlib
+import contextvars
+import unicodedata
+from dotenv import load_dotenv
+
+try:
+    import resource
+except ImportError:
+    # No existe en Windows; el pico de RSS se reporta como n/d
+    resource = None
+
+load_dotenv()
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(RAIZ, "data", "raw")
+GOLDEN_DIR = os.path.join(RAIZ, "data", "golden")
+GRABACIONES_DIR = os.path.join(RAIZ, "data", "llm_grabaciones")
+
+ETAPAS = ("pdf", "prompt", "llm", "post")
+CAMPOS_MONTO = ("pdf_sub_total", "pdf_traslado", "pdf_retencion", "pdf_total")
+
+# Tiempos por etapa de la factura que se esta procesando en la tarea actual
+_etapas_actuales = contextvars.ContextVar("etapas_actuales", default=None)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Mide tiempos por etapa, latencia, throughput, memoria y exactitud por campo "
+                    "del pipeline completo contra un ASI1 simulado"
+    )
+    parser.add_argument(
+        "--dirs",
+        nargs="+",
+        default=[os.path.join(DATA_DIR, d) for d in ("unique", "others", "error")],
+        help="Directorios con facturas PDF (por defecto data/raw/{unique,others,error})"
+    )
+    parser.add_argument(
+        "--concurrencia",
+        type=int,
+        nargs="+",
+        default=[1, 4, 8],
+        help="Facturas en paralelo de cada corrida (por defecto 1 4 8)"
+    )
+    parser.add_argument(
+        "--latencia-llm",
+        type=float,
+        default=300,
+        metavar="MS",
+        help="Milisegundos que tarda el ASI1 simulado en responder (por defecto 300)"
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="Medir tambien el pico de memoria de Python con tracemalloc (agrega overhead a los tiempos)"
+    )
+    parser.add_argument(
+        "--detalle",
+        action="store_true",
+        help="Listar cada campo que no coincide con el golden"
+    )
+    parser.add_argument(
+        "--salida",
+        metavar="ARCHIVO",
+        help="Guardar el reporte en JSON para comparar corridas"
+    )
+    parser.add_argument(
+        "--grabar",
+        action="store_true",
+        help="Llamar a ASI1 real (ASI1_API_KEY) y guardar sus respuestas en data/llm_grabaciones en lugar de medir"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Mostrar los mensajes del extractor durante las corridas"
+    )
+    return parser.parse_args()
+
+
+def ruta_relativa(path_pdf, base, extension=".json"):
+    # data/raw/unique/x.pdf -> <base>/unique/x.json
+    relativa = os.path.relpath(path_pdf, DATA_DIR)
+    if relativa.startswith(".."):
+        relativa = os.path.basename(path_pdf)
+    return os.path.join(base, os.path.splitext(relativa)[0] + extension)
+
+
+def cargar_json(ruta):
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _sumar(etapa, segundos):
+    etapas = _etapas_actuales.get()
+    if etapas is not None:
+        etapas[etapa] = etapas.get(etapa, 0.0) + segundos
+
+
+def _medir(etapa, funcion):
+    if asyncio.iscoroutinefunction(funcion):
+        async def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await funcion(*args, **kwargs)
+            finally:
+                _sumar(etapa, time.perf_counter() - inicio)
+    else:
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                _sumar(etapa, time.perf_counter() - inicio)
+    return envoltura
+
+
+@contextlib.contextmanager
+def instrumentar(extractor):
+    """
+    Envuelve los metodos del extractor que corresponden a cada etapa.
+
+    pdf: CFDI adjunto y lectura del texto; prompt: reglas, compactacion y
+    armado del prompt; llm: llamada a la API con sus reintentos; post:
+    validacion de la respuesta y armado de datos y errores.
+    """
+    envueltos = []
+    for etapa, metodos in (
+        ("pdf", ("_leer_cfdi", "_obtener_texto")),
+        ("prompt", ("_campos_reglas", "_construir_prompt", "_construir_prompt_lote")),
+        ("llm", ("_call_api_async",)),
+        ("post", ("_procesar_respuesta",)),
+    ):
+        for metodo in metodos:
+            setattr(extractor, metodo, _medir(etapa, getattr(extractor, metodo)))
+            envueltos.append(metodo)
+    compactar_original = invoice_agent.compactar_texto
+    invoice_agent.compactar_texto = _medir("prompt", compactar_original)
+    try:
+        yield extractor
+    finally:
+        invoice_agent.compactar_texto = compactar_original
+        for metodo in envueltos:
+            delattr(extractor, metodo)
+
+
+def percentil(valores, p):
+    # Metodo del rango mas cercano
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def pico_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss esta en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def correr(extractor, pdfs, concurrencia):
+    """
+    Procesa todas las facturas con un maximo de concurrencia en paralelo.
+
+    Returns:
+        tuple: (filas (ruta, resultado o excepcion, segundos, tiempos por etapa), segundos totales)
+    """
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def procesar(path_pdf):
+        async with semaforo:
+            etapas = {}
+            _etapas_actuales.set(etapas)
+            inicio = time.perf_counter()
+            try:
+                resultado = await extractor.extraer_datos_async(path_pdf)
+            except Exception as e:
+                resultado = e
+            return path_pdf, resultado, time.perf_counter() - inicio, etapas
+
+    inicio = time.perf_counter()
+    filas = await asyncio.gather(*(procesar(p) for p in pdfs))
+    return filas, time.perf_counter() - inicio
+
+
+def normalizar(valor):
+    texto = unicodedata.normalize("NFKD", str(valor))
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).upper()
+    return " ".join("".join(c if c.isalnum() else " " for c in texto).split())
+
+
+def coincide(campo, esperado, obtenido):
+    if campo in CAMPOS_MONTO:
+        try:
+            return abs(float(obtenido) - float(esperado)) < 0.005
+        except (TypeError, ValueError):
+            return False
+    # Los candidatos a RFC del emisor vienen ordenados: cuenta el primero
+    if isinstance(obtenido, list):
+        obtenido = obtenido[0] if obtenido else None
+    return obtenido is not None and normalizar(obtenido) == normalizar(esperado)
+
+
+def evaluar(filas, goldens, sin_calificar=None):
+    """
+    Compara cada resultado con su golden.
+
+    Args:
+        filas (list): Filas devueltas por correr
+        goldens (dict): Campos esperados por ruta de PDF
+        sin_calificar (dict): Campos por ruta de PDF que se excluyen de la
+            exactitud (los que el simulado respondio con el propio golden)
+
+    Returns:
+        tuple: (aciertos por campo, total por campo, sin calificar por campo, lista de diferencias)
+    """
+    sin_calificar = sin_calificar or {}
+    aciertos = {}
+    totales = {}
+    no_calificados = {}
+    diferencias = []
+    for path_pdf, resultado, _, _ in filas:
+        esperado = goldens.get(path_pdf)
+        if esperado is None:
+            continue
+        datos = {} if isinstance(resultado, Exception) else resultado[0]
+        for campo, valor in esperado.items():
+            if campo in sin_calificar.get(path_pdf, ()):
+                no_calificados[campo] = no_calificados.get(campo, 0) + 1
+                continue
+            totales[campo] = totales.get(campo, 0) + 1
+            if coincide(campo, valor, datos.get(campo)):
+                aciertos[campo] = aciertos.get(campo, 0) + 1
+            else:
+                diferencias.append((os.path.basename(path_pdf), campo, valor, datos.get(campo)))
+    return aciertos, totales, no_calificados, diferencias
+
+
+def grabar(pdfs):
+    """
+    Pide todos los campos de cada factura a ASI1 real y guarda la respuesta validada.
+    """
+    extractor = InvoiceExtractor(api_key=os.getenv("ASI1_API_KEY"))
+    campos = list(CAMPOS_LLM)
+    for path_pdf in pdfs:
+        texto, _ = compactar_texto(leer_texto_pdf(path_pdf))
+        respuesta = extractor._call_api(
+            extractor._construir_prompt(texto, campos),
+            validar=lambda t: extraer_json(t, validar=lambda datos: validar_respuesta(datos, campos))
+        )
+        ruta = ruta_relativa(path_pdf, GRABACIONES_DIR)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(extraer_json(respuesta, validar=lambda datos: validar_respuesta(datos, campos)), f, indent=4, ensure_ascii=False)
+            f.write("\n")
+        print(f"Grabada: {ruta}")
+
+
+def main():
+    args = parse_args()
+    pdfs = sorted(p for d in args.dirs for p in glob.glob(os.path.join(d, "*.pdf")))
+    if not pdfs:
+        print("No se encontraron archivos PDF")
+        return
+    if args.grabar:
+        grabar(pdfs)
+        return
+
+    # El simulado responde lo grabado de ASI1 o, si no hay grabacion, los campos del golden
+    goldens = {}
+    simulado = ServidorASI1Simulado(latencia=args.latencia_llm / 1000)
+    grabadas = 0
+    # Texto con el que el simulado reconoce cada factura que responde con el golden
+    textos_sin_grabacion = {}
+    for path_pdf in pdfs:
+        golden = cargar_json(ruta_relativa(path_pdf, GOLDEN_DIR))
+        if golden is not None:
+            goldens[path_pdf] = golden
+        grabacion = cargar_json(ruta_relativa(path_pdf, GRABACIONES_DIR))
+        grabadas += grabacion is not None
+        respuesta = grabacion or {c: v for c, v in (golden or {}).items() if c in CAMPOS_LLM}
+        texto, _ = compactar_texto(leer_texto_pdf(path_pdf))
+        simulado.registrar(texto, respuesta)
+        if grabacion is None:
+            textos_sin_grabacion[path_pdf] = texto.strip()
+    url = simulado.iniciar()
+
+    extractor = InvoiceExtractor(api_key="simulado")
+    extractor.client.api_url = url
+    # Sin limites de tasa: se mide el pipeline, no el planificador
+    extractor.scheduler = LLMScheduler(rpm=1e9, tpm=1e12)
+
+    print(f"{len(pdfs)} PDFs, {len(goldens)} con golden, {grabadas} con respuesta grabada de ASI1 "
+          f"(latencia simulada {args.latencia_llm:.0f} ms)")
+    if grabadas < len(goldens):
+        print("Sin grabacion, los campos que van al LLM se responden con el golden: "
+              "se reportan como sin calificar y no cuentan en la exactitud")
+    print()
+
+    corridas = []
+    with instrumentar(extractor):
+        for concurrencia in args.concurrencia:
+            simulado.reiniciar_contadores()
+            if args.tracemalloc:
+                tracemalloc.start()
+            salida = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with salida:
+                filas, duracion = extractor.client.run_sync(correr(extractor, pdfs, concurrencia))
+            pico_python = None
+            if args.tracemalloc:
+                pico_python = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                tracemalloc.stop()
+            corridas.append({
+                "concurrencia": concurrencia,
+                "filas": filas,
+                "duracion": duracion,
+                "llamadas_llm": simulado.llamadas,
+                "caracteres_llm": simulado.caracteres_enviados,
+                "pico_rss_mb": pico_rss_mb(),
+                "pico_python_mb": pico_python,
+                "respondidos_llm": dict(simulado.respondidos),
+            })
+    simulado.detener()
+
+    print(f"{'concurrencia':>12} {'facturas/s':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'llamadas':>9} {'tokens sal':>11} {'RSS MB':>7} {'py MB':>6} {'errores':>8}")
+    for corrida in corridas:
+        latencias = [fila[2] * 1000 for fila in corrida["filas"]]
+        errores = sum(1 for fila in corrida["filas"] if isinstance(fila[1], Exception))
+        rss = corrida["pico_rss_mb"]
+        py = corrida["pico_python_mb"]
+        print(
+            f"{corrida['concurrencia']:>12} {len(pdfs) / corrida['duracion']:>11.2f} "
+            f"{percentil(latencias, 50):>8.0f} {percentil(latencias, 95):>8.0f} {percentil(latencias, 99):>8.0f} "
+            f"{corrida['llamadas_llm']:>9} {corrida['caracteres_llm'] // 4:>11} "
+            f"{'n/d' if rss is None else f'{rss:.0f}':>7} {'-' if py is None else f'{py:.1f}':>6} {errores:>8}"
+        )
+
+    # Las etapas se reportan de la primera corrida, donde no compiten entre si
+    base = corridas[0]
+    print(f"\nEtapas (concurrencia {base['concurrencia']}, ms por factura)")
+    print(f"{'etapa':<8} {'facturas':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'total':>9}")
+    reporte_etapas = {}
+    for etapa in ETAPAS:
+        tiempos = [fila[3][etapa] * 1000 for fila in base["filas"] if etapa in fila[3]]
+        reporte_etapas[etapa] = {
+            "facturas": len(tiempos),
+            "p50": percentil(tiempos, 50),
+            "p95": percentil(tiempos, 95),
+            "p99": percentil(tiempos, 99),
+            "total": sum(tiempos),
+        }
+        print(f"{etapa:<8} {len(tiempos):>9} {percentil(tiempos, 50):>8.1f} {percentil(tiempos, 95):>8.1f} "
+              f"{percentil(tiempos, 99):>8.1f} {sum(tiempos):>9.0f}")
+
+    # Lo que el simulado respondio con el golden coincide por construccion: no se califica
+    sin_calificar = {
+        path_pdf: base["respondidos_llm"].get(texto, set())
+        for path_pdf, texto in textos_sin_grabacion.items()
+    }
+    aciertos, totales, no_calificados, diferencias = evaluar(base["filas"], goldens, sin_calificar)
+    print(f"\nExactitud contra golden ({len(goldens)} facturas)")
+    print(f"{'campo':<28} {'aciertos':>9} {'sin calificar':>14}")
+    for campo in dict.fromkeys([*totales, *no_calificados]):
+        calificados = f"{aciertos.get(campo, 0)}/{totales.get(campo, 0)}"
+        print(f"{campo:<28} {calificados:>9} {no_calificados.get(campo, 0):>14}")
+    total_aciertos = sum(aciertos.values())
+    total_campos = sum(totales.values())
+    if total_campos:
+        print(f"{'total':<28} {f'{total_aciertos}/{total_campos}':>9} {sum(no_calificados.values()):>14}"
+              f" ({total_aciertos / total_campos:.1%})")
+    if no_calificados:
+        print("sin calificar: campos que respondio el LLM simulado con el golden por falta de grabacion")
+    if args.detalle:
+        for nombre, campo, esperado, obtenido in diferencias:
+            print(f"  {nombre}: {campo} esperado={esperado!r} obtenido={obtenido!r}")
+
+    if args.salida:
+        reporte = {
+            "pdfs": len(pdfs),
+            "latencia_llm_ms": args.latencia_llm,
+            "corridas": [
+                {
+                    "concurrencia": c["concurrencia"],
+                    "facturas_por_segundo": len(pdfs) / c["duracion"],
+                    "p50_ms": percentil([f[2] * 1000 for f in c["filas"]], 50),
+                    "p95_ms": percentil([f[2] * 1000 for f in c["filas"]], 95),
+                    "p99_ms": percentil([f[2] * 1000 for f in c["filas"]], 99),
+                    "llamadas_llm": c["llamadas_llm"],
+                    "pico_rss_mb": c["pico_rss_mb"],
+                    "pico_python_mb": c["pico_python_mb"],
+                }
+                for c in corridas
+            ],
+            "etapas_ms": reporte_etapas,
+            "exactitud": {campo: aciertos.get(campo, 0) / totales[campo] for campo in totales},
+            "sin_calificar": no_calificados,
+            "diferencias": [
+                {"pdf": n, "campo": c, "esperado": e, "obtenido": o} for n, c, e, o in diferencias
+            ],
+        }
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=4, ensure_ascii=False)
+        print(f"\nReporte guardado en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import io
+import logging
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+# Clave SAT del IVA en los nodos Traslado/Retencion
+IMPUESTO_IVA = "002"
+
+
+def _nombre_local(tag):
+    # "{http://www.sat.gob.mx/cfd/4}Comprobante" -> "Comprobante"
+    return tag.rsplit("}", 1)[-1]
+
+
+def _monto(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def leer_cfdi(xml_bytes):
+    """
+    Lee los campos de la factura de un CFDI (3.3 o 4.0) con iterparse.
+
+    Solo se conservan los atributos necesarios y cada nodo se libera al
+    cerrarse, asi que el costo no depende de los complementos (Carta Porte,
+    conceptos) que traiga el XML.
+
+    Args:
+        xml_bytes (bytes): Contenido del XML
+
+    Returns:
+        dict: Campos con las mismas claves que la respuesta del extractor,
+            o None si el XML no es un CFDI
+    """
+    datos = {
+        "pdf_billed_company_name": "0",
+        "pdf_billed_company_rfc": "0",
+        "pdf_billing_company_name": "0",
+        "pdf_billing_company_rfc": "0",
+        "pdf_provider_bill_uuid": "0",
+        "pdf_currency_code": "0",
+        "pdf_sub_total": 0.0,
+        "pdf_traslado": 0.0,
+        "pdf_retencion": 0.0,
+        "pdf_total": 0.0
+    }
+    ruta = []
+    traslados = None
+    try:
+        for evento, elem in ET.iterparse(io.BytesIO(xml_bytes), events=("start", "end")):
+            nombre = _nombre_local(elem.tag)
+            if evento == "start":
+                ruta.append(nombre)
+                if len(ruta) == 1:
+                    if nombre != "Comprobante":
+                        return None
+                    datos["pdf_currency_code"] = elem.get("Moneda", "0")
+                    datos["pdf_sub_total"] = _monto(elem.get("SubTotal"))
+                    datos["pdf_total"] = _monto(elem.get("Total"))
+                elif ruta == ["Comprobante", "Emisor"]:
+                    datos["pdf_billed_company_name"] = elem.get("Nombre", "0")
+                    datos["pdf_billed_company_rfc"] = elem.get("Rfc", "0")
+                elif ruta == ["Comprobante", "Receptor"]:
+                    datos["pdf_billing_company_name"] = elem.get("Nombre", "0")
+                    datos["pdf_billing_company_rfc"] = elem.get("Rfc", "0")
+                elif ruta == ["Comprobante", "Impuestos"]:
+                    # Total declarado, por si el desglose no trae nodos de IVA
+                    traslados = _monto(elem.get("TotalImpuestosTrasladados"))
+                elif nombre == "TimbreFiscalDigital":
+                    datos["pdf_provider_bill_uuid"] = elem.get("UUID", "0").upper()
+                # Solo los impuestos del comprobante, no los de cada concepto
+                elif ruta[:3] == ["Comprobante", "Impuestos", "Traslados"] and nombre == "Traslado":
+                    if elem.get("Impuesto") == IMPUESTO_IVA:
+                        datos["pdf_traslado"] += _monto(elem.get("Importe"))
+                elif ruta[:3] == ["Comprobante", "Impuestos", "Retenciones"] and nombre == "Retencion":
+                    if elem.get("Impuesto") == IMPUESTO_IVA:
+                        datos["pdf_retencion"] += _monto(elem.get("Importe"))
+            else:
+                ruta.pop()
+                elem.clear()
+    except ET.ParseError as e:
+        logger.warning(f"XML invalido: {e}")
+        return None
+
+    if not datos["pdf_traslado"] and traslados:
+        datos["pdf_traslado"] = traslados
+    for campo in ("pdf_sub_total", "pdf_traslado", "pdf_retencion", "pdf_total"):
+        datos[campo] = round(datos[campo], 2)
+    return datos
+
+
+def buscar_xml_adjunto(pdf):
+    """
+    Busca un CFDI adjunto dentro del PDF.
+
+    Args:
+        pdf (str | bytes): Ruta o contenido del PDF
+
+    Returns:
+        bytes: Contenido del primer adjunto .xml, o None si no hay
+    """
+    import pypdfium2 as pdfium
+    from pdf_reader import PDFIUM_LOCK
+
+    with PDFIUM_LOCK:
+        try:
+            documento = pdfium.PdfDocument(pdf)
+        except pdfium.PdfiumError as e:
+            logger.warning(f"No se pudo abrir el PDF para buscar adjuntos: {e}")
+            return None
+        try:
+            for i in range(documento.count_attachments()):
+                adjunto = documento.get_attachment(i)
+                if adjunto.get_name().lower().endswith(".xml"):
+                    return bytes(adjunto.get_data())
+        finally:
+            documento.close()
+    return None
+
+
+def errores_cfdi(datos):
+    """
+    Diccionario de errores de captura de los campos leidos del CFDI.
+
+    Args:
+        datos (dict): Campos devueltos por leer_cfdi
+
+    Returns:
+        dict: True en los campos que el XML no trae
+    """
+    return {campo: valor in ("0", 0, 0.0) for campo, valor in datos.items()}
+
+
+def extraer_cfdi(pdf=None, xml=None):
+    """
+    Extrae los datos de la factura del XML recibido o del adjunto en el PDF.
+
+    Args:
+        pdf (str | bytes): Ruta o contenido del PDF (opcional)
+        xml (bytes): Contenido del XML (opcional, tiene prioridad sobre el adjunto)
+
+    Returns:
+        tuple: (diccionario de datos, diccionario de errores), o None si no hay un CFDI legible
+    """
+    if xml is None and pdf:
+        xml = buscar_xml_adjunto(pdf)
+    if not xml:
+        return None
+    datos = leer_cfdi(xml)
+    if datos is None:
+        return None
+    return datos, errores_cfdi(datos)
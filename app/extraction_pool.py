@@ -0,0 +1,141 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import logging
+import os
+from pdf_reader import leer_texto_pdf as leer_paginas_pdf
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturadoError(Exception):
+    """Se lanza cuando la cola de extraccion esta llena y no se aceptan mas PDFs."""
+
+
+def leer_texto_pdf(pdf):
+    """
+    Lee el texto de un PDF, devolviendo cadena vacia si falla.
+
+    Se define a nivel de modulo (y no en invoice_api) para que los procesos
+    del pool puedan importarla sin registrar el webhook de nuevo.
+
+    Args:
+        pdf (str | bytes): Ruta o contenido del PDF
+
+    Returns:
+        str: Texto extraído del PDF
+    """
+    try:
+        return leer_paginas_pdf(pdf)
+    except Exception as e:
+        logger.error(f"Error al leer PDF: {e}")
+        return ""
+
+
+class ExtractionPool:
+    def __init__(self, max_workers=None, max_pendientes=None, timeout=None):
+        """
+        Pool de procesos acotado para extraer texto de PDFs fuera del event loop.
+
+        Args:
+            max_workers (int): Procesos del pool (PDF_POOL_WORKERS, por defecto os.cpu_count())
+            max_pendientes (int): PDFs admitidos a la vez entre en proceso y en cola
+                (PDF_POOL_MAX_PENDIENTES, por defecto 4 por worker)
+            timeout (float): Segundos maximos de extraccion por documento (PDF_TIMEOUT)
+        """
+        self.max_workers = max_workers or int(os.getenv("PDF_POOL_WORKERS", os.cpu_count() or 1))
+        self.max_pendientes = max_pendientes or int(os.getenv("PDF_POOL_MAX_PENDIENTES", self.max_workers * 4))
+        self.timeout = timeout or float(os.getenv("PDF_TIMEOUT", "60"))
+        self._executor = None
+        self._semaforo = None
+        self.pendientes = 0
+
+    def _get_executor(self):
+        # El pool se crea en el primer uso para no lanzar procesos al importar la API
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.max_workers)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _reciclar(self, executor):
+        """
+        Mata los procesos de un pool con una extraccion atascada y deja uno nuevo para lo que siga.
+
+        ProcessPoolExecutor no permite matar una sola tarea, asi que se matan
+        todos los procesos del pool viejo; sus futuros fallan con
+        BrokenProcessPool, lo que libera sus huecos del semaforo, y los PDFs
+        que no agotaron su timeout se reenvian al pool nuevo.
+        """
+        if executor is not self._executor:
+            return  # ya lo reciclo otra extraccion vencida
+        self._executor = None
+        procesos = list((executor._processes or {}).values())
+        for proceso in procesos:
+            proceso.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning(f"Extraccion de PDF vencida: se reciclo el pool ({len(procesos)} procesos terminados)")
+
+    async def extraer_texto(self, pdf):
+        """
+        Extrae el texto de un PDF en un proceso del pool.
+
+        Los bytes se envian al proceso por el pipe del pool; no se escriben a disco.
+        Si la extraccion supera el timeout, el proceso atascado se mata (ver
+        _reciclar) antes de liberar su hueco.
+
+        Args:
+            pdf (str | bytes): Ruta o contenido del PDF
+
+        Returns:
+            str: Texto extraído del PDF
+
+        Raises:
+            PoolSaturadoError: Si ya hay max_pendientes PDFs en proceso o en cola
+            asyncio.TimeoutError: Si la extraccion supera el timeout por documento
+        """
+        if self.pendientes >= self.max_pendientes:
+            raise PoolSaturadoError(f"Cola de extraccion llena ({self.pendientes} PDFs pendientes)")
+
+        self.pendientes += 1
+        try:
+            try:
+                return await self._extraer_en_pool(pdf)
+            except BrokenProcessPool:
+                # El pool se reciclo (timeout de otro PDF) o murio con este en proceso: se reenvia una vez
+                return await self._extraer_en_pool(pdf)
+        finally:
+            self.pendientes -= 1
+
+    async def _extraer_en_pool(self, pdf):
+        self._get_executor()
+        await self._semaforo.acquire()
+        # El pool se toma despues del semaforo: mientras se esperaba turno pudo haberse reciclado
+        executor = self._get_executor()
+        try:
+            futuro = asyncio.get_running_loop().run_in_executor(executor, leer_texto_pdf, pdf)
+        except BaseException:
+            self._semaforo.release()
+            raise
+        # El hueco se libera cuando el proceso termina de verdad (o muere al reciclar el pool)
+        def _liberar(f):
+            self._semaforo.release()
+            if not f.cancelled():
+                f.exception()  # evita el aviso de excepcion no leida si el llamador ya se fue
+        futuro.add_done_callback(_liberar)
+        try:
+            return await asyncio.wait_for(asyncio.shield(futuro), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._reciclar(executor)
+            raise
+        except BrokenProcessPool:
+            # Un pool roto no acepta mas trabajo: el siguiente uso crea otro
+            if executor is self._executor:
+                self._executor = None
+            raise
+
+    def cerrar(self):
+        """Detiene los procesos del pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
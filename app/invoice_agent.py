@@ -1,37 +1,101 @@
 import os
-import requests
-import pdfplumber
-import json
-import re
-import numpy as np
+import asyncio
+import httpx
+import time
+from llm_client import ASI1Client, max_tokens_respuesta
+from llm_scheduler import obtener_scheduler
+from rule_extractor import escanear_identificadores, extraer_campos_reglas
+from rfc_registry import obtener_registro
+from cfdi_xml import extraer_cfdi
+from text_compactor import compactar_texto, estimar_tokens
+from llm_schema import detector_fin, extraer_json, validar_respuesta
+from pdf_reader import leer_texto_pdf
+from telemetry import LATENCIA_LLM, REINTENTOS_LLM, span
+
+MODEL_NAME = "asi1-mini"
+# Incrementar al cambiar _construir_prompt o el formato del resultado para invalidar los resultados en cache
+PROMPT_VERSION = "5"
+
+# Campos que se piden al modelo: descripcion en el prompt y tipo en el JSON
+CAMPOS_LLM = {
+    "pdf_billed_company_name": ("Nombre de la empresa emisora (quien emite la factura)", "string"),
+    "pdf_billing_company_name": ("Nombre de la empresa receptora (a quien va dirigida la factura)", "string"),
+    "pdf_provider_bill_uuid": ("UUID de la factura (si esta en minusculas, ponerlo en mayusculas)", "string"),
+    "pdf_currency_code": ("Moneda (Estandarizar a USD o MXN)", "string"),
+    "pdf_sub_total": ("Subtotal", "float"),
+    "pdf_traslado": ("IVA trasladado", "float"),
+    "pdf_retencion": ("IVA retenido", "float"),
+    "pdf_total": ("Total", "float"),
+}
 
 class InvoiceExtractor:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, cache=None, max_tokens=None, max_tokens_lote=6000, max_facturas_lote=8,
+                 temperature=0.0, json_mode=True, stream=True, registro=None):
         """
         Inicializa el extractor de facturas.
         
         Args:
             model_name (str): Nombre del modelo ASI1 a utilizar
             api_key (str): API key para ASI1. Si es None, se intentará obtener de las variables de entorno
+            cache (ResultCache): Cache de texto y resultados (opcional)
+            max_tokens (int): Tokens maximos de la respuesta del modelo (ASI1_MAX_TOKENS, por defecto 1024)
+            max_tokens_lote (int): Presupuesto de tokens de las facturas de un prompt en modo lote
+            max_facturas_lote (int): Facturas maximas por prompt en modo lote
+            temperature (float): Temperatura del modelo; 0 para respuestas deterministas
+            json_mode (bool): Pedir salida JSON con response_format; se desactiva sola
+                si la API lo rechaza
+            stream (bool): Leer la respuesta por streaming y cortarla en cuanto el
+                JSON esta completo y es valido
+            registro (RegistroRFC): RFCs propios y contrapartes conocidas (por
+                defecto, el registro compartido del proceso)
         """
 
         self.api_key = api_key or os.getenv("ASI1_API_KEY")
         if not self.api_key:
             raise ValueError("Se requiere una API key para ASI1. Proporciona una o configura la variable de entorno ASI1_API_KEY")
         
-        self.model_name = "asi1-mini"
+        self.model_name = MODEL_NAME
+        self.cache = cache
         self.api_url = "https://api.asi1.ai/v1/chat/completions"
         self.headers = {
             "Authorization": f"bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self.max_tokens = max_tokens or max_tokens_respuesta()
+        self.max_tokens_lote = max_tokens_lote
+        self.max_facturas_lote = max_facturas_lote
+        self.temperature = temperature
+        self.json_mode = json_mode
+        self.stream = stream
+        self.client = ASI1Client(self.api_url, self.headers)
+        self.scheduler = obtener_scheduler()
+        self.registro = registro or obtener_registro()
+
+    def _call_api(self, prompt, validar=None):
+        """
+        Realiza una llamada directa a la API de ASI1 (envoltura sincrona de _call_api_async).
+        
+        Args:
+            prompt (str): El prompt a enviar al modelo
+            validar (callable): Validacion para cortar el stream (ver _call_api_async)
+            
+        Returns:
+            str: La respuesta del modelo
+        """
+        return self.client.run_sync(self._call_api_async(prompt, validar=validar))
 
-    def _call_api(self, prompt):
+    async def _call_api_async(self, prompt, max_tokens=None, validar=None):
         """
-        Realiza una llamada directa a la API de ASI1.
+        Realiza una llamada a la API de ASI1 con el cliente HTTP compartido.
+
+        En modo stream, si se indica validar, la conexion se cierra en cuanto
+        se cierra un JSON de primer nivel que pasa la validacion, sin pagar
+        el texto que el modelo agregue despues.
         
         Args:
             prompt (str): El prompt a enviar al modelo
+            max_tokens (int): Tokens maximos de la respuesta (por defecto, self.max_tokens)
+            validar (callable): Recibe el texto acumulado y lanza ValueError si aun no es valido
             
         Returns:
             str: La respuesta del modelo
@@ -44,76 +108,122 @@ class InvoiceExtractor:
                     "content": prompt
                 }
             ],
-            "temperature": 0.7,
-            "stream": False,
-            "max_tokens": 1024
+            "temperature": self.temperature,
+            "stream": self.stream,
+            "max_tokens": max_tokens or self.max_tokens
         }
+        if self.json_mode:
+            payload["response_format"] = {"type": "json_object"}
         
+        # La latencia incluye los reintentos y las esperas del scheduler
+        inicio = time.perf_counter()
+        resultado = "error"
         try:
-            response = requests.post(self.api_url, headers=self.headers, json=payload, timeout=30)
-            response.raise_for_status()
-            
-            response_json = response.json()
-            if not response_json or "choices" not in response_json or not response_json["choices"]:
-                print(f"Respuesta inesperada de la API: {response_json}")
-                raise ValueError("La API devolvió una respuesta inválida o vacía")
-                
-            content = response_json["choices"][0]["message"]["content"]
+            # Estimacion gruesa (~4 caracteres por token) para el limite de tokens por minuto
+            tokens_estimados = len(prompt) // 4 + payload["max_tokens"]
+            with span("asi1.chat_completions", **{"llm.model": self.model_name, "llm.prompt_chars": len(prompt)}):
+                try:
+                    content = await self.scheduler.ejecutar(lambda: self._enviar(payload, validar), tokens_estimados)
+                except httpx.HTTPStatusError as e:
+                    if "response_format" not in payload or e.response.status_code not in (400, 422):
+                        raise
+                    # La API no soporta salida estructurada: se repite sin ella y no se vuelve a pedir
+                    print("La API rechazo response_format; se continua sin modo JSON")
+                    self.json_mode = False
+                    del payload["response_format"]
+                    content = await self.scheduler.ejecutar(lambda: self._enviar(payload, validar), tokens_estimados)
+
             if not content or not content.strip():
                 print("La API devolvió un contenido vacío")
                 raise ValueError("La API devolvió un contenido vacío")
                 
+            resultado = "ok"
             return content
             
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             print("La llamada a la API excedió el tiempo de espera")
             raise
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPStatusError as e:
+            print(f"Error en la llamada a la API: {str(e)}")
+            print(f"Respuesta del servidor: {e.response.text}")
+            raise
+        except httpx.RequestError as e:
             print(f"Error en la llamada a la API: {str(e)}")
-            if hasattr(e.response, 'text'):
-                print(f"Respuesta del servidor: {e.response.text}")
             raise
         except Exception as e:
             print(f"Error inesperado en la llamada a la API: {str(e)}")
             raise
+        finally:
+            LATENCIA_LLM.labels(resultado).observe(time.perf_counter() - inicio)
+
+    async def _enviar(self, payload, validar=None):
+        """
+        Envia una peticion y devuelve el contenido de la respuesta.
+
+        Se llama en cada intento del scheduler, asi que el detector de fin de
+        JSON se crea de nuevo por intento.
+        """
+        if payload["stream"]:
+            al_recibir = detector_fin(validar) if validar is not None else None
+            return await self.client.post_stream(payload, al_recibir)
+
+        response = await self.client.post(payload)
+        response_json = response.json()
+        if not response_json or "choices" not in response_json or not response_json["choices"]:
+            print(f"Respuesta inesperada de la API: {response_json}")
+            raise ValueError("La API devolvió una respuesta inválida o vacía")
+        return response_json["choices"][0]["message"]["content"]
 
     def _leer_texto_pdf(self, path_pdf):
         """
         Lee el texto de un archivo PDF.
         
         Args:
-            path_pdf (str): Ruta al archivo PDF
+            path_pdf (str | bytes): Ruta o contenido del archivo PDF
             
         Returns:
             str: Texto extraído del PDF
         """
-        with pdfplumber.open(path_pdf) as pdf:
-            texto = "\n".join([pagina.extract_text() for pagina in pdf.pages if pagina.extract_text()])
+        return leer_texto_pdf(path_pdf)
+
+    def _leer_palabras_pdf(self, path_pdf):
+        """
+        Lee las palabras del PDF con su posicion para las reglas por coordenadas.
+
+        Args:
+            path_pdf (str): Ruta al archivo PDF
 
-        words_pdf = texto.split()
-        return texto, words_pdf
+        Returns:
+            list: Diccionarios con text, x0, x1, top y pagina
+        """
+        import pdfplumber
+        palabras = []
+        with pdfplumber.open(path_pdf) as pdf:
+            for numero, pagina in enumerate(pdf.pages):
+                for palabra in pagina.extract_words():
+                    palabra["pagina"] = numero
+                    palabras.append(palabra)
+                pagina.close()
+        return palabras
 
-    def _construir_prompt(self, texto_factura):
+    def _construir_prompt(self, texto_factura, campos=None):
         """
         Construye el prompt para el modelo ASI1.
         
         Args:
             texto_factura (str): Texto de la factura
+            campos (list): Campos de CAMPOS_LLM a pedir (por defecto, todos)
             
         Returns:
             str: Prompt formateado
         """
+        campos = campos or list(CAMPOS_LLM)
+        lista = "\n".join(f"        - {CAMPOS_LLM[c][0]} (si no está, poner 0)" for c in campos)
+        estructura = ",\n".join(f'            "{c}": "{CAMPOS_LLM[c][1]}"' for c in campos)
         prompt = f"""
         Extrae los siguientes campos de esta factura:
 
-        - Nombre de la empresa emisora (quien emite la factura) (si no está, poner 0)
-        - Nombre de la empresa receptora (a quien va dirigida la factura) (si no está, poner 0)
-        - UUID de la factura (si esta en minusculas, ponerlo en mayusculas) (si no está, poner 0)
-        - Moneda (Estandarizar a USD o MXN) (si no está, poner 0)
-        - Subtotal (si no está, poner 0)
-        - IVA trasladado (si no está, poner 0)
-        - IVA retenido (si no está, poner 0)
-        - Total (si no está, poner 0)
+{lista}
 
         Factura:
         ---
@@ -124,35 +234,63 @@ class InvoiceExtractor:
         Que siga la siguiente estructura:
 
         {{
-            "pdf_billed_company_name": "string",
-            "pdf_billing_company_name": "string",
-            "pdf_provider_bill_uuid": "string",
-            "pdf_currency_code": "string",
-            "pdf_sub_total": "float",
-            "pdf_traslado": "float",
-            "pdf_retencion": "float",
-            "pdf_total": "float"
+{estructura}
+        }}
+        """
+        return prompt
+
+    def _construir_prompt_lote(self, facturas, campos):
+        """
+        Construye un prompt con varias facturas que pide un objeto JSON con una entrada por factura.
+
+        Args:
+            facturas (list): Tuplas (id, texto de la factura)
+            campos (list): Campos de CAMPOS_LLM a pedir
+
+        Returns:
+            str: Prompt formateado
+        """
+        lista = "\n".join(f"        - {CAMPOS_LLM[c][0]} (si no está, poner 0)" for c in campos)
+        estructura = ",\n".join(f'                    "{c}": "{CAMPOS_LLM[c][1]}"' for c in campos)
+        bloques = "\n\n".join(
+            f"        Factura {id_factura}:\n        ---\n        {texto}\n        ---" for id_factura, texto in facturas
+        )
+        prompt = f"""
+        Extrae los siguientes campos de cada una de estas {len(facturas)} facturas:
+
+{lista}
+
+{bloques}
+
+        Responde solo en formato JSON válido y sin ningún comentario adicional,
+        con un objeto por factura en "facturas" que incluya su "id".
+        Que siga la siguiente estructura:
+
+        {{
+            "facturas": [
+                {{
+                    "id": "string",
+{estructura}
+                }}
+            ]
         }}
         """
         return prompt
 
-    def _process_json(self, json_str):
+    def _process_json(self, data_dict):
         """
-        Procesa el JSON de respuesta y genera el diccionario de datos y errores.
+        Procesa los datos de la respuesta y genera el diccionario de datos y errores.
         
         Args:
-            json_str (str): JSON en formato string
+            data_dict (dict): Campos del modelo, de las reglas y RFCs
             
         Returns:
             tuple: (diccionario de datos, diccionario de errores)
         """
-        # Convertir el string JSON a diccionario
-        data_dict = json.loads(json_str)
-        
         # Crear diccionario de errores con la misma estructura
         error_dict = {
             "pdf_billed_company_name": data_dict["pdf_billed_company_name"] == "0",
-            "pdf_billed_company_rfc": len(data_dict["pdf_billed_company_rfc"]) == "0",
+            "pdf_billed_company_rfc": data_dict["pdf_billed_company_rfc"] == "0",
             "pdf_billing_company_name": data_dict["pdf_billing_company_name"] == "0",
             "pdf_billing_company_rfc": data_dict["pdf_billing_company_rfc"] == "0",
             "pdf_provider_bill_uuid": data_dict["pdf_provider_bill_uuid"] == "0",
@@ -170,90 +308,418 @@ class InvoiceExtractor:
             
         return data_dict, error_dict
     
-    def _find_rfc(self,words_pdf):
+    def _campos_registro(self, texto_factura, campos):
         """
-        Finds possible RFCs in the extracted words.
-        
-        Parameters:
-        - words_pdf (list): List of words extracted from the PDF.
-        
+        RFCs de emisor y receptor resueltos con el registro y los nombres que este ya conoce.
+
+        Args:
+            texto_factura (str): Texto de la factura
+            campos (dict): Campos ya encontrados; sus nombres tienen prioridad
+
         Returns:
-        - possible_rfc (list): List of possible RFCs found in the PDF.
+            dict: RFCs y nombres resueltos
         """
-
-        rfc_pattern = re.compile(r'\b([A-ZÑ&]{3,4}\d{6}[A-Z0-9]{3})\b')
-        possible_rfc = []
-        for word in words_pdf:
-            if rfc_pattern.match(word):
-                possible_rfc.append(word)
-        
-        if len(possible_rfc) == 0:
-            self.error = True
-        return np.unique(possible_rfc).tolist()
+        rfcs, _ = escanear_identificadores(texto_factura)
+        emisor, receptor = self.registro.resolver(rfcs)
+        resueltos = {"pdf_billed_company_rfc": emisor, "pdf_billing_company_rfc": receptor}
+        for campo, rfc in (("pdf_billed_company_name", emisor), ("pdf_billing_company_name", receptor)):
+            nombre = self.registro.nombre(rfc) if rfc != "0" else None
+            if nombre and campo not in campos:
+                resueltos[campo] = nombre
+        return resueltos
     
-    def extraer_datos(self, path_pdf):
+    def _procesar_respuesta(self, respuesta, texto_factura, campos_reglas=None):
+        """
+        Combina la respuesta del modelo con los RFCs y los campos detectados en el texto.
+
+        Args:
+            respuesta (str | dict): Contenido devuelto por el modelo (o su objeto JSON ya
+                separado, en modo lote), o None si no hizo falta llamarlo
+            texto_factura (str): Texto de la factura
+            campos_reglas (dict): Campos extraidos por reglas y por el registro de RFCs;
+                tienen prioridad sobre el modelo
+
+        Returns:
+            tuple: (diccionario de datos, diccionario de errores)
+
+        Raises:
+            ValueError: Si la respuesta no contiene un JSON valido o le faltan campos pedidos
+        """
+        campos_reglas = campos_reglas or {}
+        if respuesta is None:
+            json_data = {}
+        else:
+            # Solo se exigen al modelo los campos que se le pidieron
+            pedidos = [c for c in CAMPOS_LLM if c not in campos_reglas]
+            if isinstance(respuesta, dict):
+                json_data = validar_respuesta(respuesta, pedidos)
+            else:
+                json_data = extraer_json(respuesta, validar=lambda datos: validar_respuesta(datos, pedidos))
+
+        json_data.update(campos_reglas)
+        if "pdf_billed_company_rfc" not in json_data:
+            json_data.update(self._campos_registro(texto_factura, json_data))
+
+        data_dict, error_dict = self._process_json(json_data)
+        # El nombre del modelo es solo una propuesta: se usa cuando varias facturas coinciden en el
+        # (ver RegistroRFC.aprender); los del XML se confirman en _leer_cfdi
+        self.registro.aprender(
+            data_dict["pdf_billed_company_rfc"], data_dict["pdf_billed_company_name"],
+            factura=data_dict["pdf_provider_bill_uuid"]
+        )
+        return data_dict, error_dict
+
+    def _obtener_texto(self, path_pdf):
+        """
+        Lee el texto del PDF, reutilizando el de la cache si el PDF ya se proceso.
+
+        Args:
+            path_pdf (str): Ruta al archivo PDF
+
+        Returns:
+            str: Texto de la factura
+        """
+        if self.cache is None:
+            return self._leer_texto_pdf(path_pdf)
+        with open(path_pdf, "rb") as f:
+            pdf_bytes = f.read()
+        texto_factura = self.cache.obtener_texto(pdf_bytes)
+        if texto_factura is None:
+            # Se reutilizan los bytes ya leidos para el hash en lugar de reabrir el archivo
+            texto_factura = self._leer_texto_pdf(pdf_bytes)
+            self.cache.guardar_texto(pdf_bytes, texto_factura)
+        return texto_factura
+
+    def _leer_cfdi(self, path_pdf, path_xml=None):
+        """
+        Lee los datos del CFDI en XML, si se recibio o viene adjunto en el PDF.
+
+        Args:
+            path_pdf (str): Ruta al archivo PDF (puede ser None si solo hay XML)
+            path_xml (str): Ruta al XML del CFDI (opcional)
+
+        Returns:
+            tuple: (datos, errores), o None si no hay un XML legible
+        """
+        xml = None
+        if path_xml:
+            with open(path_xml, "rb") as f:
+                xml = f.read()
+        cfdi = extraer_cfdi(path_pdf, xml)
+        if cfdi is not None:
+            # El nombre del emisor en el XML es confiable: corrige el del indice
+            datos, _ = cfdi
+            self.registro.aprender(datos["pdf_billed_company_rfc"], datos["pdf_billed_company_name"], confirmado=True)
+        return cfdi
+
+    def extraer_datos(self, path_pdf, path_xml=None):
         """
         Extrae los datos de una factura en formato PDF.
 
+        Si hay un CFDI en XML (recibido o adjunto al PDF) los datos se toman de
+        ahi; si no, el PDF se lee en el hilo que llama y la llamada al modelo se
+        ejecuta en el loop de fondo del cliente, compartiendo su pool de conexiones.
+
+        Args:
+            path_pdf (str): Ruta al archivo PDF de la factura
+            path_xml (str): Ruta al XML del CFDI (opcional)
+
+        Returns:
+            tuple: (diccionario con datos extraídos, diccionario con errores de captura)
+        """
+        cfdi = self._leer_cfdi(path_pdf, path_xml)
+        if cfdi is not None:
+            return cfdi
+        texto_factura = self._obtener_texto(path_pdf)
+        return self.client.run_sync(self._extraer_de_texto(texto_factura, path_pdf))
+
+    async def extraer_datos_async(self, path_pdf, path_xml=None):
+        """
+        Version asincrona de extraer_datos; la lectura del PDF se hace en un hilo.
+
         Args:
             path_pdf (str): Ruta al archivo PDF de la factura
+            path_xml (str): Ruta al XML del CFDI (opcional)
+
+        Returns:
+            tuple: (diccionario con datos extraídos, diccionario con errores de captura)
+        """
+        cfdi = await asyncio.to_thread(self._leer_cfdi, path_pdf, path_xml)
+        if cfdi is not None:
+            return cfdi
+        texto_factura = await asyncio.to_thread(self._obtener_texto, path_pdf)
+        return await self._extraer_de_texto(texto_factura, path_pdf)
+
+    async def extraer_datos_texto_async(self, texto_factura):
+        """
+        Extrae los datos a partir del texto ya extraído del PDF (p. ej. por la API).
+
+        Args:
+            texto_factura (str): Texto de la factura
+
+        Returns:
+            tuple: (diccionario con datos extraídos, diccionario con errores de captura)
+        """
+        return await self._extraer_de_texto(texto_factura)
+
+    async def _extraer_de_texto(self, texto_factura, path_pdf=None):
+        """
+        Extrae los datos a partir del texto de la factura.
+
+        Primero aplica las reglas de rule_extractor y solo pide al modelo los
+        campos que no pudieron llenarse con confianza; si no falta ninguno, no
+        se llama al modelo.
+
+        Args:
+            texto_factura (str): Texto de la factura
+            path_pdf (str): Ruta al PDF, para buscar montos por posicion (opcional)
 
         Returns:
             tuple: (diccionario con datos extraídos, diccionario con errores de captura)
         """
-        texto_factura, words_pdf = self._leer_texto_pdf(path_pdf)
         if not texto_factura or not texto_factura.strip():
             raise ValueError("No se pudo extraer texto del PDF o el PDF está vacío")
 
-        prompt = self._construir_prompt(texto_factura)
+        # Si el prompt y el modelo no cambiaron, el resultado cacheado es valido
+        if self.cache is not None:
+            cacheado = await self.cache.obtener_resultado_async(
+                texto_factura, PROMPT_VERSION, self.model_name, self.registro.digest
+            )
+            if cacheado is not None:
+                return cacheado
+
+        campos = await self._campos_reglas(texto_factura, path_pdf)
+        faltantes = [c for c in CAMPOS_LLM if c not in campos]
+
+        if not faltantes:
+            return await self._resultado_reglas(texto_factura, campos)
+
+        # Las reglas usan el texto completo; al modelo solo va el texto compactado
+        texto_prompt, estadisticas = compactar_texto(texto_factura)
+        print(f"Texto compactado: {estadisticas['tokens_originales']} -> {estadisticas['tokens_finales']} tokens "
+              f"({estadisticas['tokens_eliminados']} eliminados)")
+        prompt = self._construir_prompt(texto_prompt, faltantes)
         max_retries = 3
         retry_count = 0
+        respuesta = None
 
         while retry_count < max_retries:
             try:
-                respuesta = self._call_api(prompt)
-                possible_rfc = self._find_rfc(words_pdf)
-
-                # Detectar RFCs
-                if "FHM190118EN7" in possible_rfc:
-                    pdf_billing_company_rfc = "FHM190118EN7"
-                    possible_rfc.remove("FHM190118EN7")
-                else:
-                    pdf_billing_company_rfc = "0"
-
-                pdf_billed_company_rfc = possible_rfc if len(possible_rfc) > 0 else "0"
-
-                # Procesar respuesta JSON según su formato
-                if respuesta.strip().startswith('{'):
-                    json_data = json.loads(respuesta)
-                elif '```json' in respuesta:
-                    json_str = respuesta.split('```json\n')[1].split('\n```')[0]
-                    json_data = json.loads(json_str)
-                elif '```' in respuesta:
-                    json_str = respuesta.split('```\n')[1].split('\n```')[0]
-                    json_data = json.loads(json_str)
-                else:
-                    json_data = json.loads(respuesta)
-
-                json_data["pdf_billing_company_rfc"] = pdf_billing_company_rfc
-                json_data["pdf_billed_company_rfc"] = pdf_billed_company_rfc
-                # Serializar nuevamente a string
-                data_json_str = json.dumps(json_data)
-
-                # Procesar el JSON
-                data_dict, error_dict = self._process_json(data_json_str)
+                respuesta = await self._call_api_async(
+                    prompt, validar=lambda texto: extraer_json(
+                        texto, validar=lambda datos: validar_respuesta(datos, faltantes)
+                    )
+                )
+                data_dict, error_dict = self._procesar_respuesta(respuesta, texto_factura, campos)
 
+                if self.cache is not None:
+                    await self.cache.guardar_resultado_async(
+                        texto_factura, PROMPT_VERSION, self.model_name, data_dict, error_dict, self.registro.digest
+                    )
                 return data_dict, error_dict
 
-            except json.JSONDecodeError as e:
+            except ValueError as e:
+                # JSON invalido, campos faltantes o de tipo incorrecto (pydantic.ValidationError)
                 retry_count += 1
                 if retry_count >= max_retries:
-                    print(f"Error al decodificar JSON después de {max_retries} intentos: {str(e)}")
+                    print(f"Error al validar el JSON después de {max_retries} intentos: {str(e)}")
                     print("Contenido original:", respuesta)
                     raise ValueError(f"La respuesta no es un JSON válido después de {max_retries} intentos: {str(e)}")
+                REINTENTOS_LLM.labels("json").inc()
                 print(f"Intento {retry_count} fallido. Reintentando...")
                 continue
             except Exception as e:
                 print(f"Error al procesar la respuesta: {str(e)}")
                 print("Contenido original:", respuesta)
-                raise
\ No newline at end of file
+                raise
+
+    async def _resultado_reglas(self, texto_factura, campos):
+        """
+        Arma el resultado de una factura que las reglas resolvieron por completo y lo guarda en cache.
+
+        Args:
+            texto_factura (str): Texto de la factura
+            campos (dict): Campos obtenidos con _campos_reglas
+
+        Returns:
+            tuple: (diccionario con datos extraídos, diccionario con errores de captura)
+        """
+        data_dict, error_dict = self._procesar_respuesta(None, texto_factura, campos)
+        if self.cache is not None:
+            await self.cache.guardar_resultado_async(
+                texto_factura, PROMPT_VERSION, self.model_name, data_dict, error_dict, self.registro.digest
+            )
+        return data_dict, error_dict
+
+    async def _campos_reglas(self, texto_factura, path_pdf=None):
+        """
+        Campos que las reglas llenan con confianza; con la ruta del PDF tambien se buscan montos por posicion.
+
+        Incluye los RFCs resueltos con el registro y los nombres que este ya
+        conoce, asi que al modelo solo se le piden los nombres que faltan.
+        """
+        campos = extraer_campos_reglas(texto_factura)
+        if path_pdf and ("pdf_sub_total" not in campos or "pdf_total" not in campos):
+            palabras = await asyncio.to_thread(self._leer_palabras_pdf, path_pdf)
+            campos = extraer_campos_reglas(texto_factura, palabras)
+        campos.update(self._campos_registro(texto_factura, campos))
+        return campos
+
+    def extraer_datos_lote(self, paths_pdf):
+        """
+        Extrae los datos de varias facturas agrupando en un mismo prompt las que necesitan al modelo.
+
+        Args:
+            paths_pdf (list): Rutas a los archivos PDF
+
+        Returns:
+            list: Por cada PDF, en el mismo orden, la tupla (datos, errores) o la excepcion si fallo
+        """
+        return self.client.run_sync(self.extraer_datos_lote_async(paths_pdf))
+
+    async def extraer_datos_lote_async(self, paths_pdf):
+        """
+        Version asincrona de extraer_datos_lote.
+
+        Args:
+            paths_pdf (list): Rutas a los archivos PDF
+
+        Returns:
+            list: Por cada PDF, en el mismo orden, la tupla (datos, errores) o la excepcion si fallo
+        """
+        resultados = [None] * len(paths_pdf)
+        facturas = []
+        for i, path_pdf in enumerate(paths_pdf):
+            try:
+                cfdi = await asyncio.to_thread(self._leer_cfdi, path_pdf)
+                if cfdi is not None:
+                    resultados[i] = cfdi
+                    continue
+                texto_factura = await asyncio.to_thread(self._obtener_texto, path_pdf)
+                facturas.append((i, texto_factura, path_pdf))
+            except Exception as e:
+                resultados[i] = e
+
+        for i, resultado in await self._extraer_lote_de_textos(facturas):
+            resultados[i] = resultado
+        return resultados
+
+    async def _extraer_lote_de_textos(self, facturas):
+        """
+        Extrae los datos de varias facturas a partir de su texto.
+
+        Las facturas resueltas por cache o por reglas no van al modelo; las
+        demas se agrupan en prompts de hasta max_facturas_lote facturas y
+        max_tokens_lote tokens. Las que faltan en la respuesta o no pasan la
+        validacion se reprocesan individualmente con _extraer_de_texto.
+
+        Args:
+            facturas (list): Tuplas (id, texto de la factura, ruta al PDF o None)
+
+        Returns:
+            list: Tuplas (id, resultado), con resultado (datos, errores) o la excepcion si fallo
+        """
+        resultados = []
+        pendientes = []
+        for id_factura, texto_factura, path_pdf in facturas:
+            if not texto_factura or not texto_factura.strip():
+                resultados.append((id_factura, ValueError("No se pudo extraer texto del PDF o el PDF está vacío")))
+                continue
+            cacheado = None
+            if self.cache is not None:
+                cacheado = await self.cache.obtener_resultado_async(
+                    texto_factura, PROMPT_VERSION, self.model_name, self.registro.digest
+                )
+            if cacheado is not None:
+                resultados.append((id_factura, cacheado))
+                continue
+            campos = await self._campos_reglas(texto_factura, path_pdf)
+            if all(c in campos for c in CAMPOS_LLM):
+                # Ya se tienen los campos de reglas: no se recalculan ni se compacta el texto
+                try:
+                    resultados.append((id_factura, await self._resultado_reglas(texto_factura, campos)))
+                except Exception as e:
+                    resultados.append((id_factura, e))
+                continue
+            texto_prompt, _ = compactar_texto(texto_factura)
+            pendientes.append((id_factura, texto_factura, path_pdf, campos, texto_prompt))
+
+        # Agrupar por presupuesto de tokens y numero de facturas
+        lotes = []
+        for pendiente in pendientes:
+            tokens = estimar_tokens(pendiente[4])
+            if (not lotes or len(lotes[-1][0]) >= self.max_facturas_lote
+                    or lotes[-1][1] + tokens > self.max_tokens_lote):
+                lotes.append(([], 0))
+            lotes[-1] = (lotes[-1][0] + [pendiente], lotes[-1][1] + tokens)
+
+        for lote, tokens in lotes:
+            print(f"Lote de {len(lote)} facturas (~{tokens} tokens de texto)")
+            resultados.extend(await self._extraer_lote(lote))
+        return resultados
+
+    def _items_lote(self, respuesta):
+        """
+        Separa los objetos por factura de la respuesta de un lote.
+
+        Args:
+            respuesta (str): Contenido devuelto por el modelo
+
+        Returns:
+            list: Objetos de la respuesta, uno por factura
+
+        Raises:
+            ValueError: Si la respuesta no contiene el arreglo de facturas
+        """
+        def facturas(datos):
+            if not isinstance(datos.get("facturas"), list):
+                raise ValueError("La respuesta del lote no trae un arreglo de facturas")
+            return datos["facturas"]
+
+        try:
+            return extraer_json(respuesta, validar=facturas)
+        except ValueError:
+            # Sin modo JSON el modelo puede devolver el arreglo sin envolver
+            return extraer_json(respuesta, list)
+
+    async def _extraer_lote(self, lote):
+        """
+        Envia un lote de facturas en un solo prompt y separa la respuesta por factura.
+
+        Args:
+            lote (list): Tuplas (id, texto, ruta, campos de reglas, texto compactado)
+
+        Returns:
+            list: Tuplas (id, resultado), con resultado (datos, errores) o la excepcion si fallo
+        """
+        claves = {f"F{n + 1}": pendiente for n, pendiente in enumerate(lote)}
+        por_id = {}
+        if len(lote) > 1:
+            campos = [c for c in CAMPOS_LLM if any(c not in pendiente[3] for pendiente in lote)]
+            prompt = self._construir_prompt_lote([(clave, p[4]) for clave, p in claves.items()], campos)
+            try:
+                respuesta = await self._call_api_async(prompt, self.max_tokens * len(lote), self._items_lote)
+                for item in self._items_lote(respuesta):
+                    if isinstance(item, dict):
+                        por_id[str(item.pop("id", ""))] = item
+            except Exception as e:
+                print(f"Fallo el lote, se procesan las facturas una por una: {str(e)}")
+
+        resultados = []
+        for clave, (id_factura, texto_factura, path_pdf, campos_reglas, _) in claves.items():
+            try:
+                if clave not in por_id:
+                    raise KeyError(clave)
+                data_dict, error_dict = self._procesar_respuesta(por_id[clave], texto_factura, campos_reglas)
+                if self.cache is not None:
+                    await self.cache.guardar_resultado_async(
+                        texto_factura, PROMPT_VERSION, self.model_name, data_dict, error_dict, self.registro.digest
+                    )
+                resultados.append((id_factura, (data_dict, error_dict)))
+            except (KeyError, TypeError, ValueError):
+                # Falta en la respuesta o no paso la validacion: se extrae sola
+                try:
+                    resultados.append((id_factura, await self._extraer_de_texto(texto_factura, path_pdf)))
+                except Exception as e:
+                    resultados.append((id_factura, e))
+        return resultados
@@ -1,11 +1,19 @@
-from fastapi import FastAPI, UploadFile, BackgroundTasks, Request
+from fastapi import FastAPI, UploadFile, BackgroundTasks, Request, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from uagents import Model
-from fetchai.communication import send_message_to_agent, parse_message_from_agent
-from fetchai.registration import register_with_agentverse
-from uagents_core.identity import Identity
-from invoice_models import PDFRequest
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from extraction_pool import ExtractionPool, PoolSaturadoError
+from job_store import crear_job_store, ESTADOS_FINALES
+from work_queue import ColaTrabajos, id_worker
+from result_cache import crear_result_cache
+from rfc_registry import obtener_registro
+from response_router import crear_router_respuestas
+from invoice_agent import InvoiceExtractor, MODEL_NAME, PROMPT_VERSION
+from cfdi_xml import extraer_cfdi
+from telemetry import (
+    EN_VUELO, PROFUNDIDAD_COLA, configurar_trazas, exportar_metricas, extraer_contexto,
+    inyectar_contexto, medir_etapa, span
+)
+from typing import Awaitable, Callable, Optional
 import base64
 import uuid
 import os
@@ -13,29 +21,62 @@ import json
 import logging
 from dotenv import load_dotenv
 import asyncio
-import pdfplumber
+import contextlib
+import functools
 import shutil
 import unicodedata
+import zipfile
+import io
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-webhook_responses: dict[str, dict] = {}
-
-# Almacenamos la ultima respuesta del webhook
-latest_response = None
-response_event = asyncio.Event()
-
 load_dotenv()
 AGENTVERSE_API_KEY = os.getenv("AGENTVERSE_API_KEY")
 TARGET_AGENT_ADDRESS = os.getenv("TARGET_AGENT_ADDRESS") 
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")  
+# Facturas de un mismo lote en proceso a la vez y llamadas al agente/LLM en vuelo en toda la API
+BATCH_MAX_CONCURRENCIA = int(os.getenv("BATCH_MAX_CONCURRENCIA", "4"))
+MAX_LLM_CONCURRENTES = int(os.getenv("MAX_LLM_CONCURRENTES", "8"))
+# agentverse: el texto viaja al agente y el resultado vuelve por el webhook
+# local: InvoiceExtractor corre en este proceso, sin agente, webhook ni ngrok
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "agentverse").lower()
+if EXECUTION_MODE not in ("agentverse", "local"):
+    raise ValueError(f"EXECUTION_MODE desconocido: {EXECUTION_MODE}")
+# Cola persistente de /jobs: con JOB_QUEUE_PATH los jobs sobreviven a reinicios del proceso
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Segundos maximos de espera por el resultado del agente o del extractor local
+TIMEOUT_EXTRACCION = 300.0
+# Segundos sin cambios tras los que /jobs/{job_id}/events envia un keep-alive y relee el job
+SSE_KEEPALIVE = 15.0
+# Registro del webhook con Agentverse al arrancar (REGISTER_WEBHOOK=0 para omitirlo,
+# p. ej. si se registra una sola vez con `python invoice_api.py` antes de levantar los workers)
+REGISTER_WEBHOOK = os.getenv("REGISTER_WEBHOOK", "1") != "0"
+REGISTER_WEBHOOK_MAX_INTENTOS = int(os.getenv("REGISTER_WEBHOOK_MAX_INTENTOS", "5"))
 
-TMP_DIR = "tmp"
-os.makedirs(TMP_DIR, exist_ok=True)
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Arranque y apagado de la API; nada de esto corre al importar el modulo
+    preparacion = None
+    if EXECUTION_MODE == "agentverse":
+        # En segundo plano para no retrasar el arranque si Agentverse tarda o no responde
+        preparacion = asyncio.create_task(preparar_agentverse())
+    iniciar_workers_cola()
+    try:
+        yield
+    finally:
+        if preparacion is not None:
+            preparacion.cancel()
+        await detener_workers_cola()
+        await router_respuestas.cerrar()
+        extraction_pool.cerrar()
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+# Trazas OTLP si OTEL_EXPORTER_OTLP_ENDPOINT esta definido; si no, los spans no hacen nada
+configurar_trazas("fr8-invoice-api")
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,114 +86,516 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
+# Identidades y digest del modelo: derivar las llaves cuesta, se calculan una vez por proceso.
+# uagents y fetchai se importan en el primer uso; en modo local no se cargan.
+@functools.cache
+def identidad_webhook():
+    from uagents_core.identity import Identity
+    return Identity.from_seed("API PDF Processing", 1)
+
+@functools.cache
+def identidad_remitente():
+    from uagents_core.identity import Identity
+    return Identity.from_seed("FastAPIWebhook", 0)
+
+@functools.cache
+def digest_pdf_request():
+    from uagents import Model
+    from invoice_models import PDFRequest
+    return Model.build_schema_digest(PDFRequest)
+
 # Registrar webhook con Agentverse
 def register_webhook():
-    identity = Identity.from_seed("API PDF Processing", 1)
+    """
+    Registra el webhook con Agentverse.
+
+    Returns:
+        bool: True si Agentverse acepto el registro
+    """
+    from fetchai.registration import register_with_agentverse
+    identity = identidad_webhook()
     logger.info(f"Client agent started with address: {identity.address}")
-    register_with_agentverse(
+    registrado = register_with_agentverse(
         identity=identity,
         url=WEBHOOK_URL,
         agentverse_token=AGENTVERSE_API_KEY,
         agent_title="FastAPI Webhook",
         readme="Recibe respuestas de PDF desde Agentverse."
     )
-    logger.info("Webhook registrado con Agentverse")
-register_webhook()
+    if registrado:
+        logger.info("Webhook registrado con Agentverse")
+    return registrado
 
-def leer_texto_pdf(path_pdf):
+async def preparar_agentverse():
     """
-    Lee el texto de un archivo PDF.
-    
-    Args:
-        path_pdf (str): Ruta al archivo PDF
-        
-    Returns:
-        str: Texto extraído del PDF
+    Calcula identidades y digest antes del primer upload y registra el webhook,
+    reintentando con backoff exponencial hasta REGISTER_WEBHOOK_MAX_INTENTOS veces.
     """
-    try:
-        with pdfplumber.open(path_pdf) as pdf:
-            texto = "\n".join([pagina.extract_text() or "" for pagina in pdf.pages])
-        return texto
-    except Exception as e:
-        logger.error(f"Error al leer PDF: {e}")
-        return ""
+    await asyncio.to_thread(identidad_remitente)
+    await asyncio.to_thread(digest_pdf_request)
+    if not REGISTER_WEBHOOK:
+        logger.info("Registro del webhook omitido (REGISTER_WEBHOOK=0)")
+        return
+    for intento in range(1, REGISTER_WEBHOOK_MAX_INTENTOS + 1):
+        try:
+            if await asyncio.to_thread(register_webhook):
+                return
+            logger.warning(f"Agentverse rechazo el registro del webhook (intento {intento})")
+        except Exception as e:
+            logger.warning(f"Error al registrar el webhook (intento {intento}): {e}")
+        if intento < REGISTER_WEBHOOK_MAX_INTENTOS:
+            await asyncio.sleep(min(2 ** intento, 60))
+    logger.error(f"No se pudo registrar el webhook tras {REGISTER_WEBHOOK_MAX_INTENTOS} intentos")
+
+# Pool de procesos para extraer texto de los PDFs sin bloquear el event loop
+extraction_pool = ExtractionPool()
+PROFUNDIDAD_COLA.labels("extraccion").set_function(lambda: extraction_pool.pendientes)
 
-# Tarea para procesar PDF y enviar texto a Agentverse
-async def process_and_send_pdf(file_content: bytes, filename: str):
-    global latest_response, response_event
+# Respuestas pendientes del webhook, indexadas por request_id. Cada upload
+# registra su propio Future y el webhook solo despierta al que le corresponde,
+# aunque llegue a otro worker (RESPONSE_ROUTER=sqlite|redis)
+router_respuestas = crear_router_respuestas()
+PROFUNDIDAD_COLA.labels("webhook").set_function(lambda: router_respuestas.pendientes)
+
+# Almacen de jobs asincronos (JOB_STORE=memory|sqlite)
+job_store = crear_job_store()
+
+# Cola persistente con leases; sus workers arrancan con la API y retoman lo pendiente
+cola_trabajos = ColaTrabajos(JOB_QUEUE_PATH) if JOB_QUEUE_PATH else None
+if cola_trabajos is not None:
+    PROFUNDIDAD_COLA.labels("trabajos").set_function(lambda: cola_trabajos.contar()["queued"])
+workers_cola: list[asyncio.Task] = []
+
+# Limite global de peticiones al agente esperando respuesta del LLM
+llm_semaforo = asyncio.Semaphore(MAX_LLM_CONCURRENTES)
+
+# Cache de texto (por hash del PDF) y de resultados (por hash del texto)
+result_cache = crear_result_cache()
+
+@contextlib.asynccontextmanager
+async def turno_llm():
+    # Adquiere llm_semaforo contando en la metrica las peticiones que esperan turno
+    cola = PROFUNDIDAD_COLA.labels("agente")
+    cola.inc()
     try:
-        # Guardar PDF temporalmente
-        temp_path = os.path.join(TMP_DIR, f"{uuid.uuid4()}_{filename}")
-        with open(temp_path, "wb") as f:
-            f.write(file_content)
-        
-        # Extraer texto del PDF
-        texto = leer_texto_pdf(temp_path)
-        #print(texto)
-        # Eliminar archivo temporal
-        os.remove(temp_path)
-        
-        if not texto:
-            return {"status": "error", "message": "No se pudo extraer texto del PDF"}
-
-        # Enviar texto a Agentverse
-        message = {
-            "path": filename,
-            "content": texto  # Enviar texto en lugar de base64
-        }
-        model_digest = Model.build_schema_digest(PDFRequest)
-
-        # Resetear la respuesta y el evento
-        latest_response = None
-        response_event.clear()
-
-        send_message_to_agent(
-            sender=Identity.from_seed("FastAPIWebhook", 0),
-            target=TARGET_AGENT_ADDRESS,
-            payload=message,
-            model_digest=model_digest
-        )
-        logger.info(f"Texto de {filename} enviado a Agentverse")
-
-        # Esperar la respuesta del webhook (máximo 30 segundos)
+        await llm_semaforo.acquire()
+    finally:
+        cola.dec()
+    try:
+        yield
+    finally:
+        llm_semaforo.release()
+
+async def enviar_a_agentverse(texto: str, filename: str, request_id: str):
+    """
+    Envia el texto al agente de Agentverse y espera su respuesta en el webhook.
+
+    Raises:
+        asyncio.TimeoutError: Si el webhook no responde en TIMEOUT_EXTRACCION segundos
+    """
+    # Registrar el Future de esta peticion antes de enviar el mensaje
+    future = await router_respuestas.registrar(request_id)
+
+    # El contexto de la traza viaja en el mensaje para que el agente y el webhook cuelguen de este span
+    message = {
+        "path": filename,
+        "content": texto,  # Enviar texto en lugar de base64
+        "request_id": request_id,
+        "traceparent": inyectar_contexto().get("traceparent", "")
+    }
+    from fetchai.communication import send_message_to_agent
+    send_message_to_agent(
+        sender=identidad_remitente(),
+        target=TARGET_AGENT_ADDRESS,
+        payload=message,
+        model_digest=digest_pdf_request()
+    )
+    logger.info(f"Texto de {filename} enviado a Agentverse (request_id={request_id})")
+
+    # Esperar la respuesta del webhook (máximo 300 segundos)
+    return await asyncio.wait_for(future, timeout=TIMEOUT_EXTRACCION)
+
+# Extractor del modo local; se crea en el primer uso porque requiere ASI1_API_KEY
+_extractor_local = None
+
+async def extraer_local(texto: str):
+    """
+    Extrae los datos con InvoiceExtractor en este proceso (EXECUTION_MODE=local).
+
+    La cache de resultados la maneja process_and_send_pdf, asi que el
+    extractor se crea sin cache propia.
+    """
+    global _extractor_local
+    if _extractor_local is None:
+        _extractor_local = InvoiceExtractor()
+    resultado, errores = await _extractor_local.extraer_datos_texto_async(texto)
+    return {"status": "received", "resultado": resultado, "errores": errores}
+
+# Tarea para procesar PDF y extraer sus datos con el agente o con el extractor local
+async def process_and_send_pdf(file_content: bytes, filename: str, xml_content: Optional[bytes] = None,
+                               al_cambiar_etapa: Optional[Callable[[str], Awaitable[None]]] = None):
+    request_id = uuid.uuid4().hex
+    EN_VUELO.inc()
+    with medir_etapa("total", **{"invoice.request_id": request_id, "invoice.filename": filename}):
         try:
-            await asyncio.wait_for(response_event.wait(), timeout=300.0)
-            if latest_response:
-                return latest_response
-            else:
+            if xml_content is None and filename.lower().endswith(".xml"):
+                file_content, xml_content = b"", file_content
+
+            # Si hay CFDI en XML (subido o adjunto al PDF) no hace falta el texto ni el LLM
+            with medir_etapa("cfdi"):
+                cfdi = await asyncio.to_thread(extraer_cfdi, file_content, xml_content)
+            if cfdi is not None:
+                logger.info(f"Datos de {filename} leidos del XML del CFDI")
+                resultado, errores = cfdi
+                return {"status": "received", "resultado": resultado, "errores": errores}
+            if not file_content:
+                return {"status": "error", "message": "El XML no es un CFDI valido y no se recibio el PDF"}
+
+            texto = await result_cache.obtener_texto_async(file_content) if result_cache is not None else None
+            if texto is None:
+                # Extraer texto del PDF en el pool de procesos, directo de los bytes en memoria
+                try:
+                    with medir_etapa("pdf"):
+                        texto = await extraction_pool.extraer_texto(file_content)
+                except asyncio.TimeoutError:
+                    return {"status": "error", "message": "Tiempo de espera agotado al extraer texto del PDF"}
+                #print(texto)
+                if texto and result_cache is not None:
+                    await result_cache.guardar_texto_async(file_content, texto)
+        
+            if not texto:
+                return {"status": "error", "message": "No se pudo extraer texto del PDF"}
+
+            # Una factura ya procesada con el mismo prompt, modelo y RFCs propios no vuelve al LLM
+            if result_cache is not None:
+                cacheado = await result_cache.obtener_resultado_async(
+                    texto, PROMPT_VERSION, MODEL_NAME, obtener_registro().digest
+                )
+                if cacheado is not None:
+                    logger.info(f"Resultado de {filename} obtenido de la cache")
+                    resultado, errores = cacheado
+                    return {"status": "received", "resultado": resultado, "errores": errores}
+
+            if al_cambiar_etapa is not None:
+                await al_cambiar_etapa("awaiting_llm")
+            async with turno_llm():
+                with medir_etapa("agente", **{"invoice.request_id": request_id, "invoice.execution_mode": EXECUTION_MODE}):
+                    try:
+                        if EXECUTION_MODE == "local":
+                            respuesta = await asyncio.wait_for(extraer_local(texto), timeout=TIMEOUT_EXTRACCION)
+                        else:
+                            respuesta = await enviar_a_agentverse(texto, filename, request_id)
+                    except asyncio.TimeoutError:
+                        return {"status": "error", "message": "Tiempo de espera agotado para la respuesta"}
+
+            if not respuesta:
                 return {"status": "error", "message": "No se recibió respuesta a tiempo"}
-        except asyncio.TimeoutError:
-            return {"status": "error", "message": "Tiempo de espera agotado para la respuesta"}
+            if result_cache is not None and respuesta.get("resultado"):
+                await result_cache.guardar_resultado_async(
+                    texto, PROMPT_VERSION, MODEL_NAME, respuesta["resultado"], respuesta["errores"],
+                    obtener_registro().digest
+                )
+            return respuesta
 
-    except Exception as e:
-        logger.error(f"Error procesando PDF: {e}")
-        return {"status": "error", "message": str(e)}
-    finally:
-        # Asegurar que el archivo temporal se elimine
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        except PoolSaturadoError:
+            raise
+        except Exception as e:
+            logger.error(f"Error procesando PDF: {e}")
+            return {"status": "error", "message": str(e)}
+        finally:
+            await router_respuestas.descartar(request_id)
+            EN_VUELO.dec()
 
 
 # Endpoint para recibir PDF desde React o alguna otra fuente
 @app.post("/upload-pdf")
-async def upload_pdf(file: UploadFile, background_tasks: BackgroundTasks):
+async def upload_pdf(file: UploadFile, background_tasks: BackgroundTasks, xml: Optional[UploadFile] = File(None)):
 #async def upload_pdf(file: PDFRequest, background_tasks: BackgroundTasks):
     try:
         file_content = await file.read()
         #file_content = base64.b64decode(file.content_b64)
         filename = file.filename
+        # El XML del CFDI es opcional; si llega, tiene prioridad sobre el PDF
+        xml_content = await xml.read() if xml is not None else None
         
         #background_tasks.add_task(process_and_send_pdf, file_content, filename, request_id)
-        result = await process_and_send_pdf(file_content, filename)
+        result = await process_and_send_pdf(file_content, filename, xml_content)
         return JSONResponse(result)
         #return JSONResponse({"status": "PDF recibido, procesando en segundo plano"})
+    except PoolSaturadoError as e:
+        logger.warning(f"Upload rechazado: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=503, headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Error recibiendo PDF: {e}")
         return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
 
+def expandir_archivos(filename: str, file_content: bytes):
+    """
+    Devuelve las facturas de un archivo subido: el propio PDF o XML, o los de un ZIP.
+
+    Dentro de un ZIP, el PDF y el XML con el mismo nombre base se tratan como
+    una sola factura.
+
+    Args:
+        filename (str): Nombre del archivo subido
+        file_content (bytes): Contenido del archivo
+
+    Returns:
+        list: Tuplas (nombre, contenido del PDF, contenido del XML o None) de cada factura
+    """
+    if not zipfile.is_zipfile(io.BytesIO(file_content)):
+        if filename.lower().endswith(".xml"):
+            return [(filename, b"", file_content)]
+        return [(filename, file_content, None)]
+    facturas = {}
+    with zipfile.ZipFile(io.BytesIO(file_content)) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                continue
+            # Solo el nombre base: las rutas internas del ZIP no se usan para escribir en disco
+            nombre = os.path.basename(info.filename)
+            base, extension = os.path.splitext(nombre)
+            extension = extension.lower()
+            if extension not in (".pdf", ".xml"):
+                continue
+            factura = facturas.setdefault(base.lower(), {"nombre": nombre, "pdf": b"", "xml": None})
+            if extension == ".pdf":
+                factura["nombre"] = nombre
+                factura["pdf"] = zf.read(info)
+            else:
+                factura["xml"] = zf.read(info)
+    return [(f["nombre"], f["pdf"], f["xml"]) for f in facturas.values()]
+
+async def procesar_en_lote(indice: int, file_content: bytes, filename: str, xml_content: Optional[bytes], semaforo: asyncio.Semaphore):
+    async with semaforo:
+        # El lote ya fue aceptado: si el pool esta lleno se espera en lugar de fallar
+        while True:
+            try:
+                result = await process_and_send_pdf(file_content, filename, xml_content)
+                break
+            except PoolSaturadoError:
+                await asyncio.sleep(1.0)
+    return {"index": indice, "filename": filename, **result}
+
+# Endpoint para lotes: varios PDFs o un ZIP, resultados en NDJSON conforme terminan
+@app.post("/upload-batch")
+async def upload_batch(files: list[UploadFile]):
+    try:
+        archivos = []
+        for file in files:
+            archivos.extend(expandir_archivos(file.filename, await file.read()))
+    except Exception as e:
+        logger.error(f"Error recibiendo lote: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+    if not archivos:
+        return JSONResponse({"status": "error", "message": "No se recibieron PDFs ni XMLs"}, status_code=400)
+    logger.info(f"Lote recibido con {len(archivos)} facturas")
+
+    async def resultados():
+        semaforo = asyncio.Semaphore(BATCH_MAX_CONCURRENCIA)
+        tareas = [
+            asyncio.create_task(procesar_en_lote(i, contenido, nombre, xml, semaforo))
+            for i, (nombre, contenido, xml) in enumerate(archivos)
+        ]
+        try:
+            for tarea in asyncio.as_completed(tareas):
+                yield json.dumps(await tarea, ensure_ascii=False) + "\n"
+        finally:
+            # Si el cliente se desconecta no se siguen procesando los PDFs restantes
+            for tarea in tareas:
+                tarea.cancel()
+
+    return StreamingResponse(resultados(), media_type="application/x-ndjson")
+
+async def run_job(job_id: str, file_content: bytes, filename: str, xml_content: Optional[bytes] = None):
+    await job_store.actualizar(job_id, status="processing")
+    try:
+        result = await process_and_send_pdf(file_content, filename, xml_content)
+    except PoolSaturadoError as e:
+        result = {"status": "error", "message": str(e)}
+    status = "done" if result.get("status") == "received" else "error"
+    await job_store.actualizar(job_id, status=status, result=result)
+
+async def latir(job_id: str, worker: str):
+    # Renueva el lease mientras el trabajo esta en proceso
+    while True:
+        await asyncio.sleep(cola_trabajos.lease / 3)
+        if not await asyncio.to_thread(cola_trabajos.latido, job_id, worker):
+            logger.warning(f"Lease del job {job_id} perdido por {worker}")
+            return
+
+async def procesar_trabajo(trabajo: dict, worker: str):
+    """
+    Procesa un trabajo tomado de la cola persistente y registra su resultado.
+
+    Un error se reintenta hasta agotar los intentos de la cola; si el proceso
+    se apaga a la mitad, el trabajo vuelve a la cola sin contar el intento.
+    Si el lease se perdio (otro worker retomo el trabajo), el resultado no se
+    publica: lo publica el worker que tiene el lease.
+
+    Las llamadas a la cola son SQLite bloqueante y corren en un hilo para no
+    detener el event loop.
+    """
+    job_id = trabajo["job_id"]
+    await job_store.actualizar(job_id, status="extracting", attempts=trabajo["attempts"])
+
+    async def al_cambiar_etapa(etapa):
+        if await asyncio.to_thread(cola_trabajos.marcar, job_id, worker, etapa):
+            await job_store.actualizar(job_id, status=etapa)
+
+    latidos = asyncio.create_task(latir(job_id, worker))
+    try:
+        result = await process_and_send_pdf(trabajo["pdf"], trabajo["filename"], trabajo["xml"], al_cambiar_etapa)
+    except PoolSaturadoError:
+        # El pool de PDFs esta lleno por otras peticiones: se devuelve el trabajo sin gastar el intento
+        if await asyncio.to_thread(cola_trabajos.liberar, job_id, worker):
+            await job_store.actualizar(job_id, status="queued")
+        await asyncio.sleep(1.0)
+        return
+    except asyncio.CancelledError:
+        await asyncio.to_thread(cola_trabajos.liberar, job_id, worker)
+        raise
+    finally:
+        latidos.cancel()
+
+    if result.get("status") == "received":
+        if not await asyncio.to_thread(cola_trabajos.completar, job_id, worker, result):
+            logger.warning(f"Lease del job {job_id} perdido por {worker}, no se publica su resultado")
+            return
+        await job_store.actualizar(job_id, status="done", result=result)
+        return
+    estado = await asyncio.to_thread(cola_trabajos.fallar, job_id, worker, result.get("message", ""), result)
+    if estado is None:
+        logger.warning(f"Lease del job {job_id} perdido por {worker}, no se publica su error")
+        return
+    logger.warning(f"Job {job_id} fallo en el intento {trabajo['attempts']}: {result.get('message')}")
+    if estado == "failed":
+        await job_store.actualizar(job_id, status="error", result=result)
+    elif estado == "queued":
+        await job_store.actualizar(job_id, status="queued")
+
+async def worker_cola(worker: str):
+    while True:
+        trabajo = await asyncio.to_thread(cola_trabajos.tomar, worker)
+        if trabajo is None:
+            await asyncio.sleep(1.0)
+            continue
+        try:
+            await procesar_trabajo(trabajo, worker)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Un fallo del propio worker no lo detiene; el lease vence y el trabajo se reintenta
+            logger.error(f"Error en el worker {worker} con el job {trabajo['job_id']}: {e}")
+
+def iniciar_workers_cola():
+    if cola_trabajos is None:
+        return
+    logger.info(f"Cola persistente en {JOB_QUEUE_PATH}: {cola_trabajos.contar()}")
+    for _ in range(JOB_WORKERS):
+        workers_cola.append(asyncio.create_task(worker_cola(id_worker())))
+
+async def detener_workers_cola():
+    for tarea in workers_cola:
+        tarea.cancel()
+    await asyncio.gather(*workers_cola, return_exceptions=True)
+    workers_cola.clear()
+
+# Endpoint asincrono: devuelve un job_id de inmediato y procesa en segundo plano
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile, background_tasks: BackgroundTasks, xml: Optional[UploadFile] = File(None)):
+    try:
+        file_content = await file.read()
+        xml_content = await xml.read() if xml is not None else None
+        if cola_trabajos is not None:
+            # La cola absorbe los picos: no se rechaza por el pool de PDFs
+            job_id = await asyncio.to_thread(cola_trabajos.encolar, file.filename, file_content, xml_content)
+            job = await job_store.crear(file.filename, job_id=job_id)
+            return JSONResponse({"job_id": job["job_id"], "status": job["status"]}, status_code=202)
+        if extraction_pool.pendientes >= extraction_pool.max_pendientes:
+            raise PoolSaturadoError(f"Cola de extraccion llena ({extraction_pool.pendientes} PDFs pendientes)")
+        job = await job_store.crear(file.filename)
+        background_tasks.add_task(run_job, job["job_id"], file_content, file.filename, xml_content)
+        return JSONResponse({"job_id": job["job_id"], "status": job["status"]}, status_code=202)
+    except PoolSaturadoError as e:
+        logger.warning(f"Job rechazado: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=503, headers={"Retry-After": "5"})
+    except Exception as e:
+        logger.error(f"Error creando job: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+async def leer_job(job_id: str):
+    """
+    Devuelve el job del almacen o, si no esta (p. ej. tras reiniciar con JOB_STORE=memory), de la cola persistente.
+    """
+    job = await job_store.obtener(job_id)
+    if job is None and cola_trabajos is not None:
+        job = await asyncio.to_thread(cola_trabajos.obtener, job_id)
+        if job is not None and job["status"] == "failed":
+            # La API expone "error" como estado final de fallo en ambos casos
+            job["status"] = "error"
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await leer_job(job_id)
+    if job is None:
+        return JSONResponse({"status": "error", "message": "Job not found"}, status_code=404)
+    return JSONResponse(job)
+
+# Server-sent events con cada cambio de estado del job hasta que termina
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = await leer_job(job_id)
+    if job is None:
+        return JSONResponse({"status": "error", "message": "Job not found"}, status_code=404)
+
+    async def eventos():
+        cola = job_store.suscribir(job_id)
+        try:
+            actual = await leer_job(job_id)
+            enviado = None
+            while True:
+                if actual is None:
+                    # El job se purgo (JOB_TTL) mientras el cliente escuchaba: se cierra el stream
+                    yield f"event: error\ndata: {json.dumps({'job_id': job_id, 'status': 'error', 'message': 'Job not found'})}\n\n"
+                    break
+                if actual["updated_at"] != enviado:
+                    enviado = actual["updated_at"]
+                    yield f"event: {actual['status']}\ndata: {json.dumps(actual)}\n\n"
+                if actual["status"] in ESTADOS_FINALES:
+                    break
+                try:
+                    actual = await asyncio.wait_for(cola.get(), timeout=SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Keep-alive para proxies; se relee el store por si otro proceso lo actualizo
+                    yield ": keep-alive\n\n"
+                    actual = await leer_job(job_id)
+        finally:
+            job_store.desuscribir(job_id, cola)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/cache/stats")
+async def cache_stats():
+    if result_cache is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **result_cache.stats})
+
+@app.get("/metrics")
+async def metrics():
+    metricas = exportar_metricas()
+    if metricas is None:
+        return JSONResponse({"status": "error", "message": "prometheus_client no esta instalado"}, status_code=501)
+    contenido, content_type = metricas
+    return Response(contenido, media_type=content_type)
+
 @app.post("/api/webhook")
 async def webhook(request: Request):
-    global latest_response, response_event
     try:
         # Leer el cuerpo como bytes y decodificar a string
         body = await request.body()
@@ -171,17 +614,23 @@ async def webhook(request: Request):
             return JSONResponse({"status": "error", "message": "Invalid JSON body"}, status_code=400)
 
         # Extraer resultado y errores del payload
+        request_id = payload.get("request_id")
         resultado = payload.get("resultado", {})
         errores = payload.get("errores", {})
-        logger.info(f"Respuesta de Agentverse - Resultado: {resultado}, Errores: {errores}")
+        logger.info(f"Respuesta de Agentverse ({request_id}) - Resultado: {resultado}, Errores: {errores}")
+        if payload.get("status") == "error":
+            # El agente no pudo procesar la factura (p. ej. bandeja llena): el upload termina con error
+            respuesta = {"status": "error", "message": payload.get("message", "Error en el agente")}
+        else:
+            respuesta = {"status": "received", "resultado": resultado, "errores": errores}
 
-        # Almacenar la respuesta y señalar que la respuesta llegó
-        latest_response = {
-            "status": "received",
-            "resultado": resultado,
-            "errores": errores
-        }
-        response_event.set()
+        # Entregar la respuesta unicamente al upload que la espera, en este o en otro worker;
+        # el agente reenvia el traceparent del upload para que este span cuelgue de su traza
+        with span("invoice.webhook", extraer_contexto(request.headers), **{"invoice.request_id": request_id}):
+            entregada = await router_respuestas.entregar(request_id, respuesta)
+            if not entregada:
+                logger.warning(f"Respuesta sin peticion pendiente: request_id={request_id}")
+                return JSONResponse({"status": "error", "message": "Unknown request_id"}, status_code=404)
 
         # Devolver respuesta al agente
         return JSONResponse({
@@ -195,5 +644,6 @@ async def webhook(request: Request):
         return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
 
 if __name__ == "__main__":
-    register_webhook()
+    # Registro unico, p. ej. antes de levantar varios workers con REGISTER_WEBHOOK=0
+    raise SystemExit(0 if register_webhook() else 1)
     
\ No newline at end of file
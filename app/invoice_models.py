@@ -4,6 +4,9 @@ from uagents import Model
 class PDFRequest(Model):
     path: str  
     content: str
+    request_id: str = ""
+    # Contexto W3C de la traza del upload (vacio si no hay trazas configuradas)
+    traceparent: str = ""
 
 class PDFResponse(Model):
     resultado: dict
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Estados de un job; "done" y "error" son finales
+ESTADOS_FINALES = ("done", "error")
+
+
+class JobStore:
+    def __init__(self):
+        """
+        Interfaz comun de los almacenes de jobs.
+
+        Las subclases implementan _guardar/_leer; la notificacion de cambios a
+        los suscriptores (SSE) vive aqui y es siempre en proceso. Los metodos
+        publicos son asincronos para que un almacen bloqueante (SQLite) corra
+        su E/S fuera del event loop (ver _ejecutar).
+        """
+        self._suscriptores: dict[str, set[asyncio.Queue]] = {}
+
+    async def _ejecutar(self, funcion, *args):
+        return funcion(*args)
+
+    def _guardar(self, job):
+        raise NotImplementedError
+
+    def _leer(self, job_id):
+        raise NotImplementedError
+
+    async def crear(self, filename, job_id=None):
+        """
+        Crea un job nuevo en estado "queued".
+
+        Args:
+            filename (str): Nombre del PDF asociado al job
+            job_id (str): Identificador a usar, p. ej. el de la cola persistente (por defecto, uno nuevo)
+
+        Returns:
+            dict: Job creado
+        """
+        ahora = time.time()
+        job = {
+            "job_id": job_id or uuid.uuid4().hex,
+            "filename": filename,
+            "status": "queued",
+            "created_at": ahora,
+            "updated_at": ahora,
+            "result": None
+        }
+        await self._ejecutar(self._guardar, job)
+        return job
+
+    async def obtener(self, job_id):
+        """
+        Devuelve el job o None si no existe.
+        """
+        return await self._ejecutar(self._leer, job_id)
+
+    async def actualizar(self, job_id, **campos):
+        """
+        Actualiza los campos de un job y avisa a sus suscriptores.
+
+        Args:
+            job_id (str): Identificador del job
+            **campos: Campos a sobrescribir (status, result, ...)
+
+        Returns:
+            dict: Job actualizado, o None si no existe
+        """
+        job = await self._ejecutar(self._actualizar, job_id, campos)
+        if job is None:
+            return None
+        for cola in self._suscriptores.get(job_id, ()):
+            cola.put_nowait(job)
+        return job
+
+    def _actualizar(self, job_id, campos):
+        job = self._leer(job_id)
+        if job is None:
+            return None
+        job.update(campos)
+        job["updated_at"] = time.time()
+        self._guardar(job)
+        return job
+
+    def suscribir(self, job_id):
+        """
+        Devuelve una cola que recibe el job cada vez que cambia.
+        """
+        cola = asyncio.Queue()
+        self._suscriptores.setdefault(job_id, set()).add(cola)
+        return cola
+
+    def desuscribir(self, job_id, cola):
+        colas = self._suscriptores.get(job_id)
+        if colas is not None:
+            colas.discard(cola)
+            if not colas:
+                del self._suscriptores[job_id]
+
+
+class InMemoryJobStore(JobStore):
+    def __init__(self, ttl=3600):
+        """
+        Almacen de jobs en memoria del proceso.
+
+        Args:
+            ttl (float): Segundos que se conservan los jobs terminados
+        """
+        super().__init__()
+        self.ttl = ttl
+        self._jobs: dict[str, dict] = {}
+
+    def _guardar(self, job):
+        self._purgar()
+        self._jobs[job["job_id"]] = dict(job)
+
+    def _leer(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def _purgar(self):
+        limite = time.time() - self.ttl
+        vencidos = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in ESTADOS_FINALES and job["updated_at"] < limite
+        ]
+        for job_id in vencidos:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore(JobStore):
+    def __init__(self, path="jobs.db", ttl=3600):
+        """
+        Almacen de jobs en SQLite; sobrevive a reinicios y se puede consultar
+        desde varios procesos.
+
+        Args:
+            path (str): Ruta del archivo SQLite
+            ttl (float): Segundos que se conservan los jobs terminados
+        """
+        super().__init__()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    async def _ejecutar(self, funcion, *args):
+        # sqlite3 bloquea mientras otro proceso escribe: se llama desde un hilo
+        return await asyncio.to_thread(funcion, *args)
+
+    def _guardar(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, status, updated_at, data) VALUES (?, ?, ?, ?)",
+                (job["job_id"], job["status"], job["updated_at"], json.dumps(job))
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*ESTADOS_FINALES, time.time() - self.ttl)
+            )
+            self._conn.commit()
+
+    def _leer(self, job_id):
+        with self._lock:
+            fila = self._conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+
+def crear_job_store():
+    """
+    Crea el almacen de jobs segun JOB_STORE ("memory" o "sqlite").
+
+    Returns:
+        JobStore: Almacen configurado
+    """
+    tipo = os.getenv("JOB_STORE", "memory").lower()
+    ttl = float(os.getenv("JOB_TTL", "3600"))
+    if tipo == "sqlite":
+        return SQLiteJobStore(os.getenv("JOB_STORE_PATH", "jobs.db"), ttl=ttl)
+    if tipo == "memory":
+        return InMemoryJobStore(ttl=ttl)
+    raise ValueError(f"JOB_STORE desconocido: {tipo}")
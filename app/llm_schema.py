@@ -0,0 +1,154 @@
+import json
+import re
+from typing import Optional
+from pydantic import BaseModel, ConfigDict, field_validator
+
+CAMPOS_TEXTO = ("pdf_billed_company_name", "pdf_billing_company_name", "pdf_provider_bill_uuid", "pdf_currency_code")
+CAMPOS_MONTO = ("pdf_sub_total", "pdf_traslado", "pdf_retencion", "pdf_total")
+
+_DECODER = json.JSONDecoder()
+_COMA_FINAL_RE = re.compile(r",\s*([}\]])")
+
+
+class DatosFacturaLLM(BaseModel):
+    """
+    Campos que devuelve el modelo. Todos son opcionales porque el prompt solo
+    pide los que las reglas no llenaron; validar_respuesta exige los pedidos.
+    """
+
+    model_config = ConfigDict(extra="ignore")
+
+    pdf_billed_company_name: Optional[str] = None
+    pdf_billing_company_name: Optional[str] = None
+    pdf_provider_bill_uuid: Optional[str] = None
+    pdf_currency_code: Optional[str] = None
+    pdf_sub_total: Optional[float] = None
+    pdf_traslado: Optional[float] = None
+    pdf_retencion: Optional[float] = None
+    pdf_total: Optional[float] = None
+
+    @field_validator(*CAMPOS_TEXTO, mode="before")
+    @classmethod
+    def _texto(cls, valor):
+        # El modelo a veces responde 0 numerico o null en lugar de "0"
+        if valor is None or valor == "" or valor == 0:
+            return "0"
+        return str(valor).strip()
+
+    @field_validator("pdf_provider_bill_uuid", "pdf_currency_code")
+    @classmethod
+    def _mayusculas(cls, valor):
+        return valor.upper()
+
+    @field_validator(*CAMPOS_MONTO, mode="before")
+    @classmethod
+    def _monto(cls, valor):
+        # "$1,234.50" -> 1234.50
+        if isinstance(valor, str):
+            valor = valor.replace("$", "").replace(",", "").strip() or 0
+        return 0 if valor is None else valor
+
+
+def detector_fin(validar):
+    """
+    Crea el callback de ASI1Client.post_stream que corta el stream en cuanto
+    el texto recibido contiene una respuesta valida.
+
+    Se valida cada vez que llega un cierre de llave o corchete, sin seguir el
+    anidamiento: las llaves del texto libre que el modelo escribe antes del
+    JSON no retrasan ni impiden el corte.
+
+    Args:
+        validar (callable): Recibe el texto acumulado y lanza ValueError si
+            todavia no es una respuesta valida
+
+    Returns:
+        callable: Recibe cada fragmento y devuelve True cuando se puede cortar
+    """
+    partes = []
+
+    def al_recibir(fragmento):
+        partes.append(fragmento)
+        if "}" not in fragmento and "]" not in fragmento:
+            return False
+        try:
+            validar("".join(partes))
+        except ValueError:
+            return False
+        return True
+
+    return al_recibir
+
+
+def _candidatos(texto, apertura):
+    # En cada apertura se prueba el texto tal cual y, si no es JSON, sin comas finales
+    posicion = texto.find(apertura)
+    while posicion != -1:
+        for candidato in (texto[posicion:], _COMA_FINAL_RE.sub(r"\1", texto[posicion:])):
+            try:
+                valor, _ = _DECODER.raw_decode(candidato)
+                yield valor
+                break
+            except json.JSONDecodeError:
+                pass
+        posicion = texto.find(apertura, posicion + 1)
+
+
+def extraer_json(texto, tipo=dict, validar=None):
+    """
+    Recupera el primer valor JSON del tipo pedido dentro de la respuesta.
+
+    Tolera texto antes o despues, bloques ```json``` y comas finales, sin
+    depender de que la respuesta empiece con "{". Con validar, se sigue
+    buscando hasta el primer valor que pasa la validacion, asi un objeto en
+    el texto libre previo no tapa a la respuesta.
+
+    Args:
+        texto (str): Respuesta del modelo
+        tipo (type): dict o list
+        validar (callable): Recibe cada valor candidato, devuelve el valor
+            validado y lanza ValueError si no es la respuesta (opcional)
+
+    Returns:
+        dict | list: Primer valor JSON valido del tipo pedido, o lo que
+            devuelve validar para el primero que la pasa
+
+    Raises:
+        ValueError: Si ningun valor pasa la validacion (el error del ultimo candidato)
+        json.JSONDecodeError: Si no hay ningun valor JSON valido de ese tipo
+    """
+    error = None
+    for valor in _candidatos(texto, "{" if tipo is dict else "["):
+        if not isinstance(valor, tipo):
+            continue
+        if validar is None:
+            return valor
+        try:
+            return validar(valor)
+        except ValueError as e:
+            error = e
+    if error is not None:
+        raise error
+    raise json.JSONDecodeError("No se encontro un JSON valido en la respuesta", texto, 0)
+
+
+def validar_respuesta(datos, campos):
+    """
+    Valida los campos devueltos por el modelo.
+
+    Args:
+        datos (dict): Objeto JSON de la respuesta
+        campos (list): Campos que se pidieron al modelo
+
+    Returns:
+        dict: Solo los campos pedidos, normalizados
+
+    Raises:
+        ValueError: Si falta un campo pedido o su valor no es valido
+            (pydantic.ValidationError es subclase de ValueError)
+    """
+    validado = DatosFacturaLLM.model_validate(datos).model_dump()
+    faltantes = [campo for campo in campos if validado[campo] is None]
+    if faltantes:
+        raise ValueError(f"Faltan campos en la respuesta del modelo: {', '.join(faltantes)}")
+    return {campo: validado[campo] for campo in campos}
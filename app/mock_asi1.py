@@ -0,0 +1,148 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bloques de factura y campos pedidos en los prompts de InvoiceExtractor
+FACTURA_RE = re.compile(r"Factura( F\d+)?:\n        ---\n        (.*?)\n        ---", re.DOTALL)
+CAMPO_RE = re.compile(r'"(pdf_\w+)": "(?:string|float)"')
+
+# Caracteres por evento SSE en las respuestas por streaming
+TAMANO_FRAGMENTO = 16
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        simulado = self.server.simulado
+        peticion = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        contenido = simulado.responder(peticion["messages"][0]["content"])
+        if simulado.latencia:
+            time.sleep(simulado.latencia)
+
+        if not peticion.get("stream"):
+            cuerpo = json.dumps({"choices": [{"message": {"role": "assistant", "content": contenido}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+            simulado.contar(contenido)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        enviado = ""
+        try:
+            for i in range(0, len(contenido), TAMANO_FRAGMENTO):
+                fragmento = contenido[i:i + TAMANO_FRAGMENTO]
+                self._enviar_evento(json.dumps({"choices": [{"delta": {"content": fragmento}}]}))
+                enviado += fragmento
+            self._enviar_evento("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente corto el stream en cuanto tuvo un JSON valido
+            self.close_connection = True
+        simulado.contar(enviado)
+
+    def _enviar_evento(self, datos):
+        evento = f"data: {datos}\n\n".encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(evento), evento))
+        self.wfile.flush()
+
+
+class ServidorASI1Simulado:
+    def __init__(self, latencia=0.0, host="127.0.0.1", puerto=0):
+        """
+        Servidor local compatible con el endpoint de chat completions de ASI1.
+
+        Responde a los prompts de InvoiceExtractor (individuales y por lote)
+        con los campos registrados para el texto de cada factura, en JSON o
+        por streaming SSE segun lo pida la peticion.
+
+        Args:
+            latencia (float): Segundos de espera antes de cada respuesta
+            host (str): Direccion de escucha
+            puerto (int): Puerto de escucha (0 para uno libre)
+        """
+        self.latencia = latencia
+        self.respuestas = {}
+        # Campos que el modelo respondio por texto de factura
+        self.respondidos = {}
+        self.llamadas = 0
+        self.caracteres_enviados = 0
+        self._lock = threading.Lock()
+        self._servidor = ThreadingHTTPServer((host, puerto), _Manejador)
+        self._servidor.daemon_threads = True
+        self._servidor.simulado = self
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._servidor.server_address[:2]
+        return f"http://{host}:{puerto}/v1/chat/completions"
+
+    def registrar(self, texto_factura, campos):
+        """
+        Registra la respuesta del modelo para una factura.
+
+        Args:
+            texto_factura (str): Texto de la factura tal como aparece en el prompt
+            campos (dict): Campos que el modelo devuelve para esa factura
+        """
+        self.respuestas[texto_factura.strip()] = campos
+
+    def responder(self, prompt):
+        """
+        Arma el contenido de la respuesta para un prompt.
+
+        Los campos que no estan registrados se responden con "0", como haria
+        el modelo con un campo que no encuentra.
+        """
+        pedidos = CAMPO_RE.findall(prompt)
+        objetos = []
+        for id_factura, texto in FACTURA_RE.findall(prompt):
+            registrados = self.respuestas.get(texto.strip(), {})
+            objeto = {"id": id_factura.strip()} if id_factura else {}
+            for campo in pedidos:
+                objeto[campo] = registrados.get(campo, "0")
+            objetos.append(objeto)
+        with self._lock:
+            self.llamadas += 1
+            for _, texto in FACTURA_RE.findall(prompt):
+                self.respondidos.setdefault(texto.strip(), set()).update(pedidos)
+        if len(objetos) == 1 and "id" not in objetos[0]:
+            return json.dumps(objetos[0], ensure_ascii=False)
+        return json.dumps({"facturas": objetos}, ensure_ascii=False)
+
+    def contar(self, contenido):
+        with self._lock:
+            self.caracteres_enviados += len(contenido)
+
+    def reiniciar_contadores(self):
+        with self._lock:
+            self.llamadas = 0
+            self.caracteres_enviados = 0
+            self.respondidos = {}
+
+    def iniciar(self):
+        """
+        Atiende peticiones en un hilo daemon.
+
+        Returns:
+            str: URL del endpoint de chat completions
+        """
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, name="asi1-simulado", daemon=True)
+        self._hilo.start()
+        return self.url
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
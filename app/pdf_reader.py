@@ -0,0 +1,218 @@
+from contextlib import closing
+import io
+import os
+import threading
+import unicodedata
+from rule_extractor import extraer_campos_reglas
+
+# Campos que, encontrados por reglas, permiten dejar de leer paginas
+CAMPOS_PARADA = ("pdf_provider_bill_uuid", "pdf_sub_total", "pdf_traslado", "pdf_retencion", "pdf_total")
+
+# Umbrales para decidir que el texto de una pagina salio roto
+MAX_CARACTERES_SOSPECHOSOS = 0.02
+MIN_ALFANUMERICOS = 0.5
+MAX_LARGO_PROMEDIO_PALABRA = 25
+
+# pdfium no es seguro entre hilos: todas las llamadas del proceso se serializan
+PDFIUM_LOCK = threading.Lock()
+
+
+def _fuente(pdf):
+    # Los bytes se envuelven sin copiarlos a disco; las rutas se abren tal cual
+    if isinstance(pdf, (bytes, bytearray, memoryview)):
+        return io.BytesIO(pdf)
+    return pdf
+
+
+class PDFBackend:
+    """
+    Extractor de texto de PDF; cada implementacion genera el texto de cada pagina.
+
+    Cada backend importa su biblioteca en el primer uso, asi que importar este
+    modulo no carga pdfplumber, pypdfium2 ni pdfminer.
+    """
+
+    nombre = ""
+
+    def iterar_paginas(self, pdf):
+        """
+        Genera el texto de cada pagina del PDF, analizandola una sola vez.
+
+        Args:
+            pdf (str | bytes): Ruta o contenido del PDF
+
+        Yields:
+            str: Texto de la pagina (vacio si no tiene texto)
+        """
+        raise NotImplementedError
+
+
+class PdfplumberBackend(PDFBackend):
+    nombre = "pdfplumber"
+
+    def iterar_paginas(self, pdf):
+        import pdfplumber
+        # La cache de cada pagina se libera en cuanto se entrega su texto
+        with pdfplumber.open(_fuente(pdf)) as documento:
+            for pagina in documento.pages:
+                try:
+                    yield pagina.extract_text() or ""
+                finally:
+                    pagina.close()
+
+
+class Pypdfium2Backend(PDFBackend):
+    nombre = "pypdfium2"
+
+    def iterar_paginas(self, pdf):
+        import pypdfium2 as pdfium
+        with PDFIUM_LOCK:
+            documento = pdfium.PdfDocument(_fuente(pdf))
+            paginas = len(documento)
+        try:
+            for i in range(paginas):
+                with PDFIUM_LOCK:
+                    pagina = documento[i]
+                    textpage = pagina.get_textpage()
+                    try:
+                        texto = textpage.get_text_bounded()
+                    finally:
+                        textpage.close()
+                        pagina.close()
+                yield texto.replace("\r\n", "\n").replace("\r", "\n")
+        finally:
+            with PDFIUM_LOCK:
+                documento.close()
+
+
+class PdfminerBackend(PDFBackend):
+    nombre = "pdfminer"
+
+    def iterar_paginas(self, pdf):
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LAParams, LTTextContainer
+        for layout in extract_pages(_fuente(pdf), laparams=LAParams()):
+            yield "".join(
+                elemento.get_text() for elemento in layout if isinstance(elemento, LTTextContainer)
+            ).strip("\n")
+
+
+BACKENDS = {
+    backend.nombre: backend for backend in (Pypdfium2Backend, PdfminerBackend, PdfplumberBackend)
+}
+
+
+def obtener_backend(nombre=None):
+    """
+    Crea el backend de extraccion indicado.
+
+    Args:
+        nombre (str): pypdfium2, pdfminer o pdfplumber (PDF_BACKEND, por defecto pdfplumber)
+
+    Returns:
+        PDFBackend: Backend de extraccion
+
+    Raises:
+        ValueError: Si el backend no existe
+    """
+    nombre = nombre or os.getenv("PDF_BACKEND", "pdfplumber")
+    if nombre not in BACKENDS:
+        raise ValueError(f"PDF_BACKEND desconocido: {nombre} (opciones: {', '.join(BACKENDS)})")
+    return BACKENDS[nombre]()
+
+
+def texto_legible(texto):
+    """
+    Indica si el texto de una pagina parece correcto.
+
+    Se considera roto si esta vacio, si tiene caracteres de reemplazo, de
+    control o "(cid:N)" (fuentes sin mapa a Unicode), si casi no tiene letras
+    ni digitos o si las palabras salen pegadas.
+    """
+    visibles = [c for c in texto if not c.isspace()]
+    if not visibles:
+        return False
+    sospechosos = sum(
+        1 for c in visibles if c == "\ufffd" or unicodedata.category(c) in ("Cc", "Co", "Cn")
+    ) + 5 * texto.count("(cid:")
+    if sospechosos / len(visibles) > MAX_CARACTERES_SOSPECHOSOS:
+        return False
+    if sum(1 for c in visibles if c.isalnum()) / len(visibles) < MIN_ALFANUMERICOS:
+        return False
+    palabras = texto.split()
+    return len(visibles) / len(palabras) <= MAX_LARGO_PROMEDIO_PALABRA
+
+
+def iterar_paginas(pdf, backend=None):
+    """
+    Genera el texto de cada pagina con el backend configurado.
+
+    Las paginas cuyo texto no pasa texto_legible se vuelven a leer con
+    pdfplumber; el PDF solo se abre con pdfplumber si hace falta.
+
+    Args:
+        pdf (str | bytes): Ruta o contenido del PDF
+        backend (PDFBackend): Backend a usar (por defecto, obtener_backend())
+
+    Yields:
+        str: Texto de la pagina (vacio si no tiene texto)
+    """
+    backend = backend or obtener_backend()
+    respaldo = None
+    try:
+        with closing(backend.iterar_paginas(pdf)) as textos:
+            for numero, texto in enumerate(textos):
+                if backend.nombre != PdfplumberBackend.nombre and not texto_legible(texto):
+                    if respaldo is None:
+                        import pdfplumber
+                        respaldo = pdfplumber.open(_fuente(pdf))
+                    pagina = respaldo.pages[numero]
+                    try:
+                        texto = pagina.extract_text() or ""
+                    finally:
+                        pagina.close()
+                yield texto
+    finally:
+        if respaldo is not None:
+            respaldo.close()
+
+
+def campos_completos(texto):
+    """
+    Indica si las reglas ya encuentran el UUID y todos los montos en el texto.
+    """
+    campos = extraer_campos_reglas(texto)
+    return all(campo in campos for campo in CAMPOS_PARADA)
+
+
+def _leer_paginas(pdf, parada_temprana, backend):
+    paginas = []
+    with closing(iterar_paginas(pdf, backend)) as textos:
+        for texto in textos:
+            if not texto:
+                continue
+            paginas.append(texto)
+            if parada_temprana and campos_completos("\n".join(paginas)):
+                break
+    return "\n".join(paginas)
+
+
+def leer_texto_pdf(pdf, parada_temprana=None, backend=None):
+    """
+    Lee el texto de un PDF pagina por pagina.
+
+    Solo las paginas que no pasan texto_legible se releen con pdfplumber
+    (ver iterar_paginas); el resto del documento se lee una sola vez.
+
+    Args:
+        pdf (str | bytes): Ruta o contenido del PDF
+        parada_temprana (bool): Dejar de leer cuando las paginas leidas ya
+            contienen el UUID y los montos (PDF_PARADA_TEMPRANA, por defecto inactivo)
+        backend (PDFBackend): Backend de extraccion (por defecto, PDF_BACKEND)
+
+    Returns:
+        str: Texto de las paginas leidas, separadas por salto de linea
+    """
+    if parada_temprana is None:
+        parada_temprana = os.getenv("PDF_PARADA_TEMPRANA", "0") == "1"
+    return _leer_paginas(pdf, parada_temprana, backend or obtener_backend())
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from work_queue import id_worker
+
+
+class RouterRespuestas:
+    def __init__(self):
+        """
+        Interfaz comun de los routers de respuestas del webhook.
+
+        Cada upload registra un Future por request_id y espera en el; el
+        webhook entrega la respuesta con entregar(). Si el Future vive en este
+        proceso se resuelve directo; si no, las subclases compartidas la
+        publican para el worker que la espera (_anunciar/_publicar/_retirar).
+        """
+        self.worker = id_worker()
+        self._esperas: dict[str, asyncio.Future] = {}
+
+    async def _anunciar(self, request_id):
+        pass
+
+    async def _publicar(self, request_id, respuesta):
+        return False
+
+    async def _retirar(self, request_id):
+        pass
+
+    async def registrar(self, request_id):
+        """
+        Registra la espera de una respuesta; llamar antes de enviar el mensaje al agente.
+
+        Returns:
+            asyncio.Future: Future que recibe la respuesta
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._esperas[request_id] = future
+        await self._anunciar(request_id)
+        return future
+
+    async def entregar(self, request_id, respuesta):
+        """
+        Entrega la respuesta del webhook al upload que la espera, en este u otro proceso.
+
+        Args:
+            request_id (str): Identificador de la peticion
+            respuesta (dict): Respuesta a entregar
+
+        Returns:
+            bool: False si ningun worker espera ese request_id
+        """
+        future = self._esperas.get(request_id)
+        if future is not None:
+            if not future.done():
+                future.set_result(respuesta)
+            return True
+        return await self._publicar(request_id, respuesta)
+
+    async def descartar(self, request_id):
+        """
+        Olvida la espera de un request_id (respondido, vencido o con error).
+        """
+        if self._esperas.pop(request_id, None) is not None:
+            await self._retirar(request_id)
+
+    @property
+    def pendientes(self):
+        return len(self._esperas)
+
+    async def cerrar(self):
+        pass
+
+
+class RouterEnProceso(RouterRespuestas):
+    """
+    Router en memoria: el webhook debe llegar al mismo proceso que hizo el upload (un solo worker).
+    """
+
+
+class RouterSQLite(RouterRespuestas):
+    def __init__(self, path="respuestas.db", intervalo=0.05, ttl=900):
+        """
+        Router compartido por los procesos de un mismo host a traves de SQLite.
+
+        Las esperas se anotan en la tabla esperas; el webhook que recibe una
+        respuesta ajena la guarda en respuestas y el worker que la espera la
+        recoge sondeando cada `intervalo` segundos (solo mientras tiene esperas).
+
+        Args:
+            path (str): Ruta del archivo SQLite, la misma para todos los workers
+            intervalo (float): Segundos entre sondeos de respuestas
+            ttl (float): Segundos tras los que se borran esperas y respuestas huerfanas
+        """
+        super().__init__()
+        self.intervalo = intervalo
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sondeo = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS esperas (request_id TEXT PRIMARY KEY, worker TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS respuestas (request_id TEXT PRIMARY KEY, worker TEXT NOT NULL, "
+            "data TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS respuestas_worker ON respuestas (worker)")
+
+    # Las consultas bloquean hasta `timeout` segundos si otro worker tiene la base: se corren en un hilo
+    def _anotar_espera(self, request_id):
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM esperas WHERE created_at < ?", (ahora - self.ttl,))
+            self._conn.execute("DELETE FROM respuestas WHERE created_at < ?", (ahora - self.ttl,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO esperas (request_id, worker, created_at) VALUES (?, ?, ?)",
+                (request_id, self.worker, ahora)
+            )
+
+    def _guardar_respuesta(self, request_id, data):
+        with self._lock:
+            fila = self._conn.execute("SELECT worker FROM esperas WHERE request_id = ?", (request_id,)).fetchone()
+            if fila is None:
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respuestas (request_id, worker, data, created_at) VALUES (?, ?, ?, ?)",
+                (request_id, fila[0], data, time.time())
+            )
+        return True
+
+    def _borrar(self, request_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM esperas WHERE request_id = ?", (request_id,))
+            self._conn.execute("DELETE FROM respuestas WHERE request_id = ?", (request_id,))
+
+    def _leer_respuestas(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT request_id, data FROM respuestas WHERE worker = ?", (self.worker,)
+            ).fetchall()
+
+    async def _anunciar(self, request_id):
+        await asyncio.to_thread(self._anotar_espera, request_id)
+        if self._sondeo is None or self._sondeo.done():
+            self._sondeo = asyncio.create_task(self._sondear())
+
+    async def _publicar(self, request_id, respuesta):
+        return await asyncio.to_thread(self._guardar_respuesta, request_id, json.dumps(respuesta))
+
+    async def _retirar(self, request_id):
+        await asyncio.to_thread(self._borrar, request_id)
+
+    async def _sondear(self):
+        # Recoge las respuestas dirigidas a este worker; termina cuando no quedan esperas
+        while self._esperas:
+            for request_id, data in await asyncio.to_thread(self._leer_respuestas):
+                future = self._esperas.get(request_id)
+                if future is not None and not future.done():
+                    future.set_result(json.loads(data))
+            await asyncio.sleep(self.intervalo)
+
+    async def cerrar(self):
+        if self._sondeo is not None:
+            self._sondeo.cancel()
+        with self._lock:
+            self._conn.close()
+
+
+class RouterRedis(RouterRespuestas):
+    def __init__(self, url="redis://localhost:6379/0", cliente=None, prefijo="fr8:respuestas", ttl=900):
+        """
+        Router compartido entre hosts (varios pods) a traves de Redis.
+
+        Cada espera se anota en la llave <prefijo>:espera:<request_id> con el
+        worker que la tiene; el webhook publica la respuesta en el canal de ese
+        worker, al que este esta suscrito mientras tiene esperas.
+
+        Args:
+            url (str): URL de Redis (REDIS_URL)
+            cliente: Cliente redis.asyncio ya creado; p.ej. fakeredis.aioredis.FakeRedis() para pruebas sin servidor
+            prefijo (str): Prefijo de llaves y canales
+            ttl (float): Segundos que vive la llave de una espera
+        """
+        super().__init__()
+        if cliente is None:
+            try:
+                import redis.asyncio
+            except ImportError as e:
+                raise ImportError("RESPONSE_ROUTER=redis requiere el paquete redis (pip install redis)") from e
+            cliente = redis.asyncio.from_url(url)
+        self.cliente = cliente
+        self.prefijo = prefijo
+        self.ttl = int(ttl)
+        self.canal = f"{prefijo}:worker:{self.worker}"
+        self._pubsub = None
+        self._escucha = None
+
+    async def _anunciar(self, request_id):
+        if self._escucha is None or self._escucha.done():
+            # La suscripcion de una escucha que termino se cierra antes de reemplazarla
+            if self._pubsub is not None:
+                await self._pubsub.aclose()
+            # Suscribirse antes de anotar la espera para no perder una respuesta rapida
+            self._pubsub = self.cliente.pubsub()
+            await self._pubsub.subscribe(self.canal)
+            self._escucha = asyncio.create_task(self._escuchar())
+        await self.cliente.set(f"{self.prefijo}:espera:{request_id}", self.canal, ex=self.ttl)
+
+    async def _publicar(self, request_id, respuesta):
+        canal = await self.cliente.get(f"{self.prefijo}:espera:{request_id}")
+        if canal is None:
+            return False
+        mensaje = json.dumps({"request_id": request_id, "respuesta": respuesta})
+        # Sin suscriptores el worker ya no existe: la respuesta no tiene a quien llegar
+        return await self.cliente.publish(canal, mensaje) > 0
+
+    async def _retirar(self, request_id):
+        await self.cliente.delete(f"{self.prefijo}:espera:{request_id}")
+
+    async def _escuchar(self):
+        while True:
+            mensaje = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if mensaje is None:
+                continue
+            datos = json.loads(mensaje["data"])
+            future = self._esperas.get(datos["request_id"])
+            if future is not None and not future.done():
+                future.set_result(datos["respuesta"])
+
+    async def cerrar(self):
+        if self._escucha is not None:
+            self._escucha.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self.cliente.aclose()
+
+
+def crear_router_respuestas():
+    """
+    Crea el router de respuestas segun RESPONSE_ROUTER ("memory", "sqlite" o "redis").
+
+    Returns:
+        RouterRespuestas: Router configurado
+    """
+    tipo = os.getenv("RESPONSE_ROUTER", "memory").lower()
+    if tipo == "memory":
+        return RouterEnProceso()
+    if tipo == "sqlite":
+        return RouterSQLite(os.getenv("RESPONSE_ROUTER_PATH", "respuestas.db"))
+    if tipo == "redis":
+        return RouterRedis(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"RESPONSE_ROUTER desconocido: {tipo}")
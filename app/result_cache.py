@@ -0,0 +1,216 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def normalizar_texto(texto):
+    """
+    Colapsa espacios y saltos de linea para que diferencias de formato en la
+    extraccion no generen claves distintas.
+    """
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+def hash_pdf(pdf_bytes):
+    """SHA-256 del contenido del PDF (clave del nivel 1)."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def hash_resultado(texto, prompt_version, model_name, config=""):
+    """SHA-256 del texto normalizado, version del prompt, modelo y configuracion del registro de RFCs (clave del nivel 2)."""
+    base = f"{prompt_version}\0{model_name}\0{config}\0{normalizar_texto(texto)}"
+    return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+
+class LRUTier:
+    def __init__(self, max_entries=1024, ttl=86400):
+        """
+        Nivel en memoria con expulsion LRU por numero de entradas y por TTL.
+
+        Args:
+            max_entries (int): Entradas maximas antes de expulsar la menos usada
+            ttl (float): Segundos de vida de cada entrada
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            valor, expira = entrada
+            if expira < time.time():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (valor, time.time() + self.ttl)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entries:
+                self._datos.popitem(last=False)
+
+
+class SQLiteTier:
+    def __init__(self, path, max_entries=100000, ttl=86400):
+        """
+        Nivel persistente en SQLite, compartido entre procesos y reinicios.
+
+        Args:
+            path (str): Ruta del archivo SQLite
+            max_entries (int): Entradas maximas entre ambos niveles
+            ttl (float): Segundos de vida de cada entrada
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                clave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL,
+                expira REAL NOT NULL,
+                usado REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, clave):
+        ahora = time.time()
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT valor FROM cache WHERE clave = ? AND expira >= ?", (clave, ahora)
+            ).fetchone()
+            if fila is None:
+                return None
+            self._conn.execute("UPDATE cache SET usado = ? WHERE clave = ?", (ahora, clave))
+            self._conn.commit()
+        return json.loads(fila[0])
+
+    def set(self, clave, valor):
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (clave, valor, expira, usado) VALUES (?, ?, ?, ?)",
+                (clave, json.dumps(valor), ahora + self.ttl, ahora)
+            )
+            self._conn.execute("DELETE FROM cache WHERE expira < ?", (ahora,))
+            self._conn.execute(
+                """
+                DELETE FROM cache WHERE clave IN (
+                    SELECT clave FROM cache ORDER BY usado DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+
+class ResultCache:
+    def __init__(self, max_entries=1024, ttl=86400, sqlite_path=None):
+        """
+        Cache de dos niveles direccionada por contenido.
+
+        Nivel 1: SHA-256 del PDF -> texto extraido.
+        Nivel 2: hash del texto normalizado + version del prompt + modelo -> (datos, errores).
+
+        Cada nivel tiene una capa LRU en memoria y, si se indica sqlite_path,
+        una capa en disco que se consulta cuando la de memoria falla.
+
+        Args:
+            max_entries (int): Entradas maximas de cada capa en memoria
+            ttl (float): Segundos de vida de cada entrada
+            sqlite_path (str): Ruta del archivo SQLite, o None para solo memoria
+        """
+        self._memoria = {"texto": LRUTier(max_entries, ttl), "resultado": LRUTier(max_entries, ttl)}
+        self._disco = SQLiteTier(sqlite_path, ttl=ttl) if sqlite_path else None
+        self.stats = {"texto": {"hits": 0, "misses": 0}, "resultado": {"hits": 0, "misses": 0}}
+
+    def _get(self, nivel, clave):
+        valor = self._memoria[nivel].get(clave)
+        if valor is None and self._disco is not None:
+            valor = self._disco.get(f"{nivel}:{clave}")
+            if valor is not None:
+                self._memoria[nivel].set(clave, valor)
+        self.stats[nivel]["hits" if valor is not None else "misses"] += 1
+        return valor
+
+    def _set(self, nivel, clave, valor):
+        self._memoria[nivel].set(clave, valor)
+        if self._disco is not None:
+            self._disco.set(f"{nivel}:{clave}", valor)
+
+    def obtener_texto(self, pdf_bytes):
+        """
+        Devuelve el texto ya extraido de un PDF identico, o None.
+        """
+        return self._get("texto", hash_pdf(pdf_bytes))
+
+    def guardar_texto(self, pdf_bytes, texto):
+        self._set("texto", hash_pdf(pdf_bytes), texto)
+
+    def obtener_resultado(self, texto, prompt_version, model_name, config=""):
+        """
+        Devuelve la tupla (datos, errores) de un texto ya procesado, o None.
+
+        `config` es el digest del registro de RFCs (RegistroRFC.digest): los
+        resultados resueltos con otros RFCs propios no se reutilizan.
+        """
+        valor = self._get("resultado", hash_resultado(texto, prompt_version, model_name, config))
+        return tuple(valor) if valor is not None else None
+
+    def guardar_resultado(self, texto, prompt_version, model_name, data_dict, error_dict, config=""):
+        self._set("resultado", hash_resultado(texto, prompt_version, model_name, config), [data_dict, error_dict])
+
+    async def _en_hilo(self, funcion, *args):
+        # Solo la capa en disco bloquea: sin ella la consulta es en memoria y no cambia de hilo
+        if self._disco is None:
+            return funcion(*args)
+        return await asyncio.to_thread(funcion, *args)
+
+    async def obtener_texto_async(self, pdf_bytes):
+        """Version de obtener_texto para el event loop: SQLite se consulta en un hilo."""
+        return await self._en_hilo(self.obtener_texto, pdf_bytes)
+
+    async def guardar_texto_async(self, pdf_bytes, texto):
+        await self._en_hilo(self.guardar_texto, pdf_bytes, texto)
+
+    async def obtener_resultado_async(self, texto, prompt_version, model_name, config=""):
+        """Version de obtener_resultado para el event loop: SQLite se consulta en un hilo."""
+        return await self._en_hilo(self.obtener_resultado, texto, prompt_version, model_name, config)
+
+    async def guardar_resultado_async(self, texto, prompt_version, model_name, data_dict, error_dict, config=""):
+        await self._en_hilo(self.guardar_resultado, texto, prompt_version, model_name, data_dict, error_dict, config)
+
+
+def crear_result_cache():
+    """
+    Crea la cache segun las variables de entorno.
+
+    CACHE_ENABLED (1/0), CACHE_MAX_ENTRIES, CACHE_TTL y CACHE_SQLITE_PATH
+    (vacio para usar solo memoria).
+
+    Returns:
+        ResultCache: Cache configurada, o None si esta deshabilitada
+    """
+    if os.getenv("CACHE_ENABLED", "1") == "0":
+        return None
+    return ResultCache(
+        max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")),
+        ttl=float(os.getenv("CACHE_TTL", "86400")),
+        sqlite_path=os.getenv("CACHE_SQLITE_PATH") or None
+    )
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from rule_extractor import RFCS_GENERICOS, ordenar_rfcs
+
+# RFC propio cuando no se configura ninguno
+RFC_PROPIO_POR_DEFECTO = "FHM190118EN7"
+
+
+def _leer_propios(texto):
+    """
+    Lee RFCs propios, uno por linea como "RFC" o "RFC,Nombre"; ignora lineas vacias y comentarios (#).
+
+    Returns:
+        dict: RFC -> nombre (None si no se indico)
+    """
+    propios = {}
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if not linea or linea.startswith("#"):
+            continue
+        rfc, _, nombre = linea.partition(",")
+        propios[rfc.strip().upper()] = nombre.strip() or None
+    return propios
+
+
+class RegistroRFC:
+    def __init__(self, propios=None, contrapartes_path=None, min_coincidencias=None):
+        """
+        Registro de RFCs de las empresas propias y de las contrapartes conocidas.
+
+        Con el registro, los roles de la factura se resuelven sin el modelo:
+        el receptor es la empresa propia y el emisor el mejor candidato de las
+        demas; los nombres ya conocidos tampoco se piden al modelo.
+
+        Los nombres del XML del CFDI se confirman de inmediato. Los que
+        devuelve el modelo quedan como propuestas y solo se usan cuando
+        `min_coincidencias` facturas distintas coinciden en el mismo nombre.
+
+        Args:
+            propios (dict): RFC propio -> nombre o None (por defecto se leen de
+                RFC_PROPIOS_PATH y RFC_PROPIOS, y si no hay ninguno, FHM190118EN7)
+            contrapartes_path (str): Archivo SQLite donde persiste el indice de
+                contrapartes (RFC_CONTRAPARTES_PATH; por defecto solo en memoria)
+            min_coincidencias (int): Facturas que deben coincidir en un nombre
+                del modelo para usarlo (RFC_MIN_COINCIDENCIAS, por defecto 2;
+                0 para aprender nombres solo del XML)
+        """
+        if propios is None:
+            propios = {}
+            ruta = os.getenv("RFC_PROPIOS_PATH")
+            if ruta:
+                with open(ruta, encoding="utf-8") as f:
+                    propios.update(_leer_propios(f.read()))
+            for rfc in os.getenv("RFC_PROPIOS", "").split(","):
+                if rfc.strip():
+                    propios.setdefault(rfc.strip().upper(), None)
+            propios = propios or {RFC_PROPIO_POR_DEFECTO: None}
+        self.propios = propios
+        if min_coincidencias is None:
+            min_coincidencias = int(os.getenv("RFC_MIN_COINCIDENCIAS", "2"))
+        self.min_coincidencias = min_coincidencias
+        # Nombres que se usan (del XML o con suficientes coincidencias) y propuestas del modelo por factura
+        self._contrapartes: dict[str, str] = {}
+        self._confirmados: set[str] = set()
+        self._propuestas: dict[str, dict[str, set]] = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        contrapartes_path = contrapartes_path or os.getenv("RFC_CONTRAPARTES_PATH")
+        if contrapartes_path:
+            self._conn = sqlite3.connect(contrapartes_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS nombres_contrapartes (rfc TEXT PRIMARY KEY, nombre TEXT NOT NULL, "
+                "confirmado INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS propuestas_contrapartes (rfc TEXT NOT NULL, nombre TEXT NOT NULL, "
+                "factura TEXT NOT NULL, PRIMARY KEY (rfc, nombre, factura))"
+            )
+            self._conn.commit()
+            for rfc, nombre, confirmado in self._conn.execute("SELECT rfc, nombre, confirmado FROM nombres_contrapartes"):
+                self._contrapartes[rfc] = nombre
+                if confirmado:
+                    self._confirmados.add(rfc)
+            for rfc, nombre, factura in self._conn.execute("SELECT rfc, nombre, factura FROM propuestas_contrapartes"):
+                self._propuestas.setdefault(rfc, {}).setdefault(nombre, set()).add(factura)
+
+    @property
+    def digest(self):
+        """
+        Huella de la configuracion (RFCs propios, sus nombres y min_coincidencias).
+
+        Forma parte de la clave de la cache de resultados: si la configuracion
+        cambia, los resultados resueltos con la anterior dejan de usarse.
+        """
+        base = json.dumps([sorted(self.propios.items()), self.min_coincidencias])
+        return hashlib.sha256(base.encode("utf-8")).hexdigest()[:16]
+
+    def es_propio(self, rfc):
+        return rfc in self.propios
+
+    def nombre(self, rfc):
+        """
+        Nombre conocido de un RFC propio o de una contraparte, o None.
+        """
+        if rfc in self.propios:
+            return self.propios[rfc]
+        return self._contrapartes.get(rfc)
+
+    def aprender(self, rfc, nombre, confirmado=False, factura=None):
+        """
+        Agrega el nombre de una contraparte al indice.
+
+        Un nombre confirmado (del XML del CFDI) se usa de inmediato y reemplaza
+        al que hubiera. Uno sin confirmar (del modelo) queda como propuesta de
+        la factura indicada y se usa cuando min_coincidencias facturas
+        distintas proponen el mismo nombre, salvo que ya haya uno confirmado.
+        Los RFCs propios y genericos no se indexan.
+
+        Args:
+            rfc (str): RFC de la contraparte
+            nombre (str): Nombre de la contraparte
+            confirmado (bool): True si el nombre viene de una fuente confiable
+            factura (str): Identificador de la factura (p. ej. su UUID); sin el,
+                un nombre sin confirmar no se registra
+        """
+        if not rfc or rfc == "0" or not nombre or nombre == "0":
+            return
+        if rfc in self.propios or rfc in RFCS_GENERICOS:
+            return
+        with self._lock:
+            if confirmado:
+                self._confirmar(rfc, nombre)
+                return
+            if not factura or factura == "0" or self.min_coincidencias <= 0:
+                return
+            if self._confirmado(rfc) or self._contrapartes.get(rfc) == nombre:
+                return
+            facturas = self._propuestas.setdefault(rfc, {}).setdefault(nombre, set())
+            if factura in facturas:
+                return
+            facturas.add(factura)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO propuestas_contrapartes (rfc, nombre, factura) VALUES (?, ?, ?)",
+                    (rfc, nombre, factura)
+                )
+                self._conn.commit()
+                # Otros procesos pueden haber propuesto el mismo nombre sobre el mismo archivo
+                coincidencias = self._conn.execute(
+                    "SELECT COUNT(*) FROM propuestas_contrapartes WHERE rfc = ? AND nombre = ?", (rfc, nombre)
+                ).fetchone()[0]
+            else:
+                coincidencias = len(facturas)
+            if coincidencias >= self.min_coincidencias:
+                self._guardar(rfc, nombre, confirmado=False)
+
+    def _confirmado(self, rfc):
+        if rfc in self._confirmados or self._conn is None:
+            return rfc in self._confirmados
+        fila = self._conn.execute("SELECT confirmado FROM nombres_contrapartes WHERE rfc = ?", (rfc,)).fetchone()
+        return bool(fila and fila[0])
+
+    def _confirmar(self, rfc, nombre):
+        self._confirmados.add(rfc)
+        self._propuestas.pop(rfc, None)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM propuestas_contrapartes WHERE rfc = ?", (rfc,))
+        self._guardar(rfc, nombre, confirmado=True)
+
+    def _guardar(self, rfc, nombre, confirmado):
+        self._contrapartes[rfc] = nombre
+        if self._conn is not None:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO nombres_contrapartes (rfc, nombre, confirmado) VALUES (?, ?, ?)",
+                (rfc, nombre, int(confirmado))
+            )
+            self._conn.commit()
+
+    def resolver(self, rfcs):
+        """
+        Asigna los roles de la factura a partir de los RFCs encontrados en el texto.
+
+        El receptor es el RFC propio y el emisor el mejor candidato a emisor
+        que no sea generico. Si hay dos o mas RFCs propios, la factura es
+        entre empresas propias: el emisor es el propio mejor colocado como
+        emisor y el receptor el mejor colocado como receptor de los demas.
+
+        Args:
+            rfcs (dict): RFCs devueltos por escanear_identificadores
+
+        Returns:
+            tuple: (RFC del emisor, RFC del receptor), "0" si no se encontro
+        """
+        propios = [rfc for rfc in rfcs if rfc in self.propios]
+        if len(propios) > 1:
+            emisor = next(rfc for rfc in ordenar_rfcs(rfcs, "emisor") if rfc in self.propios)
+            receptor = next(rfc for rfc in ordenar_rfcs(rfcs, "receptor") if rfc in self.propios and rfc != emisor)
+            return emisor, receptor
+        receptor = propios[0] if propios else "0"
+        candidatos = [rfc for rfc in ordenar_rfcs(rfcs, "emisor") if rfc != receptor and rfc not in RFCS_GENERICOS]
+        return (candidatos[0] if candidatos else "0"), receptor
+
+    @property
+    def contrapartes(self):
+        return len(self._contrapartes)
+
+
+_registro = None
+_registro_lock = threading.Lock()
+
+
+def obtener_registro():
+    """
+    Devuelve el registro compartido por todos los extractores del proceso.
+    """
+    global _registro
+    with _registro_lock:
+        if _registro is None:
+            _registro = RegistroRFC()
+    return _registro
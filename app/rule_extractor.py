@@ -0,0 +1,298 @@
+import re
+from bisect import bisect_left
+
+# Los PDFs usan a veces guiones tipograficos (U+2010, U+2011, U+2013) en el UUID
+_GUION = "[-‐‑–]"
+_HEX = "[0-9A-Fa-f]"
+UUID_RE = re.compile(
+    rf"(?<![0-9A-Fa-f{{]){_HEX}{{8}}{_GUION}{_HEX}{{4}}{_GUION}{_HEX}{{4}}"
+    rf"{_GUION}{_HEX}{{4}}{_GUION}{_HEX}{{12}}(?![0-9A-Fa-f}}])"
+)
+MONTO = r"(\d{1,3}(?:,\d{3})+\.\d{2}|\d+\.\d{2})(?!\d)"
+MONTO_RE = re.compile(MONTO)
+SUBTOTAL_RE = re.compile(rf"sub\s?-?total\s*:?\s*(?:\$\s*)?{MONTO}", re.IGNORECASE)
+TOTAL_RE = re.compile(
+    rf"(?<![a-z])(?<!bruto )(?<!neto )total\s*:?\s*(?:\$\s*)?{MONTO}(?!\s*%)", re.IGNORECASE
+)
+MONEDA_RE = re.compile(r"moneda\s*:\s*([A-Za-zÁÉÍÓÚáéíóú. ]{2,30})", re.IGNORECASE)
+ETIQUETA_FOLIO_RE = re.compile(r"folio\s*fiscal", re.IGNORECASE)
+ETIQUETA_UUID_RE = re.compile(r"uuid", re.IGNORECASE)
+RELACIONADO_RE = re.compile(r"relaci", re.IGNORECASE)
+LINEA_TRASLADO_RE = re.compile(r"iva|i\.v\.a|trasl|impuesto", re.IGNORECASE)
+LINEA_RETENCION_RE = re.compile(r"reten", re.IGNORECASE)
+# Solo se acepta el nombre si ocupa el resto de la linea (sin otra etiqueta al lado)
+NOMBRE_EMISOR_RE = re.compile(r"^[ \t]*nombre[ \t]*(?:del[ \t]*)?emisor[ \t]*:[ \t]*([^:\n]{3,})$", re.IGNORECASE | re.MULTILINE)
+NOMBRE_RECEPTOR_RE = re.compile(r"^[ \t]*nombre[ \t]*(?:del[ \t]*)?receptor[ \t]*:[ \t]*([^:\n]{3,})$", re.IGNORECASE | re.MULTILINE)
+
+# RFC: 3 letras (persona moral) o 4 (fisica), fecha AAMMDD y homoclave; se acepta pegado a puntuacion
+_RFC = r"(?<![A-ZÑ&0-9])[A-ZÑ&]{3,4}\d{6}[A-Z0-9]{3}(?![A-Z0-9])"
+# Una sola pasada sobre el texto encuentra UUIDs, RFCs y etiquetas de emisor/receptor con su posicion
+IDENTIFICADORES_RE = re.compile(
+    rf"(?P<uuid>{UUID_RE.pattern})|(?P<rfc>{_RFC})|(?P<emisor>(?i:emisor))|(?P<receptor>(?i:receptor))"
+)
+# Valores del SAT para el digito verificador del RFC
+_VALORES_RFC = {c: i for i, c in enumerate("0123456789ABCDEFGHIJKLMN&OPQRSTUVWXYZ Ñ")}
+# RFCs genericos del SAT (publico en general y extranjeros); no identifican a la contraparte
+RFCS_GENERICOS = frozenset(("XAXX010101000", "XEXX010101000"))
+# Caracteres maximos entre un RFC y una etiqueta para asociarlos
+DISTANCIA_ETIQUETA = 300
+
+# Etiquetas buscadas por posicion cuando el texto separa la etiqueta de su valor
+ETIQUETAS_POSICION = {
+    "pdf_sub_total": re.compile(r"^sub\s?-?total:?$", re.IGNORECASE),
+    "pdf_total": re.compile(r"^total:?$", re.IGNORECASE),
+    "traslado": re.compile(r"^(i\.?v\.?a\.?|iva\s?trasladado|trasladados?):?$", re.IGNORECASE),
+    "retencion": re.compile(r"^(retenci[oó]n|retenidos?):?$", re.IGNORECASE),
+}
+
+
+def _a_centavos(monto):
+    return int(round(float(monto.replace(",", "")) * 100))
+
+
+def _unico(valores):
+    # Solo hay confianza si todas las apariciones coinciden
+    distintos = set(valores)
+    return distintos.pop() if len(distintos) == 1 else None
+
+
+def _buscar_uuid(lineas):
+    por_folio, por_uuid = [], []
+    for i, linea in enumerate(lineas):
+        anterior = lineas[i - 1] if i > 0 else ""
+        contexto = " ".join(lineas[max(0, i - 2):i + 1])
+        # Los UUID de CFDI relacionados no son el de esta factura
+        if RELACIONADO_RE.search(contexto):
+            continue
+        for m in UUID_RE.finditer(linea):
+            uuid = re.sub(_GUION, "-", m.group(0)).upper()
+            if ETIQUETA_FOLIO_RE.search(linea) or ETIQUETA_FOLIO_RE.search(anterior):
+                por_folio.append(uuid)
+            elif ETIQUETA_UUID_RE.search(linea) or ETIQUETA_UUID_RE.search(anterior):
+                por_uuid.append(uuid)
+    return _unico(por_folio) or _unico(por_uuid)
+
+
+def _buscar_moneda(texto):
+    codigos = []
+    for m in MONEDA_RE.finditer(texto):
+        valor = m.group(1).upper()
+        if "USD" in valor or "DOLAR" in valor or "DÓLAR" in valor:
+            codigos.append("USD")
+        elif "MXN" in valor or "PESO" in valor or "M.N" in valor:
+            codigos.append("MXN")
+        elif "EUR" in valor:
+            codigos.append("EUR")
+    return _unico(codigos)
+
+
+def _buscar_nombre(texto, etiqueta_re):
+    return _unico([m.group(1).strip() for m in etiqueta_re.finditer(texto)])
+
+
+def _valores_por_posicion(palabras, etiqueta_re):
+    """
+    Busca el monto mas cercano a la derecha o debajo de cada aparicion de la etiqueta.
+    """
+    valores = []
+    for etiqueta in palabras:
+        if not etiqueta_re.match(etiqueta["text"]):
+            continue
+        mejor = None
+        for palabra in palabras:
+            if palabra["pagina"] != etiqueta["pagina"] or not MONTO_RE.fullmatch(palabra["text"].lstrip("$")):
+                continue
+            dy = palabra["top"] - etiqueta["top"]
+            dx = palabra["x0"] - etiqueta["x1"]
+            misma_fila = abs(dy) <= 3 and dx >= 0
+            debajo = 3 < dy <= 60 and palabra["x0"] >= etiqueta["x0"] - 5
+            if not (misma_fila or debajo):
+                continue
+            distancia = max(dy, 0) * 2 + abs(dx)
+            if mejor is None or distancia < mejor[0]:
+                mejor = (distancia, palabra["text"].lstrip("$"))
+        if mejor is not None:
+            valores.append(_a_centavos(mejor[1]))
+    return valores
+
+
+def rfc_valido(rfc):
+    """
+    Valida la fecha y el digito verificador de un RFC con el algoritmo del SAT.
+
+    Args:
+        rfc (str): RFC de 12 (persona moral) o 13 (persona fisica) caracteres
+
+    Returns:
+        bool: True si el RFC es valido o es uno de los genericos
+    """
+    if rfc in RFCS_GENERICOS:
+        return True
+    fecha = rfc[-9:-3]
+    if not ("01" <= fecha[2:4] <= "12" and "01" <= fecha[4:] <= "31"):
+        return False
+    # Las personas morales se completan a 13 caracteres con un espacio al inicio
+    completo = rfc.rjust(13)
+    suma = sum(_VALORES_RFC.get(c, 0) * (13 - i) for i, c in enumerate(completo[:12]))
+    digito = 11 - suma % 11
+    esperado = "0" if digito == 11 else "A" if digito == 10 else str(digito)
+    return rfc[-1] == esperado
+
+
+def _distancia(posiciones, etiquetas):
+    # Distancia minima en caracteres entre las apariciones y las etiquetas (ambas ordenadas)
+    mejor = None
+    for posicion in posiciones:
+        i = bisect_left(etiquetas, posicion)
+        for j in (i - 1, i):
+            if 0 <= j < len(etiquetas):
+                distancia = abs(etiquetas[j] - posicion)
+                if mejor is None or distancia < mejor:
+                    mejor = distancia
+    return mejor
+
+
+def escanear_identificadores(texto):
+    """
+    Encuentra en una sola pasada los RFCs validos y los UUIDs del texto.
+
+    Args:
+        texto (str): Texto de la factura
+
+    Returns:
+        tuple: (dict de RFCs en orden de primera aparicion, cada uno con la
+            distancia en caracteres a la etiqueta "Emisor" y "Receptor" mas
+            cercana o None; lista de UUIDs sin repetir, en orden de aparicion)
+    """
+    posiciones_rfc = {}
+    uuids = {}
+    emisores, receptores = [], []
+    for m in IDENTIFICADORES_RE.finditer(texto):
+        tipo = m.lastgroup
+        if tipo == "rfc":
+            posiciones_rfc.setdefault(m.group(), []).append(m.start())
+        elif tipo == "uuid":
+            uuids.setdefault(re.sub(_GUION, "-", m.group()).upper(), None)
+        elif tipo == "emisor":
+            emisores.append(m.start())
+        else:
+            receptores.append(m.start())
+
+    rfcs = {}
+    for rfc, posiciones in posiciones_rfc.items():
+        if rfc_valido(rfc):
+            rfcs[rfc] = {"emisor": _distancia(posiciones, emisores), "receptor": _distancia(posiciones, receptores)}
+    return rfcs, list(uuids)
+
+
+def ordenar_rfcs(rfcs, rol="emisor"):
+    """
+    Ordena los RFCs como candidatos a un rol.
+
+    Primero los cercanos a la etiqueta del rol (del mas cercano al mas lejano),
+    despues los que no estan junto a ninguna etiqueta, luego los cercanos solo
+    a la etiqueta del otro rol y al final los genericos; dentro de cada grupo
+    se conserva el orden de aparicion.
+
+    Args:
+        rfcs (dict): RFCs devueltos por escanear_identificadores
+        rol (str): "emisor" o "receptor"
+
+    Returns:
+        list: RFCs ordenados
+    """
+    otro = "receptor" if rol == "emisor" else "emisor"
+
+    def clave(elemento):
+        orden, (rfc, distancias) = elemento
+        if rfc in RFCS_GENERICOS:
+            return (3, 0, orden)
+        if distancias[rol] is not None and distancias[rol] <= DISTANCIA_ETIQUETA:
+            return (0, distancias[rol], orden)
+        if distancias[otro] is not None and distancias[otro] <= DISTANCIA_ETIQUETA:
+            return (2, 0, orden)
+        return (1, 0, orden)
+
+    return [rfc for _, (rfc, _) in sorted(enumerate(rfcs.items()), key=clave)]
+
+
+def extraer_campos_reglas(texto, palabras=None):
+    """
+    Extrae con reglas deterministas los campos de un CFDI impreso.
+
+    Solo devuelve los campos con alta confianza: UUID con etiqueta de folio
+    fiscal, moneda, nombres con etiqueta "Nombre emisor/receptor" y
+    subtotal/total cuando todas sus apariciones coinciden, e IVA
+    trasladado/retenido cuando hay una unica combinacion de montos del texto
+    que cumple subtotal + traslado - retencion = total. Los montos leidos por
+    posicion solo se aceptan dentro de esa combinacion.
+
+    Args:
+        texto (str): Texto de la factura
+        palabras (list): Palabras con posicion (text, x0, x1, top, pagina) de
+            pdfplumber, para etiquetas cuyo valor no queda junto en el texto
+
+    Returns:
+        dict: Campos encontrados, con las mismas claves que la respuesta del LLM
+    """
+    campos = {}
+    lineas = texto.split("\n")
+
+    uuid = _buscar_uuid(lineas)
+    if uuid:
+        campos["pdf_provider_bill_uuid"] = uuid
+    moneda = _buscar_moneda(texto)
+    if moneda:
+        campos["pdf_currency_code"] = moneda
+    emisor = _buscar_nombre(texto, NOMBRE_EMISOR_RE)
+    if emisor:
+        campos["pdf_billed_company_name"] = emisor
+    receptor = _buscar_nombre(texto, NOMBRE_RECEPTOR_RE)
+    if receptor:
+        campos["pdf_billing_company_name"] = receptor
+
+    subtotales = [_a_centavos(m) for m in SUBTOTAL_RE.findall(texto)]
+    totales = [_a_centavos(m) for m in TOTAL_RE.findall(texto)]
+    candidatos_traslado = {0}
+    candidatos_retencion = {0}
+    for linea in lineas:
+        montos = [_a_centavos(m) for m in MONTO_RE.findall(linea)]
+        if LINEA_RETENCION_RE.search(linea):
+            candidatos_retencion.update(montos)
+        if LINEA_TRASLADO_RE.search(linea):
+            candidatos_traslado.update(montos)
+    # Los montos tomados por posicion solo se aceptan si cuadran con los demas
+    por_posicion = False
+    if palabras:
+        if not subtotales:
+            subtotales = _valores_por_posicion(palabras, ETIQUETAS_POSICION["pdf_sub_total"])
+            por_posicion = por_posicion or bool(subtotales)
+        if not totales:
+            totales = _valores_por_posicion(palabras, ETIQUETAS_POSICION["pdf_total"])
+            por_posicion = por_posicion or bool(totales)
+        candidatos_traslado.update(_valores_por_posicion(palabras, ETIQUETAS_POSICION["traslado"]))
+        candidatos_retencion.update(_valores_por_posicion(palabras, ETIQUETAS_POSICION["retencion"]))
+
+    subtotal = _unico(subtotales)
+    total = _unico(totales)
+    if not por_posicion:
+        if subtotal is not None:
+            campos["pdf_sub_total"] = subtotal / 100
+        if total is not None:
+            campos["pdf_total"] = total / 100
+    if subtotal is not None and total is not None:
+        soluciones = [
+            (traslado, retencion)
+            for traslado in candidatos_traslado
+            for retencion in candidatos_retencion
+            if subtotal + traslado - retencion == total
+            and traslado <= subtotal and retencion <= subtotal
+            and (traslado != retencion or traslado == 0)
+        ]
+        if len(soluciones) == 1:
+            traslado, retencion = soluciones[0]
+            campos["pdf_sub_total"] = subtotal / 100
+            campos["pdf_total"] = total / 100
+            campos["pdf_traslado"] = traslado / 100
+            campos["pdf_retencion"] = retencion / 100
+    return campos
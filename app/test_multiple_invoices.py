@@ -1,8 +1,12 @@
 from invoice_agent import InvoiceExtractor
+from result_cache import crear_result_cache
 import os
 from dotenv import load_dotenv
 import json
+import argparse
+import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -32,16 +36,38 @@ def print_results(invoice_name, datos, errores):
         print("\nNo se encontraron errores de captura")
     print("\n" + "-"*50)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extrae los datos de todas las facturas PDF de un directorio")
+    parser.add_argument(
+        "--dir",
+        default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "raw", "error"),
+        help="Directorio con las facturas PDF (por defecto data/raw/error)"
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Numero de facturas procesadas en paralelo (por defecto 1)"
+    )
+    parser.add_argument(
+        "--lote",
+        action="store_true",
+        help="Agrupar varias facturas en cada llamada al modelo (ignora --parallel)"
+    )
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     ASI1_API_KEY = os.getenv("ASI1_API_KEY")
     if not ASI1_API_KEY:
         raise ValueError("No se encontró la API key de ASI1 en las variables de entorno")
 
     # Crear una instancia del extractor
-    extractor = InvoiceExtractor(api_key=ASI1_API_KEY)
+    extractor = InvoiceExtractor(api_key=ASI1_API_KEY, cache=crear_result_cache())
 
     # Directorio de facturas
-    data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "raw", "error")
+    data_dir = args.dir
     
     # Verificar que el directorio existe
     if not os.path.exists(data_dir):
@@ -54,26 +80,47 @@ def main():
         print("No se encontraron archivos PDF en el directorio")
         return
 
-    print(f"Procesando {len(invoice_paths)} facturas...")
-    
     # Estadísticas
     total_errores = 0
     facturas_con_error = 0
-    
-    for invoice_path in invoice_paths:
-        ruta_completa = os.path.join(data_dir, invoice_path)
-        try:
-            datos, errores = extractor.extraer_datos(ruta_completa)
-            print_results(invoice_path, datos, errores)
-            
-            # Actualizar estadísticas
-            if any(errores.values()):
-                facturas_con_error += 1
-                total_errores += sum(1 for error in errores.values() if error)
-                
-        except Exception as e:
+    inicio = time.perf_counter()
+
+    def registrar(invoice_path, resultado):
+        nonlocal total_errores, facturas_con_error
+        if isinstance(resultado, Exception):
             print(f"\nError al procesar {invoice_path}:")
-            print(f"Error: {str(e)}")
+            print(f"Error: {str(resultado)}")
+            return
+        datos, errores = resultado
+        print_results(invoice_path, datos, errores)
+
+        # Actualizar estadísticas
+        if any(errores.values()):
+            facturas_con_error += 1
+            total_errores += sum(1 for error in errores.values() if error)
+
+    if args.lote:
+        print(f"Procesando {len(invoice_paths)} facturas en modo lote...")
+        resultados = extractor.extraer_datos_lote([os.path.join(data_dir, p) for p in invoice_paths])
+        for invoice_path, resultado in zip(invoice_paths, resultados):
+            registrar(invoice_path, resultado)
+    else:
+        print(f"Procesando {len(invoice_paths)} facturas con {args.parallel} en paralelo...")
+        # Las facturas se extraen en hilos (la llamada al LLM es I/O) y los
+        # resultados se imprimen conforme terminan
+        with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as executor:
+            futuros = {
+                executor.submit(extractor.extraer_datos, os.path.join(data_dir, invoice_path)): invoice_path
+                for invoice_path in invoice_paths
+            }
+            for futuro in as_completed(futuros):
+                invoice_path = futuros[futuro]
+                try:
+                    registrar(invoice_path, futuro.result())
+                except Exception as e:
+                    registrar(invoice_path, e)
+    
+    duracion = time.perf_counter() - inicio
     
     # Mostrar resumen final
     print("\nResumen del procesamiento:")
@@ -81,6 +128,7 @@ def main():
     print(f"Facturas con errores: {facturas_con_error}")
     print(f"Total de errores encontrados: {total_errores}")
     print(f"Promedio de errores por factura: {total_errores/len(invoice_paths):.2f}")
+    print(f"Tiempo total: {duracion:.2f} s ({duracion/len(invoice_paths):.2f} s por factura)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los modulos de app/ se importan por nombre, como cuando se corre la API desde este directorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+import ctypes
+import io
+import os
+
+import pytest
+
+from cfdi_xml import extraer_cfdi, leer_cfdi
+
+CFDI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "cfdi40.xml")
+
+
+@pytest.fixture
+def xml():
+    with open(CFDI, "rb") as f:
+        return f.read()
+
+
+def _pdf_con_adjunto(nombre, contenido):
+    pdfium = pytest.importorskip("pypdfium2")
+    import pypdfium2.raw as raw
+    documento = pdfium.PdfDocument.new()
+    documento.new_page(200, 200)
+    nombre_ancho = ctypes.c_char_p((nombre + "\0").encode("utf-16-le"))
+    adjunto = raw.FPDFDoc_AddAttachment(documento, ctypes.cast(nombre_ancho, raw.FPDF_WIDESTRING))
+    raw.FPDFAttachment_SetFile(adjunto, documento, contenido, len(contenido))
+    salida = io.BytesIO()
+    documento.save(salida)
+    documento.close()
+    return salida.getvalue()
+
+
+def test_lee_el_cfdi_40(xml):
+    assert leer_cfdi(xml) == {
+        "pdf_billed_company_name": "TRANSPORTES DEL NORTE",
+        "pdf_billed_company_rfc": "SAT970701NN3",
+        "pdf_billing_company_name": "FR8 HUB MEXICO",
+        "pdf_billing_company_rfc": "FHM190118EN7",
+        # El UUID se normaliza a mayusculas
+        "pdf_provider_bill_uuid": "56F42BF6-4E1B-4770-AD10-3D4288837990",
+        "pdf_currency_code": "MXN",
+        "pdf_sub_total": 1000.0,
+        # Solo los impuestos del comprobante: los del concepto no se suman otra vez
+        "pdf_traslado": 160.0,
+        "pdf_retencion": 40.0,
+        "pdf_total": 1120.0,
+    }
+
+
+def test_rechaza_xml_invalido_o_que_no_es_cfdi():
+    assert leer_cfdi(b"<cfdi:Comprobante") is None
+    assert leer_cfdi(b"<Factura><Total>1</Total></Factura>") is None
+    assert extraer_cfdi(xml=b"no es xml") is None
+
+
+def test_lee_el_xml_adjunto_al_pdf(xml):
+    datos, errores = extraer_cfdi(_pdf_con_adjunto("factura.xml", xml))
+    assert datos["pdf_provider_bill_uuid"] == "56F42BF6-4E1B-4770-AD10-3D4288837990"
+    assert not any(errores.values())
+
+
+def test_pdf_sin_xml_adjunto():
+    assert extraer_cfdi(_pdf_con_adjunto("notas.txt", b"hola")) is None
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import pytest
+
+import extraction_pool
+from extraction_pool import ExtractionPool
+
+
+def _leer_falso(pdf):
+    # Corre en los procesos del pool (fork): b"cuelga" simula un PDF que atora a pdfplumber
+    if pdf == b"cuelga":
+        time.sleep(60)
+    if pdf == b"lento":
+        time.sleep(0.4)
+    return pdf.decode()
+
+
+@pytest.fixture(autouse=True)
+def lector_falso(monkeypatch):
+    monkeypatch.setattr(extraction_pool, "leer_paginas_pdf", _leer_falso)
+
+
+def test_timeout_mata_el_proceso_y_libera_el_hueco():
+    async def escenario():
+        pool = ExtractionPool(max_workers=1, max_pendientes=2, timeout=0.5)
+        try:
+            await pool.extraer_texto(b"hola")
+            proceso = next(iter(pool._executor._processes.values()))
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.extraer_texto(b"cuelga")
+            assert pool.pendientes == 0
+            proceso.join(timeout=5)
+            assert not proceso.is_alive()
+            # Con un solo proceso, esto solo responde si el hueco del atascado se libero
+            assert await pool.extraer_texto(b"otra") == "otra"
+        finally:
+            pool.cerrar()
+
+    asyncio.run(escenario())
+
+
+def test_pdfs_en_proceso_se_reenvian_al_reciclar():
+    async def escenario():
+        pool = ExtractionPool(max_workers=2, max_pendientes=4, timeout=0.5)
+        try:
+            atascado = asyncio.create_task(pool.extraer_texto(b"cuelga"))
+            await asyncio.sleep(0.3)
+            # "lento" sigue en el pool viejo cuando este se recicla por el timeout de "cuelga"
+            lento = asyncio.create_task(pool.extraer_texto(b"lento"))
+            with pytest.raises(asyncio.TimeoutError):
+                await atascado
+            assert await lento == "lento"
+            assert pool.pendientes == 0
+        finally:
+            pool.cerrar()
+
+    asyncio.run(escenario())
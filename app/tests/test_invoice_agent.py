@@ -0,0 +1,31 @@
+import asyncio
+
+import invoice_agent
+from invoice_agent import CAMPOS_LLM, InvoiceExtractor
+
+
+def test_lote_resuelto_por_reglas_no_vuelve_a_extraer(monkeypatch):
+    extractor = InvoiceExtractor(api_key="prueba")
+    campos = {campo: "X" if tipo == "string" else 1.0 for campo, (_, tipo) in CAMPOS_LLM.items()}
+    llamadas = []
+
+    async def campos_reglas(texto_factura, path_pdf=None):
+        llamadas.append(texto_factura)
+        return dict(campos)
+
+    async def extraer_de_texto(*args):
+        raise AssertionError("la factura no debe reprocesarse")
+
+    def compactar(*args):
+        raise AssertionError("el texto no debe compactarse")
+
+    monkeypatch.setattr(extractor, "_campos_reglas", campos_reglas)
+    monkeypatch.setattr(extractor, "_extraer_de_texto", extraer_de_texto)
+    monkeypatch.setattr(invoice_agent, "compactar_texto", compactar)
+
+    resultados = asyncio.run(extractor._extraer_lote_de_textos([(0, "Factura completa", None)]))
+
+    assert llamadas == ["Factura completa"]
+    [(id_factura, (datos, errores))] = resultados
+    assert id_factura == 0
+    assert datos["pdf_total"] == 1.0
@@ -0,0 +1,45 @@
+import asyncio
+import json
+import os
+
+os.environ.setdefault("REGISTER_WEBHOOK", "0")
+
+import invoice_api
+from job_store import InMemoryJobStore, SQLiteJobStore
+
+
+def test_sqlite_avisa_a_los_suscriptores(tmp_path):
+    async def escenario():
+        store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+        job = await store.crear("factura.pdf")
+        cola = store.suscribir(job["job_id"])
+        await store.actualizar(job["job_id"], status="done", result={"status": "received"})
+        avisado = cola.get_nowait()
+        assert avisado["status"] == "done"
+        assert await store.obtener(job["job_id"]) == avisado
+        assert await store.actualizar("no-existe", status="done") is None
+
+    asyncio.run(escenario())
+
+
+def test_eventos_terminan_si_el_job_se_purga(monkeypatch):
+    store = InMemoryJobStore()
+    monkeypatch.setattr(invoice_api, "job_store", store)
+    monkeypatch.setattr(invoice_api, "cola_trabajos", None)
+    monkeypatch.setattr(invoice_api, "SSE_KEEPALIVE", 0.01)
+
+    async def escenario():
+        job = await store.crear("factura.pdf")
+        respuesta = await invoice_api.job_events(job["job_id"])
+        eventos = []
+        async for evento in respuesta.body_iterator:
+            eventos.append(evento)
+            if evento.startswith("event: queued"):
+                # El TTL purga el job mientras el cliente escucha
+                store._jobs.clear()
+        return eventos
+
+    eventos = asyncio.run(asyncio.wait_for(escenario(), timeout=5))
+    assert eventos[0].startswith("event: queued")
+    assert eventos[-1].startswith("event: error")
+    assert json.loads(eventos[-1].split("data: ", 1)[1])["message"] == "Job not found"
@@ -0,0 +1,123 @@
+import asyncio
+
+import httpx
+import pytest
+
+import llm_scheduler
+from llm_scheduler import CircuitBreaker, CircuitoAbiertoError, LLMScheduler, TokenBucket
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def monotonic(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(llm_scheduler.time, "monotonic", reloj.monotonic)
+    return reloj
+
+
+@pytest.fixture
+def esperas(monkeypatch):
+    # Las esperas del planificador se registran en lugar de dormir
+    registradas = []
+
+    async def dormir(segundos):
+        registradas.append(segundos)
+
+    monkeypatch.setattr(llm_scheduler.asyncio, "sleep", dormir)
+    return registradas
+
+
+def _error(status, retry_after=None):
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+    respuesta = httpx.Response(status, headers=headers, request=httpx.Request("POST", "http://asi1"))
+    return httpx.HTTPStatusError("error", request=respuesta.request, response=respuesta)
+
+
+def _llamada(*resultados):
+    # Cada llamada lanza o devuelve el siguiente resultado
+    pendientes = list(resultados)
+
+    async def llamada():
+        resultado = pendientes.pop(0)
+        if isinstance(resultado, Exception):
+            raise resultado
+        return resultado
+
+    return llamada
+
+
+def test_token_bucket_se_repone_con_el_tiempo(reloj):
+    bucket = TokenBucket(por_minuto=60, capacidad=2)
+    assert bucket.reservar() == 0.0
+    assert bucket.reservar() == 0.0
+    # Sin saldo: la tercera espera lo que tarda en reponerse un token (1 por segundo)
+    assert bucket.reservar() == pytest.approx(1.0)
+    reloj.ahora += 3
+    assert bucket.reservar() == 0.0
+    # La reposicion no pasa de la capacidad aunque pase mucho tiempo
+    reloj.ahora += 600
+    assert bucket.reservar() == 0.0
+    assert bucket.reservar() == 0.0
+    assert bucket.reservar() == pytest.approx(1.0)
+
+
+def test_circuito_abierto_semiabierto_cerrado(reloj):
+    circuito = CircuitBreaker(umbral=2, tiempo_abierto=30)
+    circuito.fallo()
+    assert circuito.estado == "cerrado"
+    circuito.fallo()
+    assert circuito.estado == "abierto"
+    with pytest.raises(CircuitoAbiertoError):
+        circuito.permitir()
+
+    reloj.ahora += 30
+    assert circuito.estado == "semiabierto"
+    circuito.permitir()
+    # Solo pasa una llamada de prueba a la vez
+    with pytest.raises(CircuitoAbiertoError):
+        circuito.permitir()
+    circuito.exito()
+    assert circuito.estado == "cerrado"
+    circuito.permitir()
+
+
+def test_prueba_fallida_reabre_el_circuito(reloj):
+    circuito = CircuitBreaker(umbral=1, tiempo_abierto=30)
+    circuito.fallo()
+    reloj.ahora += 30
+    circuito.permitir()
+    circuito.fallo()
+    assert circuito.estado == "abierto"
+
+
+def test_retry_after_se_respeta_completo(esperas):
+    scheduler = LLMScheduler(rpm=1e9, tpm=1e12, backoff_max=30, retry_after_max=120)
+    llamada = _llamada(_error(429, retry_after=90), "ok")
+    assert asyncio.run(scheduler.ejecutar(llamada)) == "ok"
+    assert esperas == [90.0]
+
+
+def test_retry_after_mayor_al_maximo_falla_de_inmediato(esperas):
+    scheduler = LLMScheduler(rpm=1e9, tpm=1e12, retry_after_max=120)
+    llamada = _llamada(_error(429, retry_after=600), "ok")
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(scheduler.ejecutar(llamada))
+    assert esperas == []
+
+
+def test_errores_5xx_agotan_reintentos_y_abren_el_circuito(esperas):
+    scheduler = LLMScheduler(rpm=1e9, tpm=1e12, max_reintentos=2, umbral_circuito=3)
+    llamada = _llamada(_error(503), _error(503), _error(503))
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(scheduler.ejecutar(llamada))
+    assert len(esperas) == 2
+    assert scheduler.circuito.estado == "abierto"
+    with pytest.raises(CircuitoAbiertoError):
+        asyncio.run(scheduler.ejecutar(_llamada("ok")))
@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from llm_schema import detector_fin, extraer_json, validar_respuesta
+
+
+def _validar_total(datos):
+    return validar_respuesta(datos, ["pdf_total"])
+
+
+def test_repara_comas_finales_del_primer_objeto():
+    assert extraer_json('```json\n{"a": 1,}\n``` y {"b":2}') == {"a": 1}
+
+
+def test_sigue_buscando_hasta_el_objeto_que_valida():
+    texto = 'Claro {"nota": "usa { llaves"} {"pdf_total": "1,000.50",}'
+    assert extraer_json(texto) == {"nota": "usa { llaves"}
+    assert extraer_json(texto, validar=_validar_total) == {"pdf_total": 1000.5}
+
+
+def test_sin_objeto_valido():
+    with pytest.raises(ValueError, match="pdf_total"):
+        extraer_json('{"nota": "sin montos"}', validar=_validar_total)
+    with pytest.raises(json.JSONDecodeError):
+        extraer_json("sin JSON", validar=_validar_total)
+
+
+@pytest.mark.parametrize("fragmentos", [
+    ['Claro {"nota": "usa { llaves"', '} ', '{"pdf_total": "1,000.50"', '}'],
+    ['Se usa { para abrir: ', '{"pdf_total": "1,000.50"', '}'],
+])
+def test_detector_corta_cuando_el_objeto_valida(fragmentos):
+    al_recibir = detector_fin(lambda texto: extraer_json(texto, validar=_validar_total))
+    assert [al_recibir(fragmento) for fragmento in fragmentos] == [False] * (len(fragmentos) - 1) + [True]
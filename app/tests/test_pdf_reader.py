@@ -0,0 +1,56 @@
+import sys
+
+from pdf_reader import PDFBackend, leer_texto_pdf
+
+
+class BackendFalso(PDFBackend):
+    nombre = "falso"
+
+    def __init__(self, paginas):
+        self.paginas = paginas
+
+    def iterar_paginas(self, pdf):
+        yield from self.paginas
+
+
+class PdfplumberFalso:
+    # Registra que paginas se releen en lugar de abrir un PDF real
+    def __init__(self):
+        self.releidas = []
+
+    def open(self, fuente):
+        return self
+
+    @property
+    def pages(self):
+        return self
+
+    def __getitem__(self, numero):
+        self.releidas.append(numero)
+        return self
+
+    def extract_text(self):
+        return "Texto releido"
+
+    def close(self):
+        pass
+
+
+def test_solo_se_releen_las_paginas_ilegibles(monkeypatch):
+    pdfplumber = PdfplumberFalso()
+    monkeypatch.setitem(sys.modules, "pdfplumber", pdfplumber)
+    backend = BackendFalso(["Factura sin UUID ni montos", "���", "Pagina con texto normal"])
+
+    texto = leer_texto_pdf(b"pdf", parada_temprana=False, backend=backend)
+
+    # Que las reglas no encuentren campos no provoca releer todo el documento
+    assert pdfplumber.releidas == [1]
+    assert texto == "Factura sin UUID ni montos\nTexto releido\nPagina con texto normal"
+
+
+def test_por_defecto_se_leen_todas_las_paginas(monkeypatch):
+    monkeypatch.delenv("PDF_PARADA_TEMPRANA", raising=False)
+    completa = "UUID 56F42BF6-4E1B-4770-AD10-3D4288837990 Subtotal $1,000.00 IVA $160.00 Total $1,160.00"
+    backend = BackendFalso([completa, "Retencion IVA $40.00"])
+
+    assert leer_texto_pdf(b"pdf", backend=backend) == completa + "\nRetencion IVA $40.00"
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from response_router import RouterRedis, RouterSQLite
+
+
+async def _entrega_entre_instancias(espera, webhook, esta_vacio):
+    # El upload espera en una instancia y el webhook llega a la otra
+    future = await espera.registrar("req-1")
+    assert await webhook.entregar("req-1", {"status": "received", "resultado": {"pdf_total": 1.0}})
+    assert await asyncio.wait_for(future, timeout=2) == {"status": "received", "resultado": {"pdf_total": 1.0}}
+    await espera.descartar("req-1")
+
+    assert not await webhook.entregar("desconocido", {"status": "received"})
+
+    # Un upload que vence descarta su espera: la respuesta tardia ya no tiene destino
+    await espera.registrar("req-2")
+    await espera.descartar("req-2")
+    assert espera.pendientes == 0
+    assert await esta_vacio()
+    assert not await webhook.entregar("req-2", {"status": "received"})
+
+
+def test_router_sqlite_entre_procesos(tmp_path):
+    ruta = str(tmp_path / "respuestas.db")
+
+    async def escenario():
+        espera = RouterSQLite(ruta, intervalo=0.01)
+        webhook = RouterSQLite(ruta, intervalo=0.01)
+
+        async def esta_vacio():
+            filas = [
+                webhook._conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+                for tabla in ("esperas", "respuestas")
+            ]
+            return filas == [0, 0]
+
+        try:
+            await _entrega_entre_instancias(espera, webhook, esta_vacio)
+        finally:
+            await espera.cerrar()
+            await webhook.cerrar()
+
+    asyncio.run(escenario())
+
+
+def test_router_redis_entre_procesos():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def escenario():
+        servidor = fakeredis.FakeServer()
+        espera = RouterRedis(cliente=fakeredis.aioredis.FakeRedis(server=servidor))
+        webhook = RouterRedis(cliente=fakeredis.aioredis.FakeRedis(server=servidor))
+
+        async def esta_vacio():
+            return await webhook.cliente.keys(f"{webhook.prefijo}:espera:*") == []
+
+        try:
+            await _entrega_entre_instancias(espera, webhook, esta_vacio)
+        finally:
+            await espera.cerrar()
+            await webhook.cerrar()
+
+    asyncio.run(escenario())
+
+
+def test_router_redis_cierra_la_suscripcion_de_una_escucha_caida():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def escenario():
+        router = RouterRedis(cliente=fakeredis.aioredis.FakeRedis())
+        try:
+            await router.registrar("req-1")
+            anterior = router._pubsub
+            router._escucha.cancel()
+            await asyncio.gather(router._escucha, return_exceptions=True)
+
+            await router.registrar("req-2")
+            assert router._pubsub is not anterior
+            assert anterior.connection is None
+        finally:
+            await router.cerrar()
+
+    asyncio.run(escenario())
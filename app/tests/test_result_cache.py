@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+import result_cache
+from result_cache import LRUTier, ResultCache, SQLiteTier, hash_resultado
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def time(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(result_cache.time, "time", reloj.time)
+    return reloj
+
+
+def test_memoria_vence_por_ttl(reloj):
+    nivel = LRUTier(max_entries=10, ttl=60)
+    nivel.set("a", 1)
+    reloj.ahora += 59
+    assert nivel.get("a") == 1
+    reloj.ahora += 2
+    assert nivel.get("a") is None
+
+
+def test_memoria_expulsa_la_menos_usada():
+    nivel = LRUTier(max_entries=2, ttl=60)
+    nivel.set("a", 1)
+    nivel.set("b", 2)
+    nivel.get("a")
+    nivel.set("c", 3)
+    assert nivel.get("b") is None
+    assert nivel.get("a") == 1
+    assert nivel.get("c") == 3
+
+
+def test_disco_vence_por_ttl_y_expulsa_la_menos_usada(tmp_path, reloj):
+    nivel = SQLiteTier(str(tmp_path / "cache.db"), max_entries=2, ttl=60)
+    nivel.set("a", [1])
+    reloj.ahora += 1
+    nivel.set("b", [2])
+    reloj.ahora += 1
+    nivel.get("a")
+    reloj.ahora += 1
+    nivel.set("c", [3])
+    assert nivel.get("b") is None
+    assert nivel.get("a") == [1]
+    reloj.ahora += 61
+    assert nivel.get("c") is None
+
+
+def test_clave_incluye_prompt_modelo_y_registro():
+    base = hash_resultado("Factura  A\n", "5", "asi1-mini", "registro-1")
+    assert base == hash_resultado("Factura A", "5", "asi1-mini", "registro-1")
+    assert base != hash_resultado("Factura A", "6", "asi1-mini", "registro-1")
+    assert base != hash_resultado("Factura A", "5", "otro-modelo", "registro-1")
+    assert base != hash_resultado("Factura A", "5", "asi1-mini", "registro-2")
+
+
+def test_disco_sobrevive_a_la_memoria(tmp_path):
+    ruta = str(tmp_path / "cache.db")
+
+    async def escenario():
+        cache = ResultCache(sqlite_path=ruta)
+        await cache.guardar_resultado_async("Factura", "5", "asi1", {"pdf_total": 1.0}, {}, "registro")
+        await cache.guardar_texto_async(b"%PDF", "Factura")
+        # Otro proceso con la memoria vacia lee del disco
+        otra = ResultCache(sqlite_path=ruta)
+        assert await otra.obtener_texto_async(b"%PDF") == "Factura"
+        assert await otra.obtener_resultado_async("Factura", "5", "asi1", "registro") == ({"pdf_total": 1.0}, {})
+        assert await otra.obtener_resultado_async("Factura", "5", "asi1", "otro") is None
+
+    asyncio.run(escenario())
@@ -0,0 +1,55 @@
+from rfc_registry import RegistroRFC
+from result_cache import hash_resultado
+
+PROPIO = "FHM190118EN7"
+EMISOR = "AAA010101AAA"
+
+
+def test_nombre_del_modelo_requiere_coincidencias():
+    registro = RegistroRFC(propios={PROPIO: None}, min_coincidencias=2)
+
+    registro.aprender(EMISOR, "Transportes Uno", factura="uuid-1")
+    # La misma factura procesada otra vez no cuenta como otra coincidencia
+    registro.aprender(EMISOR, "Transportes Uno", factura="uuid-1")
+    registro.aprender(EMISOR, "Transportes Otro", factura="uuid-2")
+    registro.aprender(EMISOR, "Transportes Uno")
+    assert registro.nombre(EMISOR) is None
+
+    registro.aprender(EMISOR, "Transportes Uno", factura="uuid-3")
+    assert registro.nombre(EMISOR) == "Transportes Uno"
+
+
+def test_xml_reemplaza_al_modelo_y_el_modelo_no_al_xml():
+    registro = RegistroRFC(propios={PROPIO: None}, min_coincidencias=1)
+
+    registro.aprender(EMISOR, "Nombre del modelo", factura="uuid-1")
+    assert registro.nombre(EMISOR) == "Nombre del modelo"
+    registro.aprender(EMISOR, "Nombre del XML", confirmado=True)
+    assert registro.nombre(EMISOR) == "Nombre del XML"
+    registro.aprender(EMISOR, "Otro nombre del modelo", factura="uuid-2")
+    assert registro.nombre(EMISOR) == "Nombre del XML"
+
+
+def test_propuestas_y_confirmados_persisten(tmp_path):
+    ruta = str(tmp_path / "contrapartes.db")
+    registro = RegistroRFC(propios={PROPIO: None}, contrapartes_path=ruta, min_coincidencias=2)
+    registro.aprender(EMISOR, "Transportes Uno", factura="uuid-1")
+    registro.aprender("BBB010101BBB", "Del XML", confirmado=True)
+
+    # Otro proceso sobre el mismo archivo suma su coincidencia a la ya guardada
+    otro = RegistroRFC(propios={PROPIO: None}, contrapartes_path=ruta, min_coincidencias=2)
+    assert otro.nombre(EMISOR) is None
+    assert otro.nombre("BBB010101BBB") == "Del XML"
+    otro.aprender(EMISOR, "Transportes Uno", factura="uuid-2")
+    assert otro.nombre(EMISOR) == "Transportes Uno"
+    otro.aprender("BBB010101BBB", "Del modelo", factura="uuid-3")
+    otro.aprender("BBB010101BBB", "Del modelo", factura="uuid-4")
+    assert otro.nombre("BBB010101BBB") == "Del XML"
+
+
+def test_digest_cambia_con_los_rfcs_propios():
+    uno = RegistroRFC(propios={PROPIO: None})
+    otro = RegistroRFC(propios={PROPIO: None, "CCC010101CCC": "Filial"})
+    assert uno.digest == RegistroRFC(propios={PROPIO: None}).digest
+    assert uno.digest != otro.digest
+    assert hash_resultado("texto", "5", "asi1", uno.digest) != hash_resultado("texto", "5", "asi1", otro.digest)
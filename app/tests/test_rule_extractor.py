@@ -0,0 +1,67 @@
+import pytest
+
+from rfc_registry import RegistroRFC
+from rule_extractor import escanear_identificadores, extraer_campos_reglas, ordenar_rfcs, rfc_valido
+
+UUID = "56F42BF6-4E1B-4770-AD10-3D4288837990"
+
+
+@pytest.mark.parametrize("rfc", ["FHM190118EN7", "SAT970701NN3", "GODE561231GR8", "XAXX010101000"])
+def test_rfc_con_digito_verificador_valido(rfc):
+    assert rfc_valido(rfc)
+
+
+@pytest.mark.parametrize("rfc", ["AAA010101AAA", "FHM190118EN8", "FHM191318EN7"])
+def test_rfc_invalido(rfc):
+    assert not rfc_valido(rfc)
+
+
+def test_emisor_es_el_mas_cercano_a_su_etiqueta():
+    # GODE561231GR8 aparece primero pero mas lejos de "Emisor"; el RFC del receptor queda al final
+    texto = (
+        "RFC GODE561231GR8 " + "-" * 60 + "\n"
+        "Datos del Emisor\nRFC: SAT970701NN3\n"
+        + "Concepto\n" * 50
+        + "Receptor: FHM190118EN7\n"
+    )
+    rfcs, _ = escanear_identificadores(texto)
+    assert ordenar_rfcs(rfcs, "emisor") == ["SAT970701NN3", "GODE561231GR8", "FHM190118EN7"]
+    assert ordenar_rfcs(rfcs, "receptor")[0] == "FHM190118EN7"
+
+
+def test_rfcs_genericos_nunca_se_eligen():
+    texto = "Emisor RFC: XAXX010101000\nReceptor: FHM190118EN7\nCliente extranjero XEXX010101000\n"
+    rfcs, _ = escanear_identificadores(texto)
+    assert ordenar_rfcs(rfcs, "emisor")[-2:] == ["XAXX010101000", "XEXX010101000"]
+    assert RegistroRFC(propios={"FHM190118EN7": None}).resolver(rfcs) == ("0", "FHM190118EN7")
+
+
+def test_montos_moneda_y_uuid():
+    texto = (
+        f"Folio fiscal: {UUID.lower()}\n"
+        "Moneda: MXN Peso Mexicano\n"
+        "Subtotal: $1,000.00\n"
+        "IVA 16%: 160.00\n"
+        "Retencion IVA 4%: 40.00\n"
+        "Total: $1,120.00\n"
+    )
+    assert extraer_campos_reglas(texto) == {
+        "pdf_provider_bill_uuid": UUID,
+        "pdf_currency_code": "MXN",
+        "pdf_sub_total": 1000.0,
+        "pdf_traslado": 160.0,
+        "pdf_retencion": 40.0,
+        "pdf_total": 1120.0,
+    }
+
+
+@pytest.mark.parametrize("moneda, codigo", [("USD Dolar americano", "USD"), ("Pesos M.N.", "MXN"), ("EUR", "EUR")])
+def test_moneda(moneda, codigo):
+    assert extraer_campos_reglas(f"Moneda: {moneda}\n")["pdf_currency_code"] == codigo
+
+
+def test_montos_que_no_cuadran_no_se_devuelven():
+    # Dos totales distintos: no hay confianza en ninguno
+    campos = extraer_campos_reglas("Subtotal: 100.00\nIVA: 16.00\nTotal: 116.00\nTotal: 120.00\n")
+    assert "pdf_total" not in campos
+    assert "pdf_traslado" not in campos
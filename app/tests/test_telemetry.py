@@ -0,0 +1,108 @@
+import asyncio
+import contextvars
+import os
+import socket
+
+import httpx
+import pytest
+
+# Sin agente real: el upload no registra el webhook ni espera a Agentverse al arrancar
+os.environ.setdefault("EXECUTION_MODE", "agentverse")
+os.environ.setdefault("REGISTER_WEBHOOK", "0")
+
+import telemetry
+from telemetry import configurar_trazas, extraer_contexto, inyectar_contexto, servir_metricas, span
+
+
+def _cliente(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api")
+
+
+def _ancestros(hijo, spans):
+    # Nombres de los spans de los que cuelga hijo, del padre directo a la raiz
+    por_id = {s.context.span_id: s for s in spans}
+    nombres = []
+    while hijo.parent is not None:
+        hijo = por_id[hijo.parent.span_id]
+        nombres.append(hijo.name)
+    return nombres
+
+
+def test_upload_agente_y_webhook_comparten_la_traza(monkeypatch):
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry import trace
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    exportador = InMemorySpanExporter()
+    assert configurar_trazas("fr8-pruebas", exportador=exportador)
+
+    import fetchai.communication
+    import invoice_api
+
+    async def extraer_texto(contenido):
+        return "Factura de prueba"
+
+    monkeypatch.setattr(invoice_api.extraction_pool, "extraer_texto", extraer_texto)
+    monkeypatch.setattr(invoice_api, "result_cache", None)
+
+    async def escenario():
+        async with _cliente(invoice_api.app) as cliente:
+            tareas = []
+
+            async def agente(payload):
+                # Como agent.py: continua la traza del traceparent y lo reenvia al webhook
+                with span("agent.proxy_handler", extraer_contexto({"traceparent": payload["traceparent"]})):
+                    await cliente.post("/api/webhook", headers=inyectar_contexto(), json={
+                        "status": "received",
+                        "request_id": payload["request_id"],
+                        "resultado": {"pdf_total": "1.00"},
+                        "errores": {},
+                    })
+
+            def enviar(sender, target, payload, model_digest):
+                # Contexto vacio: el agente solo conoce la traza por el traceparent del mensaje
+                tareas.append(asyncio.get_running_loop().create_task(agente(payload), context=contextvars.Context()))
+
+            monkeypatch.setattr(fetchai.communication, "send_message_to_agent", enviar)
+            respuesta = await cliente.post("/upload-pdf", files={"file": ("factura.pdf", b"%PDF", "application/pdf")})
+            await asyncio.gather(*tareas)
+            return respuesta
+
+    respuesta = asyncio.run(escenario())
+    assert respuesta.json()["resultado"] == {"pdf_total": "1.00"}
+
+    trace.get_tracer_provider().force_flush()
+    terminados = exportador.get_finished_spans()
+    spans = {s.name: s for s in terminados}
+    assert len({s.context.trace_id for s in terminados}) == 1
+    # FastAPI puede agregar sus propios spans por peticion entre los de la aplicacion
+    cadena = _ancestros(spans["invoice.webhook"], terminados)
+    assert cadena.index("agent.proxy_handler") < cadena.index("invoice.agente") < cadena.index("invoice.total")
+    assert _ancestros(spans["agent.proxy_handler"], terminados)[0] == "invoice.agente"
+
+
+def test_metrics_sin_prometheus_responde_501(monkeypatch):
+    import invoice_api
+
+    monkeypatch.setattr(telemetry, "PROMETHEUS_DISPONIBLE", False)
+
+    async def escenario():
+        async with _cliente(invoice_api.app) as cliente:
+            return await cliente.get("/metrics")
+
+    respuesta = asyncio.run(escenario())
+    assert respuesta.status_code == 501
+    assert respuesta.json() == {"status": "error", "message": "prometheus_client no esta instalado"}
+
+
+def test_servir_metricas_en_un_puerto_propio():
+    pytest.importorskip("prometheus_client")
+    with socket.socket() as libre:
+        libre.bind(("127.0.0.1", 0))
+        puerto = libre.getsockname()[1]
+
+    assert not servir_metricas(0)
+    assert servir_metricas(puerto)
+    respuesta = httpx.get(f"http://127.0.0.1:{puerto}/metrics")
+    assert respuesta.status_code == 200
+    assert "invoice_llm_latency_seconds" in respuesta.text
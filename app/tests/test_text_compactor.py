@@ -0,0 +1,55 @@
+from text_compactor import compactar_texto, estimar_tokens
+
+SELLO = "MIIFuzCCA6OgAwIBAgIUMDAwMDEwMDAwMDA0MDAwMDI0MzUwDQYJKoZIhvcNAQEL" * 3
+ENCABEZADO = "TRANSPORTES DEL NORTE SA DE CV - Factura electronica"
+
+
+def _factura(paginas=2):
+    pagina = "\n".join([
+        ENCABEZADO,
+        "Emisor: TRANSPORTES DEL NORTE SA DE CV   RFC: SAT970701NN3",
+        "Receptor: FR8 HUB MEXICO  RFC: FHM190118EN7",
+        "Folio fiscal: 56F42BF6-4E1B-4770-AD10-3D4288837990",
+        "Subtotal: $1,000.00",
+        "IVA 16%: $160.00",
+        "Total: $1,160.00",
+        "Sello digital del emisor: " + SELLO,
+        "Cadena original: ||1.1|56F42BF6-4E1B-4770-AD10-3D4288837990|2024-01-15T10:00:00||",
+        "Este documento es una representacion impresa de un CFDI",
+    ])
+    return "\n".join(pagina for _ in range(paginas))
+
+
+def test_quita_sellos_cadena_original_y_lineas_repetidas():
+    compacto, info = compactar_texto(_factura(), max_tokens=2000)
+
+    assert SELLO[:40] not in compacto
+    assert "||1.1|" not in compacto
+    assert "representacion impresa" not in compacto
+    assert compacto.count(ENCABEZADO) == 1
+    for campo in ("56F42BF6-4E1B-4770-AD10-3D4288837990", "SAT970701NN3", "FHM190118EN7",
+                  "$1,000.00", "$160.00", "$1,160.00", "FR8 HUB MEXICO"):
+        assert campo in compacto
+    assert info["tokens_finales"] == estimar_tokens(compacto)
+    assert info["tokens_eliminados"] == info["tokens_originales"] - info["tokens_finales"]
+
+
+def test_recorta_a_las_ventanas_de_etiquetas_si_sigue_excediendo():
+    relleno = ["Renglon de detalle numero %03d sin datos fiscales" % i for i in range(60)]
+    texto = "\n".join(relleno[:10] + ["Total: $1,160.00"] + relleno[10:] + ["UUID: 56F42BF6-4E1B-4770-AD10-3D4288837990"])
+
+    compacto, info = compactar_texto(texto, max_tokens=200)
+
+    lineas = compacto.split("\n")
+    # Encabezado, la ventana de cada etiqueta y nada del relleno intermedio
+    assert lineas[:8] == relleno[:8]
+    assert "Total: $1,160.00" in lineas
+    assert "UUID: 56F42BF6-4E1B-4770-AD10-3D4288837990" in lineas
+    assert relleno[30] not in lineas
+    assert info["tokens_finales"] <= 200
+
+
+def test_usa_prompt_max_tokens_por_defecto(monkeypatch):
+    monkeypatch.setenv("PROMPT_MAX_TOKENS", "20")
+    compacto, info = compactar_texto(_factura())
+    assert info["tokens_finales"] <= 20
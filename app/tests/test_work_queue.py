@@ -0,0 +1,66 @@
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("REGISTER_WEBHOOK", "0")
+
+import invoice_api
+from work_queue import ColaTrabajos
+
+
+@pytest.fixture
+def cola(tmp_path, monkeypatch):
+    cola = ColaTrabajos(str(tmp_path / "queue.db"), lease=60)
+    monkeypatch.setattr(invoice_api, "cola_trabajos", cola)
+    yield cola
+    cola.cerrar()
+
+
+def _tomar_con_lease_perdido(cola, monkeypatch, resultado):
+    # Mientras el worker procesa, su lease vence y otro worker retoma el trabajo
+    job_id = cola.encolar("factura.pdf", b"%PDF")
+    asyncio.run(invoice_api.job_store.crear("factura.pdf", job_id=job_id))
+    trabajo = cola.tomar("worker-a")
+
+    async def procesar(*args):
+        cola.liberar(job_id, "worker-a")
+        assert cola.tomar("worker-b")["job_id"] == job_id
+        return resultado
+
+    monkeypatch.setattr(invoice_api, "process_and_send_pdf", procesar)
+    return trabajo
+
+
+def test_lease_perdido_no_publica_el_resultado(cola, monkeypatch):
+    trabajo = _tomar_con_lease_perdido(cola, monkeypatch, {"status": "received", "resultado": {}, "errores": {}})
+
+    asyncio.run(invoice_api.procesar_trabajo(trabajo, "worker-a"))
+
+    assert asyncio.run(invoice_api.job_store.obtener(trabajo["job_id"]))["status"] == "extracting"
+    assert cola.obtener(trabajo["job_id"])["status"] == "extracting"
+
+
+def test_lease_perdido_no_publica_el_error(cola, monkeypatch):
+    trabajo = _tomar_con_lease_perdido(cola, monkeypatch, {"status": "error", "message": "fallo"})
+
+    asyncio.run(invoice_api.procesar_trabajo(trabajo, "worker-a"))
+
+    assert asyncio.run(invoice_api.job_store.obtener(trabajo["job_id"]))["status"] == "extracting"
+    assert cola.obtener(trabajo["job_id"])["status"] == "extracting"
+
+
+def test_con_lease_se_publica_el_resultado(cola, monkeypatch):
+    job_id = cola.encolar("factura.pdf", b"%PDF")
+    asyncio.run(invoice_api.job_store.crear("factura.pdf", job_id=job_id))
+    trabajo = cola.tomar("worker-a")
+    resultado = {"status": "received", "resultado": {"pdf_total": "1.00"}, "errores": {}}
+
+    async def procesar(*args):
+        return resultado
+
+    monkeypatch.setattr(invoice_api, "process_and_send_pdf", procesar)
+    asyncio.run(invoice_api.procesar_trabajo(trabajo, "worker-a"))
+
+    assert asyncio.run(invoice_api.job_store.obtener(job_id))["status"] == "done"
+    assert cola.obtener(job_id)["status"] == "done"
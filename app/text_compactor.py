@@ -0,0 +1,95 @@
+import os
+import re
+
+# Sellos digitales, certificados y demas cadenas base64 (con letras y digitos)
+BLOB_RE = re.compile(r"(?=[A-Za-z0-9+/]*\d)(?=[A-Za-z0-9+/]*[A-Za-z])[A-Za-z0-9+/]{40,}={0,2}|[A-Za-z0-9+/]{16,}={1,2}")
+# Restos de la cadena original una vez quitados los sellos: "||1.1|...|"
+CADENA_ORIGINAL_RE = re.compile(r"\|\|[^\n]*?\|\|")
+CID_RE = re.compile(r"\(cid:\d+\)")
+ESPACIOS_RE = re.compile(r"[ \t ]+")
+BOILERPLATE_RE = re.compile(
+    r"este documento es una representaci[oó]n impresa de un cfdi"
+    r"|p[aá]gina\s*\d+\s*de\s*\d+"
+    r"|powered by [^\n]*",
+    re.IGNORECASE
+)
+# Etiquetas alrededor de las cuales estan los campos que se piden al modelo
+ETIQUETAS_RE = re.compile(
+    r"rfc|folio\s*fiscal|uuid|moneda|sub\s?-?total|total|iva|i\.v\.a|trasl|reten|impuesto"
+    r"|emisor|receptor|nombre|raz[oó]n\s*social|cliente",
+    re.IGNORECASE
+)
+# Lineas del encabezado que se conservan siempre (suele estar el nombre del emisor)
+LINEAS_ENCABEZADO = 8
+# Lineas antes y despues de cada etiqueta que se conservan al recortar
+VENTANA_ANTES = 1
+VENTANA_DESPUES = 2
+# Largo minimo para considerar una linea repetida como encabezado o pie de pagina
+LARGO_MINIMO_DUPLICADO = 15
+
+
+def estimar_tokens(texto):
+    """Estimacion gruesa de tokens (~4 caracteres por token)."""
+    return len(texto) // 4
+
+
+def _limpiar_lineas(texto):
+    texto = CID_RE.sub(" ", texto)
+    texto = BLOB_RE.sub(" ", texto)
+    texto = CADENA_ORIGINAL_RE.sub(" ", texto)
+    texto = BOILERPLATE_RE.sub(" ", texto)
+    lineas = []
+    vistas = set()
+    for linea in texto.split("\n"):
+        linea = ESPACIOS_RE.sub(" ", linea).strip(" |")
+        if not linea:
+            continue
+        # Encabezados y pies repetidos en cada pagina: solo la primera aparicion
+        if len(linea) >= LARGO_MINIMO_DUPLICADO:
+            if linea in vistas:
+                continue
+            vistas.add(linea)
+        lineas.append(linea)
+    return lineas
+
+
+def _regiones_con_etiquetas(lineas):
+    conservar = set(range(min(LINEAS_ENCABEZADO, len(lineas))))
+    for i, linea in enumerate(lineas):
+        if ETIQUETAS_RE.search(linea):
+            conservar.update(range(max(0, i - VENTANA_ANTES), min(len(lineas), i + VENTANA_DESPUES + 1)))
+    return [linea for i, linea in enumerate(lineas) if i in conservar]
+
+
+def compactar_texto(texto, max_tokens=None):
+    """
+    Reduce el texto de la factura antes de enviarlo al modelo.
+
+    Colapsa espacios, quita sellos digitales, cadena original, leyendas
+    legales y lineas repetidas entre paginas. Si aun excede el presupuesto,
+    conserva solo el encabezado y las lineas cercanas a las etiquetas de los
+    campos y, como ultimo recurso, corta el texto al presupuesto.
+
+    Args:
+        texto (str): Texto de la factura
+        max_tokens (int): Presupuesto de tokens del texto (PROMPT_MAX_TOKENS, por defecto 2000)
+
+    Returns:
+        tuple: (texto compactado, dict con tokens_originales, tokens_finales y tokens_eliminados)
+    """
+    max_tokens = max_tokens or int(os.getenv("PROMPT_MAX_TOKENS", "2000"))
+    lineas = _limpiar_lineas(texto)
+    compacto = "\n".join(lineas)
+    if estimar_tokens(compacto) > max_tokens:
+        compacto = "\n".join(_regiones_con_etiquetas(lineas))
+    if estimar_tokens(compacto) > max_tokens:
+        corte = compacto[:max_tokens * 4]
+        compacto = corte.rsplit("\n", 1)[0] if "\n" in corte else corte
+
+    originales = estimar_tokens(texto)
+    finales = estimar_tokens(compacto)
+    return compacto, {
+        "tokens_originales": originales,
+        "tokens_finales": finales,
+        "tokens_eliminados": originales - finales
+    }
@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+# Estados de un trabajo en la cola; "done" y "failed" son finales
+ESTADOS_COLA = ("queued", "extracting", "awaiting_llm", "done", "failed")
+ESTADOS_EN_PROCESO = ("extracting", "awaiting_llm")
+
+
+def id_worker():
+    """
+    Identificador unico del worker: host, pid y un sufijo aleatorio por instancia.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class ColaTrabajos:
+    def __init__(self, path="queue.db", lease=None, max_intentos=None):
+        """
+        Cola de trabajos persistente en SQLite (modo WAL).
+
+        Guarda el PDF, el estado, los intentos y el resultado de cada factura.
+        Los workers toman trabajos con un lease que renuevan con latidos; si un
+        proceso muere, su lease vence y el trabajo vuelve a la cola, asi que un
+        reinicio continua donde se quedo en lugar de reprocesar todo. Varios
+        procesos pueden compartir el mismo archivo. Los metodos bloquean hasta
+        que SQLite responde: desde codigo asincrono se llaman con asyncio.to_thread.
+
+        Args:
+            path (str): Ruta del archivo SQLite
+            lease (float): Segundos que un worker retiene un trabajo sin latido
+                (JOB_LEASE, por defecto 60)
+            max_intentos (int): Intentos antes de marcar un trabajo como "failed"
+                (JOB_MAX_INTENTOS, por defecto 3)
+        """
+        self.lease = lease or float(os.getenv("JOB_LEASE", "60"))
+        self.max_intentos = max_intentos or int(os.getenv("JOB_MAX_INTENTOS", "3"))
+        self._lock = threading.Lock()
+        # Sin transacciones implicitas: tomar() usa BEGIN IMMEDIATE para que dos procesos no tomen el mismo trabajo
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cola (
+                job_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                status TEXT NOT NULL,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_hasta REAL,
+                pdf BLOB,
+                xml BLOB,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cola_status ON cola (status, created_at)")
+
+    def encolar(self, filename, pdf, xml=None, job_id=None):
+        """
+        Agrega una factura a la cola en estado "queued".
+
+        Args:
+            filename (str): Nombre del archivo
+            pdf (bytes): Contenido del PDF (vacio si solo hay XML)
+            xml (bytes): Contenido del XML del CFDI (opcional)
+            job_id (str): Identificador a usar (por defecto, uno nuevo)
+
+        Returns:
+            str: job_id del trabajo
+        """
+        job_id = job_id or uuid.uuid4().hex
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO cola (job_id, filename, status, pdf, xml, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, filename, pdf, xml, ahora, ahora)
+            )
+        return job_id
+
+    def tomar(self, worker):
+        """
+        Toma el trabajo mas antiguo en cola y lo pasa a "extracting" con un lease.
+
+        Antes devuelve a la cola los trabajos cuyo lease vencio (o los marca
+        como "failed" si ya agotaron sus intentos).
+
+        Args:
+            worker (str): Identificador del worker (ver id_worker)
+
+        Returns:
+            dict: Trabajo con job_id, filename, attempts, pdf y xml, o None si la cola esta vacia
+        """
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._recuperar_vencidos(ahora)
+                fila = self._conn.execute(
+                    "SELECT job_id, filename, intentos, pdf, xml FROM cola "
+                    "WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if fila is not None:
+                    self._conn.execute(
+                        "UPDATE cola SET status = 'extracting', intentos = intentos + 1, worker = ?, "
+                        "lease_hasta = ?, updated_at = ? WHERE job_id = ?",
+                        (worker, ahora + self.lease, ahora, fila[0])
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if fila is None:
+            return None
+        job_id, filename, intentos, pdf, xml = fila
+        return {"job_id": job_id, "filename": filename, "attempts": intentos + 1, "pdf": pdf or b"", "xml": xml}
+
+    def _recuperar_vencidos(self, ahora):
+        self._conn.execute(
+            "UPDATE cola SET status = 'failed', error = 'Lease vencido sin terminar tras agotar los intentos', "
+            "worker = NULL, lease_hasta = NULL, pdf = NULL, xml = NULL, updated_at = ? "
+            "WHERE status IN (?, ?) AND lease_hasta < ? AND intentos >= ?",
+            (ahora, *ESTADOS_EN_PROCESO, ahora, self.max_intentos)
+        )
+        self._conn.execute(
+            "UPDATE cola SET status = 'queued', worker = NULL, lease_hasta = NULL, updated_at = ? "
+            "WHERE status IN (?, ?) AND lease_hasta < ?",
+            (ahora, *ESTADOS_EN_PROCESO, ahora)
+        )
+
+    def _actualizar_propio(self, job_id, worker, asignaciones, valores):
+        # Solo el worker que tiene el lease puede modificar el trabajo
+        ahora = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE cola SET {asignaciones}, updated_at = ? "
+                f"WHERE job_id = ? AND worker = ? AND status IN (?, ?)",
+                (*valores, ahora, job_id, worker, *ESTADOS_EN_PROCESO)
+            )
+        return cursor.rowcount == 1
+
+    def latido(self, job_id, worker):
+        """
+        Renueva el lease de un trabajo.
+
+        Returns:
+            bool: False si el worker ya no tiene el trabajo (su lease vencio y lo tomo otro)
+        """
+        return self._actualizar_propio(job_id, worker, "lease_hasta = ?", (time.time() + self.lease,))
+
+    def marcar(self, job_id, worker, status):
+        """
+        Cambia la etapa de un trabajo en proceso ("extracting" o "awaiting_llm") y renueva su lease.
+
+        Returns:
+            bool: False si el worker ya no tiene el trabajo
+        """
+        if status not in ESTADOS_EN_PROCESO:
+            raise ValueError(f"Estado en proceso desconocido: {status}")
+        return self._actualizar_propio(
+            job_id, worker, "status = ?, lease_hasta = ?", (status, time.time() + self.lease)
+        )
+
+    def completar(self, job_id, worker, result):
+        """
+        Marca un trabajo como "done" con su resultado y libera el PDF guardado.
+
+        Returns:
+            bool: False si el worker ya no tiene el trabajo
+        """
+        return self._actualizar_propio(
+            job_id, worker,
+            "status = 'done', result = ?, error = NULL, worker = NULL, lease_hasta = NULL, pdf = NULL, xml = NULL",
+            (json.dumps(result, ensure_ascii=False),)
+        )
+
+    def fallar(self, job_id, worker, error, result=None):
+        """
+        Registra un intento fallido: el trabajo vuelve a la cola, o queda en
+        "failed" si ya agoto sus intentos.
+
+        Args:
+            job_id (str): Identificador del trabajo
+            worker (str): Identificador del worker
+            error (str): Descripcion del error
+            result (dict): Ultima respuesta obtenida, si la hay
+
+        Returns:
+            str: Nuevo estado ("queued" o "failed"), o None si el worker ya no tiene el trabajo
+        """
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT intentos FROM cola WHERE job_id = ? AND worker = ?", (job_id, worker)
+            ).fetchone()
+        if fila is None:
+            return None
+        resultado = json.dumps(result, ensure_ascii=False) if result is not None else None
+        if fila[0] >= self.max_intentos:
+            asignaciones = "status = 'failed', error = ?, result = ?, worker = NULL, lease_hasta = NULL, pdf = NULL, xml = NULL"
+            estado = "failed"
+        else:
+            asignaciones = "status = 'queued', error = ?, result = ?, worker = NULL, lease_hasta = NULL"
+            estado = "queued"
+        return estado if self._actualizar_propio(job_id, worker, asignaciones, (error, resultado)) else None
+
+    def liberar(self, job_id, worker):
+        """
+        Devuelve un trabajo a la cola sin contar el intento (p. ej. al apagar el proceso).
+
+        Returns:
+            bool: False si el worker ya no tiene el trabajo
+        """
+        return self._actualizar_propio(
+            job_id, worker, "status = 'queued', intentos = intentos - 1, worker = NULL, lease_hasta = NULL", ()
+        )
+
+    def obtener(self, job_id):
+        """
+        Devuelve el trabajo (sin el PDF) o None si no existe.
+        """
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT job_id, filename, status, intentos, result, error, created_at, updated_at "
+                "FROM cola WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if fila is None:
+            return None
+        job_id, filename, status, intentos, result, error, created_at, updated_at = fila
+        return {
+            "job_id": job_id,
+            "filename": filename,
+            "status": status,
+            "attempts": intentos,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "result": json.loads(result) if result else None,
+            "error": error
+        }
+
+    def contar(self):
+        """
+        Numero de trabajos por estado.
+
+        Returns:
+            dict: Conteo de cada estado de ESTADOS_COLA
+        """
+        with self._lock:
+            filas = self._conn.execute("SELECT status, COUNT(*) FROM cola GROUP BY status").fetchall()
+        conteo = dict.fromkeys(ESTADOS_COLA, 0)
+        conteo.update(filas)
+        return conteo
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Encola los PDFs y XMLs de uno o varios directorios para procesarlos en segundo plano"
+    )
+    parser.add_argument("db", help="Archivo SQLite de la cola (el mismo JOB_QUEUE_PATH de la API)")
+    parser.add_argument("dirs", nargs="*", help="Directorios con facturas a encolar (recursivo)")
+    args = parser.parse_args()
+
+    cola = ColaTrabajos(args.db)
+    total = 0
+    for directorio in args.dirs:
+        for raiz, _, archivos in os.walk(directorio):
+            # PDF y XML con el mismo nombre base son una sola factura
+            xmls = {os.path.splitext(n)[0].lower(): n for n in archivos if n.lower().endswith(".xml")}
+            pdfs = {os.path.splitext(n)[0].lower() for n in archivos if n.lower().endswith(".pdf")}
+            for nombre in sorted(archivos):
+                base, extension = os.path.splitext(nombre)
+                extension = extension.lower()
+                if extension == ".xml" and base.lower() in pdfs:
+                    continue  # se encola junto con su PDF
+                if extension not in (".pdf", ".xml"):
+                    continue
+                with open(os.path.join(raiz, nombre), "rb") as f:
+                    contenido = f.read()
+                if extension == ".xml":
+                    cola.encolar(nombre, b"", contenido)
+                else:
+                    xml = None
+                    if base.lower() in xmls:
+                        with open(os.path.join(raiz, xmls[base.lower()]), "rb") as f:
+                            xml = f.read()
+                    cola.encolar(nombre, contenido, xml)
+                total += 1
+    if args.dirs:
+        print(f"{total} facturas encoladas")
+    print(json.dumps(cola.contar()))
+
+
+if __name__ == "__main__":
+    main()